@@ -0,0 +1,149 @@
+# Benchmark dell'archiviazione delle prenotazioni al crescere dello storico.
+# Per ogni dimensione dello storico (prenotazioni concluse o cancellate) crea un database con 500 stanze, lo storico
+# e 2000 prenotazioni future, poi misura caricamento dell'indice di occupazione, ricerca di disponibilità (senza cache),
+# query di sovrapposizione su Booking e pagina dello storico di un utente, prima e dopo l'archiviazione.
+# Senza archiviazione i tempi crescono con lo storico; dopo l'archiviazione le tabelle attive contengono solo le prenotazioni
+# future e i tempi restano costanti, mentre lo storico dell'utente resta identico.
+# Ogni dimensione gira in un processo separato, su un database nuovo.
+#
+# Uso: python benchmarks/bench_archive.py [dimensioni dello storico, ad esempio 10000 100000 1000000]
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+SIZES = [int(size) for size in sys.argv[1:] if size != '--worker'] or [10000, 100000, 1000000]
+UPCOMING = 2000
+USERS = 1000
+CHUNK = 50000
+SEARCHES = 200
+QUERIES = 50
+
+
+# Inserisce le righe a blocchi con inserimenti multipli, confermando ogni blocco
+def bulk_insert(fa, model, rows):
+    for start in range(0, len(rows), CHUNK):
+        fa.db.session.execute(fa.insert(model), rows[start:start + CHUNK])
+        fa.db.session.commit()
+
+
+# Crea utenti, storico e prenotazioni future. Le prenotazioni di ogni stanza non si sovrappongono:
+# lo storico va a ritroso da 60 giorni fa, le prenotazioni future occupano parte dei prossimi 60 giorni.
+# Come create_booking vengono salvati prezzi addebitati, notti occupate e riepilogo giornaliero (senza tariffe: prezzo base).
+def build_history(fa, size, today):
+    rooms = fa.Room.query.order_by(fa.Room.id).all()
+    user_ids = [f'bench-user-{index}' for index in range(USERS)]
+    bulk_insert(fa, fa.User, [
+        {"id": user_id, "username": user_id, "email": f'{user_id}@example.com', "password": 'benchmark', "first_name": 'Bench', "surname": user_id}
+        for user_id in user_ids
+    ])
+
+    stays = []
+    for index in range(size):
+        check_out = today - timedelta(days=60 + 3 * (index // len(rooms)))
+        stays.append((check_out - timedelta(days=2), check_out, 'canceled' if index % 10 == 0 else 'confirmed'))
+    for index in range(UPCOMING):
+        check_in = today + timedelta(days=1 + 15 * (index // len(rooms)) + index % 12)
+        stays.append((check_in, check_in + timedelta(days=2), 'confirmed'))
+
+    bookings, booking_rooms, room_nights, confirmed = [], [], [], []
+    for index, (check_in, check_out, status) in enumerate(stays):
+        booking_id = index + 1
+        room = rooms[index % len(rooms)]
+        created_at = datetime.combine(check_in - timedelta(days=30), datetime.min.time())
+        prices = [[room.price] * (check_out - check_in).days]
+        bookings.append({
+            "id": booking_id, "user_id": user_ids[index % USERS], "property_id": room.property_id, "check_in": check_in,
+            "check_out": check_out, "guests": 2, "status": status, "total_price": fa.stay_total(prices),
+            "created_at": created_at, "updated_at": created_at
+        })
+        booking_rooms.append({"booking_id": booking_id, "room_id": room.id, "nightly_prices": fa.encode_nightly_prices(prices[0])})
+        if status == 'confirmed':
+            confirmed.append((check_in, check_out, [room], prices))
+            room_nights += [{"room_id": room.id, "night": night, "booking_id": booking_id} for night in fa.stay_nights(check_in, check_out)]
+    bulk_insert(fa, fa.Booking, bookings)
+    bulk_insert(fa, fa.BookingRooms, booking_rooms)
+    bulk_insert(fa, fa.RoomNight, room_nights)
+    fa.update_daily_occupancy(added=confirmed)
+    fa.db.session.commit()
+    return user_ids[1]
+
+
+def measure(fa, client, user_id, today):
+    rng = random.Random(1)
+    results = {"active": fa.Booking.query.count()}
+
+    start = time.perf_counter()
+    fa.occupancy_index.load()
+    results["load"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    for _ in range(SEARCHES):
+        check_in = today + timedelta(days=rng.randrange(1, 30))
+        response = client.post('/rooms_per_type_and_suggestion', json={
+            'check_in': check_in.strftime('%Y%m%d'), 'check_out': (check_in + timedelta(days=3)).strftime('%Y%m%d'), 'guests': 4, 'rooms': 2
+        })
+        assert response.status_code == 200
+    results["search"] = (time.perf_counter() - start) * 1000 / SEARCHES
+
+    start = time.perf_counter()
+    for _ in range(QUERIES):
+        check_in = today + timedelta(days=rng.randrange(1, 30))
+        fa.db.session.query(fa.Booking.id).filter(
+            fa.Booking.check_in < check_in + timedelta(days=3), fa.Booking.check_out > check_in, fa.Booking.status != 'canceled'
+        ).all()
+    results["overlap"] = (time.perf_counter() - start) * 1000 / QUERIES
+
+    start = time.perf_counter()
+    for _ in range(QUERIES):
+        page = fa.get_user_bookings_page(user_id, 20)
+    results["history"] = (time.perf_counter() - start) * 1000 / QUERIES
+    results["history_ids"] = [booking["id"] for booking in page["bookings"]]
+    return results
+
+
+def run_worker(size):
+    from common import setup_app
+
+    fa = setup_app(env={
+        'ROOM_STANDARD_QUANTITY': 250, 'ROOM_SUPERIOR_QUANTITY': 175, 'ROOM_SUITE_QUANTITY': 75,
+        'SUGGESTION_CACHE_SIZE': 0, 'INVENTORY_SYNC_SECONDS': 0,
+    })
+    today = datetime.utcnow().date()
+    client = fa.app.test_client()
+    with fa.app.app_context():
+        fa.run_migrations()
+        user_id = build_history(fa, size, today)
+        before = measure(fa, client, user_id, today)
+
+        start = time.perf_counter()
+        archived = fa.archive_bookings()
+        archive_ms = (time.perf_counter() - start) * 1000
+
+        after = measure(fa, client, user_id, today)
+    assert before.pop("history_ids") == after.pop("history_ids")
+    print(json.dumps({"before": before, "after": after, "archived": archived, "archive_ms": archive_ms}))
+
+
+def main():
+    print(f"500 stanze, {UPCOMING} prenotazioni future; tempi medi in millisecondi")
+    print(f"{'storico':>9} {'archiviazione':>13} {'righe attive':>12} {'carica indice':>13} {'ricerca':>8} {'sovrapposizione':>15} {'pagina storico':>14}")
+    for size in SIZES:
+        output = subprocess.run([sys.executable, __file__, '--worker', str(size)], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        for label, phase in (('prima', result["before"]), ('dopo', result["after"])):
+            print(f"{size:>9} {label:>13} {phase['active']:>12} {phase['load']:>13.1f} {phase['search']:>8.2f} "
+                  f"{phase['overlap']:>15.2f} {phase['history']:>14.2f}")
+        print(f"{'':>9} {result['archived']} prenotazioni archiviate in {result['archive_ms'] / 1000:.1f}s "
+              f"({result['archived'] / max(result['archive_ms'] / 1000, 1e-9):.0f} al secondo)")
+
+
+if __name__ == '__main__':
+    if '--worker' in sys.argv:
+        run_worker(int(sys.argv[-1]))
+    else:
+        main()
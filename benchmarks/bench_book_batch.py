@@ -0,0 +1,60 @@
+# Confronta le prenotazioni al secondo ottenute con una chiamata a /book per ogni soggiorno
+# e con una sola chiamata a /book_batch per un gruppo di soggiorni (il caso tipico dei tour operator).
+# Il throughput è misurato in prenotazioni al secondo, non in richieste al secondo.
+#
+# Uso: python benchmarks/bench_book_batch.py [soggiorni_per_gruppo]
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+from common import setup_app, create_user
+
+GROUP_SIZE = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+GROUPS = 5
+
+
+# Soggiorni di un gruppo su date diverse, così nessuno fallisce per mancanza di stanze
+def group_items(rng, group):
+    items = []
+    for i in range(GROUP_SIZE):
+        check_in = date(2030, 1, 1) + timedelta(days=group * GROUP_SIZE + i)
+        items.append({
+            'check_in': check_in.strftime('%Y%m%d'),
+            'check_out': (check_in + timedelta(days=rng.randint(1, 3))).strftime('%Y%m%d'),
+            'guests': 2, 'room_types': [rng.choice(['standard', 'superior', 'suite'])]
+        })
+    return items
+
+
+def main():
+    fa = setup_app(env={'SUGGESTION_CACHE_SIZE': 0})
+    with fa.app.app_context():
+        headers = {'Authorization': f'Bearer {fa.create_access_token(identity=create_user(fa, "operator"))}'}
+    client = fa.app.test_client()
+    rng = random.Random(7)
+
+    print(f"{GROUPS} gruppi da {GROUP_SIZE} soggiorni")
+    print(f"{'modalità':>12} {'prenotazioni':>13} {'secondi':>8} {'prenotazioni/s':>15}")
+
+    # Una richiesta /book per soggiorno
+    booked = 0
+    start = time.perf_counter()
+    for group in range(GROUPS):
+        for item in group_items(rng, group):
+            booked += client.post('/book', headers=headers, json=item).status_code == 201
+    elapsed = time.perf_counter() - start
+    print(f"{'/book':>12} {booked:>13} {elapsed:>8.2f} {booked / elapsed:>15.1f}")
+
+    # Una richiesta /book_batch per gruppo, su date successive per non contendersi le stesse stanze
+    booked = 0
+    start = time.perf_counter()
+    for group in range(GROUPS, 2 * GROUPS):
+        response = client.post('/book_batch', headers=headers, json={'bookings': group_items(rng, group)})
+        booked += response.get_json()['booked']
+    elapsed = time.perf_counter() - start
+    print(f"{'/book_batch':>12} {booked:>13} {elapsed:>8.2f} {booked / elapsed:>15.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# Misura il tempo di avvio a freddo dell'applicazione e il tempo della prima richiesta,
+# con la fase di inizializzazione (schema, stanze, catalogo e indice di occupazione) eseguita prima di servire
+# e senza, cioè con il caricamento dei dati in memoria rimandato alla prima ricerca.
+# Ogni misura gira in un processo separato, per partire davvero da un interprete vuoto.
+#
+# Uso: python benchmarks/bench_cold_start.py [prenotazioni]
+import json
+import os
+import subprocess
+import sys
+import time
+
+BOOKINGS = int(sys.argv[-1]) if len(sys.argv) > 1 and sys.argv[1] != '--worker' else 20000
+SEARCH = {'check_in': '20300110', 'check_out': '20300113', 'guests': 3, 'rooms': 2}
+SECOND_SEARCH = {'check_in': '20300210', 'check_out': '20300213', 'guests': 3, 'rooms': 2}
+
+
+def measure(initialize):
+    from common import ROOT_DIR
+    sys.path.insert(0, ROOT_DIR)
+
+    start = time.perf_counter()
+    import flask_app
+    imported = time.perf_counter()
+    app = flask_app.create_app()
+    created = time.perf_counter()
+    if initialize:
+        flask_app.initialize(app)
+    initialized = time.perf_counter()
+
+    client = app.test_client()
+    assert client.post('/rooms_per_type_and_suggestion', json=SEARCH).status_code == 200
+    first = time.perf_counter()
+    assert client.post('/rooms_per_type_and_suggestion', json=SECOND_SEARCH).status_code == 200
+    second = time.perf_counter()
+
+    print(json.dumps({
+        'import': (imported - start) * 1000,
+        'create_app': (created - imported) * 1000,
+        'initialize': (initialized - created) * 1000,
+        'first_request': (first - initialized) * 1000,
+        'second_request': (second - first) * 1000,
+        'time_to_first_request': (first - start) * 1000,
+    }))
+
+
+def main():
+    from common import setup_app, create_user, add_bookings
+
+    fa = setup_app()
+    with fa.app.app_context():
+        add_bookings(fa, create_user(fa, 'history'), BOOKINGS)
+    env = dict(os.environ, SUGGESTION_CACHE_SIZE='0')
+
+    print(f"{BOOKINGS} prenotazioni nel database, tempi in millisecondi")
+    columns = ['import', 'create_app', 'initialize', 'first_request', 'second_request', 'time_to_first_request']
+    print(f"{'modalità':>22} " + " ".join(f"{column:>21}" for column in columns))
+    for label, flag in [('con inizializzazione', '1'), ('senza inizializzazione', '0')]:
+        output = subprocess.run([sys.executable, __file__, '--worker', flag], env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{label:>22} " + " ".join(f"{result[column]:>21.1f}" for column in columns))
+
+
+if __name__ == '__main__':
+    if '--worker' in sys.argv:
+        measure(sys.argv[-1] == '1')
+    else:
+        main()
@@ -0,0 +1,148 @@
+# Stress test di create_booking con più thread, e poi con più processi worker, che prenotano in parallelo le stesse date.
+# Verifica che nessuna stanza venga assegnata a due prenotazioni sovrapposte e riporta le prenotazioni al secondo.
+# I thread condividono l'indice di occupazione dello stesso processo; i processi lavorano sullo stesso database con indici
+# separati, come i worker di gunicorn, e scoprono le prenotazioni degli altri solo tramite i conflitti sulle notti occupate.
+# Con SQLite le scritture sono serializzate: il throughput non cresce con il numero di thread o processi,
+# e con molti writer concorrenti cala per l'attesa del lock del database e per i tentativi ripetuti.
+#
+# Uso: python benchmarks/bench_concurrent_booking.py [richieste_per_thread]
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import date, timedelta
+
+from common import setup_app, create_user
+
+THREAD_COUNTS = [1, 2, 4, 8]
+PROCESS_COUNTS = [1, 2, 4, 8]
+REQUESTS_PER_THREAD = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1] != '--worker' else 40
+# Secondi concessi ai processi worker per avviarsi prima di iniziare a prenotare tutti insieme
+PROCESS_START_DELAY = 5
+# Finestra di date ristretta per forzare la contesa sulle stesse stanze
+WINDOW_START = date(2030, 3, 1)
+WINDOW_DAYS = 20
+
+
+def worker(fa, user_id, seed, results):
+    rng = random.Random(seed)
+    booked = failed = 0
+    with fa.app.app_context():
+        for _ in range(REQUESTS_PER_THREAD):
+            check_in = WINDOW_START + timedelta(days=rng.randrange(WINDOW_DAYS))
+            check_out = check_in + timedelta(days=rng.randint(1, 4))
+            room_type = rng.choice(['standard', 'superior', 'suite'])
+            try:
+                fa.create_booking(user_id, check_in.strftime('%Y%m%d'), check_out.strftime('%Y%m%d'), 2, [room_type])
+                booked += 1
+            except Exception:
+                # Stanze esaurite per le date richieste o tentativi esauriti
+                failed += 1
+        fa.db.session.remove()
+    results.append((booked, failed))
+
+
+# Conta le coppie di prenotazioni confermate e sovrapposte che condividono una stanza
+def count_double_bookings(fa):
+    Booking, BookingRooms = fa.Booking, fa.BookingRooms
+    first_booking = fa.db.aliased(Booking)
+    second_booking = fa.db.aliased(Booking)
+    first_room = fa.db.aliased(BookingRooms)
+    second_room = fa.db.aliased(BookingRooms)
+    return fa.db.session.query(first_room.id).join(
+        second_room, (second_room.room_id == first_room.room_id) & (second_room.booking_id > first_room.booking_id)
+    ).join(first_booking, first_booking.id == first_room.booking_id
+    ).join(second_booking, second_booking.id == second_room.booking_id
+    ).filter(
+        first_booking.status != 'canceled', second_booking.status != 'canceled',
+        first_booking.check_in < second_booking.check_out, second_booking.check_in < first_booking.check_out
+    ).count()
+
+
+# Svuota l'inventario, così ogni giro riparte dalle stesse condizioni
+def reset_bookings(fa):
+    with fa.app.app_context():
+        fa.RoomNight.query.delete()
+        fa.BookingRooms.query.delete()
+        fa.Booking.query.delete()
+        fa.DailyOccupancy.query.delete()
+        fa.db.session.commit()
+        fa.occupancy_index.invalidate()
+
+
+# Processo worker: attende l'istante di partenza comune, prenota come un thread e riporta l'esito in JSON
+def run_worker(db_path, seed, start_at):
+    fa = setup_app(db_path=db_path)
+    with fa.app.app_context():
+        fa.occupancy_index.load()
+        user_id = create_user(fa, f'process-{start_at}-{seed}')
+    time.sleep(max(0.0, start_at - time.time()))
+    results = []
+    worker(fa, user_id, seed, results)
+    print(json.dumps({"booked": results[0][0], "failed": results[0][1], "finished_at": time.time()}))
+
+
+# Avvia i processi worker sullo stesso database e restituisce (prenotate, rifiutate, secondi trascorsi)
+def run_processes(db_path, processes):
+    start_at = time.time() + PROCESS_START_DELAY
+    pool = [
+        subprocess.Popen([sys.executable, __file__, '--worker', db_path, str(seed), str(start_at)],
+                         cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.PIPE, text=True)
+        for seed in range(processes)
+    ]
+    results = []
+    for process in pool:
+        output, _ = process.communicate()
+        if process.returncode:
+            raise SystemExit("Un processo worker è terminato con errore.")
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    elapsed = max(result["finished_at"] for result in results) - start_at
+    return sum(result["booked"] for result in results), sum(result["failed"] for result in results), elapsed
+
+
+def main():
+    fa = setup_app()
+    print(f"{'thread':>6} {'prenotate':>10} {'rifiutate':>10} {'doppie':>7} {'pren./s':>9}")
+    for threads in THREAD_COUNTS:
+        reset_bookings(fa)
+        with fa.app.app_context():
+            user_ids = [create_user(fa, f'stress{threads}-{i}') for i in range(threads)]
+
+        results = []
+        pool = [threading.Thread(target=worker, args=(fa, user_ids[i], i, results)) for i in range(threads)]
+        start = time.perf_counter()
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        booked = sum(result[0] for result in results)
+        failed = sum(result[1] for result in results)
+        with fa.app.app_context():
+            double_bookings = count_double_bookings(fa)
+        print(f"{threads:>6} {booked:>10} {failed:>10} {double_bookings:>7} {booked / elapsed:>9.1f}")
+        if double_bookings:
+            raise SystemExit("Rilevate stanze assegnate a prenotazioni sovrapposte.")
+
+    db_path = fa.app.config['SQLALCHEMY_DATABASE_URI'].removeprefix('sqlite:///')
+    print(f"{'processi':>8} {'prenotate':>10} {'rifiutate':>10} {'doppie':>7} {'pren./s':>9}")
+    for processes in PROCESS_COUNTS:
+        reset_bookings(fa)
+        booked, failed, elapsed = run_processes(db_path, processes)
+        with fa.app.app_context():
+            double_bookings = count_double_bookings(fa)
+        print(f"{processes:>8} {booked:>10} {failed:>10} {double_bookings:>7} {booked / elapsed:>9.1f}")
+        if double_bookings:
+            raise SystemExit("Rilevate stanze assegnate a prenotazioni sovrapposte.")
+    print("Nessuna doppia prenotazione.")
+
+
+if __name__ == '__main__':
+    if '--worker' in sys.argv:
+        run_worker(sys.argv[-3], int(sys.argv[-2]), float(sys.argv[-1]))
+    else:
+        main()
@@ -0,0 +1,46 @@
+# Micro-benchmark della codifica JSON di una risposta di disponibilità con 500 stanze.
+# Confronta il serializzatore predefinito di Flask (json) e quello basato su orjson, costruendo i dizionari
+# delle stanze a ogni risposta (come in passato) oppure riusando i dizionari già costruiti dal catalogo.
+# In entrambi i casi la codifica in JSON viene eseguita per intero a ogni risposta: si misura il risparmio della sola costruzione.
+#
+# Uso: python benchmarks/bench_json_encoding.py
+from common import setup_app, time_ms
+
+REPEAT = 200
+
+
+# Risposta di disponibilità con dizionari delle stanze costruiti a ogni chiamata
+def fresh_payload(rooms):
+    room_dicts = [{
+        "id": room.id,
+        "number": room.number,
+        "price": room.price,
+        "capacity": room.capacity,
+        "room_type": room.room_type
+    } for room in rooms]
+    return {"available_rooms": room_dicts, "selected_combination": room_dicts[:3], "total_cost_selected_combination": 450.0}
+
+
+# Risposta di disponibilità con i dizionari delle stanze riusati dal catalogo
+def cached_payload(fa, rooms):
+    return {"available_rooms": fa.serialize_rooms(rooms, 'suggestion'),
+            "selected_combination": fa.serialize_rooms(rooms[:3], 'suggestion'), "total_cost_selected_combination": 450.0}
+
+
+def main():
+    fa = setup_app(env={'ROOM_STANDARD_QUANTITY': 250, 'ROOM_SUPERIOR_QUANTITY': 175, 'ROOM_SUITE_QUANTITY': 75})
+    with fa.app.app_context():
+        rooms = list(fa.room_catalog.all())
+    print(f"risposta con {len(rooms)} stanze, media su {REPEAT} codifiche")
+    print(f"{'serializzatore':>14} {'stanze':>10} {'ms':>8} {'byte':>8}")
+    for name, provider_class in fa.JSON_PROVIDERS.items():
+        provider = provider_class(fa.app)
+        with fa.app.test_request_context():
+            for label, build in (('costruite', lambda: fresh_payload(rooms)), ('riusate', lambda: cached_payload(fa, rooms))):
+                size = len(provider.response(build()).get_data())
+                elapsed = time_ms(lambda: provider.response(build()).get_data(), repeat=REPEAT)
+                print(f"{name:>14} {label:>10} {elapsed:>8.3f} {size:>8}")
+
+
+if __name__ == '__main__':
+    main()
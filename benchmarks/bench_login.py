@@ -0,0 +1,65 @@
+# Benchmark dei login al secondo al variare del numero di thread del pool di hashing.
+# I client concorrenti sono più dei thread di hashing, così si misura la capacità del pool e non quella dei client.
+#
+# Uso: python benchmarks/bench_login.py [iterazioni_pbkdf2]
+import sys
+import threading
+import time
+
+from common import setup_app
+
+ITERATIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+WORKER_COUNTS = [1, 2, 4, 8]
+CLIENTS = 16
+LOGINS_PER_CLIENT = 8
+
+
+def run_clients(fa, include_bookings):
+    results = {"ok": 0, "rejected": 0}
+    lock = threading.Lock()
+
+    def client(index):
+        test_client = fa.app.test_client()
+        for _ in range(LOGINS_PER_CLIENT):
+            response = test_client.post('/login', json={
+                'identifier': f'login{index}', 'password': 'password', 'include_bookings': include_bookings
+            })
+            with lock:
+                results["ok" if response.status_code == 200 else "rejected"] += 1
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(CLIENTS)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+
+def main():
+    method = f'pbkdf2:sha256:{ITERATIONS}'
+    fa = setup_app(env={'PASSWORD_HASH_METHOD': method})
+    with fa.app.app_context():
+        password_hash = fa.generate_password_hash('password', method)
+        fa.db.session.add_all([
+            fa.User(username=f'login{index}', email=f'login{index}@example.com', password=password_hash,
+                    first_name='Bench', surname=str(index))
+            for index in range(CLIENTS)
+        ])
+        fa.db.session.commit()
+
+    print(f"metodo {method}, {CLIENTS} client concorrenti")
+    print(f"{'worker':>6} {'login/s':>9} {'rifiutati':>10}")
+    for workers in WORKER_COUNTS:
+        fa.app.extensions['hotel']['password_hasher'] = fa.PasswordHasher(method, workers, max_pending=CLIENTS, timeout=60)
+        results, elapsed = run_clients(fa, include_bookings=False)
+        print(f"{workers:>6} {results['ok'] / elapsed:>9.1f} {results['rejected']:>10}")
+
+    # Con una coda più corta dei client concorrenti le richieste in eccesso vengono rifiutate subito con 503
+    fa.app.extensions['hotel']['password_hasher'] = fa.PasswordHasher(method, 2, max_pending=4, timeout=60)
+    results, elapsed = run_clients(fa, include_bookings=False)
+    print(f"coda limitata a 4: {results['ok']} login riusciti, {results['rejected']} rifiutati con 503 in {elapsed:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+# Benchmark di sovraccarico: molti client anonimi cercano stanze senza pause mentre pochi utenti autenticati prenotano.
+# Confronta latenza (p50/p99) e richieste servite con il controllo di ammissione disattivato e attivato:
+# senza controllo la latenza cresce con il numero di client, con il controllo le richieste in eccesso vengono scartate
+# con 503 e Retry-After e la latenza di quelle servite, in particolare delle prenotazioni, resta limitata.
+#
+# Uso: python benchmarks/bench_overload.py [client_di_ricerca] [secondi]
+import random
+import sys
+import threading
+import time
+from datetime import date, timedelta
+
+from common import setup_app, create_user
+
+SEARCH_CLIENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 128
+DURATION = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+BOOKING_CLIENTS = 4
+START_DATE = date(2030, 1, 1)
+
+
+# Percentile di una lista di latenze in millisecondi
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run_scenario(fa, tokens):
+    results = {operation: {"latencies": [], "ok": 0, "rejected": 0} for operation in ('search', 'book')}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + DURATION
+
+    def record(operation, response, elapsed_ms):
+        with lock:
+            result = results[operation]
+            result["latencies"].append(elapsed_ms)
+            if response.status_code in (429, 503):
+                result["rejected"] += 1
+            else:
+                result["ok"] += 1
+
+    def client(operation, seed, token=None):
+        rng = random.Random(seed)
+        test_client = fa.app.test_client()
+        while time.perf_counter() < deadline:
+            check_in = START_DATE + timedelta(days=rng.randrange(3 * 365))
+            dates = {'check_in': check_in.strftime('%Y%m%d'), 'check_out': (check_in + timedelta(days=rng.randint(1, 5))).strftime('%Y%m%d')}
+            start = time.perf_counter()
+            if operation == 'search':
+                response = test_client.post('/rooms_per_type_and_suggestion', json={**dates, 'guests': rng.randint(2, 8), 'rooms': rng.randint(1, 3)})
+            else:
+                response = test_client.post('/book', json={**dates, 'guests': 2, 'room_types': ['standard']},
+                                            headers={'Authorization': f'Bearer {token}'})
+            record(operation, response, (time.perf_counter() - start) * 1000)
+            # I client rispettano Retry-After prima di riprovare
+            if response.status_code in (429, 503):
+                time.sleep(int(response.headers.get('Retry-After', 1)))
+
+    threads = [threading.Thread(target=client, args=('search', index)) for index in range(SEARCH_CLIENTS)]
+    threads += [threading.Thread(target=client, args=('book', 1000 + index, token)) for index, token in enumerate(tokens)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def main():
+    fa = setup_app(env={
+        'ADMISSION_CONTROL': 'True', 'SUGGESTION_CACHE_SIZE': 0,
+        'ROOM_STANDARD_QUANTITY': 60, 'ROOM_SUPERIOR_QUANTITY': 45, 'ROOM_SUITE_QUANTITY': 15,
+        # I client del benchmark condividono lo stesso indirizzo IP: si misurano solo i limiti di concorrenza e di coda
+        'RATE_LIMIT_IP_PER_SECOND': 0, 'RATE_LIMIT_USER_PER_SECOND': 0,
+    })
+    with fa.app.app_context():
+        tokens = []
+        for index in range(BOOKING_CLIENTS):
+            user = fa.db.session.get(fa.User, create_user(fa, f'overload{index}'))
+            tokens.append(fa.create_access_token(identity=user.id, additional_claims=fa.user_claims(user)))
+
+    print(f"{SEARCH_CLIENTS} client di ricerca anonimi e {BOOKING_CLIENTS} client di prenotazione per {DURATION:.0f}s")
+    print(f"{'ammissione':>10} {'operazione':>10} {'servite':>8} {'scartate':>9} {'servite/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for enabled in (False, True):
+        fa.ADMISSION_CONTROL = enabled
+        results = run_scenario(fa, tokens)
+        for operation, result in results.items():
+            print(f"{'sì' if enabled else 'no':>10} {operation:>10} {result['ok']:>8} {result['rejected']:>9} "
+                  f"{result['ok'] / DURATION:>10.1f} {percentile(result['latencies'], 0.5):>8.1f} {percentile(result['latencies'], 0.99):>8.1f}")
+    with fa.app.app_context():
+        stats = fa.admission_controller.stats()
+    print(f"controllo di ammissione: {stats['admitted']} richieste ammesse, {stats['shed']} scartate per sovraccarico")
+
+
+if __name__ == '__main__':
+    main()
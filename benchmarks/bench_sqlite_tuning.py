@@ -0,0 +1,87 @@
+# Benchmark del throughput misto lettura/scrittura su /book e /rooms_per_type_and_suggestion,
+# con e senza i PRAGMA di ottimizzazione SQLite (WAL, synchronous=NORMAL, busy_timeout, mmap, cache).
+# Ogni configurazione gira in un processo separato, perché le impostazioni vengono lette all'importazione dell'applicazione.
+#
+# Uso: python benchmarks/bench_sqlite_tuning.py [secondi]
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import date, timedelta
+
+DURATION = float(sys.argv[-1]) if len(sys.argv) > 1 else 5.0
+WRITERS = 4
+READERS = 4
+
+
+def run_workload():
+    from common import setup_app, create_user
+
+    # La cache dei risultati è disattivata, così ogni ricerca calcola davvero la disponibilità
+    fa = setup_app(env={'SUGGESTION_CACHE_SIZE': 0, 'ROOM_STANDARD_QUANTITY': 100,
+                        'ROOM_SUPERIOR_QUANTITY': 100, 'ROOM_SUITE_QUANTITY': 50})
+    with fa.app.app_context():
+        tokens = [fa.create_access_token(identity=create_user(fa, f'mixed{i}')) for i in range(WRITERS)]
+
+    counts = {"book": 0, "search": 0, "errors": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + DURATION
+
+    def writer(index):
+        client = fa.app.test_client()
+        rng = random.Random(index)
+        headers = {'Authorization': f'Bearer {tokens[index]}'}
+        while time.perf_counter() < deadline:
+            check_in = date(2030, 1, 1) + timedelta(days=rng.randrange(365))
+            response = client.post('/book', headers=headers, json={
+                'check_in': check_in.strftime('%Y%m%d'),
+                'check_out': (check_in + timedelta(days=rng.randint(1, 5))).strftime('%Y%m%d'),
+                'guests': 2, 'room_types': [rng.choice(['standard', 'superior', 'suite'])]
+            })
+            with lock:
+                counts["book" if response.status_code == 201 else "errors"] += 1
+
+    def reader(index):
+        client = fa.app.test_client()
+        rng = random.Random(1000 + index)
+        while time.perf_counter() < deadline:
+            check_in = date(2030, 1, 1) + timedelta(days=rng.randrange(365))
+            rooms = rng.randint(1, 3)
+            response = client.post('/rooms_per_type_and_suggestion', json={
+                'check_in': check_in.strftime('%Y%m%d'),
+                'check_out': (check_in + timedelta(days=rng.randint(1, 5))).strftime('%Y%m%d'),
+                'guests': rng.randint(rooms, rooms * 2), 'rooms': rooms
+            })
+            with lock:
+                counts["search" if response.status_code == 200 else "errors"] += 1
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(WRITERS)]
+    threads += [threading.Thread(target=reader, args=(i,)) for i in range(READERS)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    print(json.dumps({key: value / elapsed if key != "errors" else value for key, value in counts.items()}))
+
+
+def main():
+    print(f"{WRITERS} thread di scrittura, {READERS} di lettura, {DURATION:.0f}s per configurazione")
+    print(f"{'configurazione':>16} {'book/s':>8} {'search/s':>9} {'errori':>7}")
+    for label, tuning in [('senza PRAGMA', 'False'), ('con PRAGMA', 'True')]:
+        env = dict(os.environ, SQLITE_TUNING=tuning)
+        output = subprocess.run([sys.executable, __file__, '--worker', str(DURATION)], env=env,
+                                capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{label:>16} {result['book']:>8.1f} {result['search']:>9.1f} {result['errors']:>7}")
+
+
+if __name__ == '__main__':
+    if '--worker' in sys.argv:
+        run_workload()
+    else:
+        main()
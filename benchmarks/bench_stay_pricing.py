@@ -0,0 +1,91 @@
+# Benchmark del calcolo del prezzo dei soggiorni con tariffe stagionali e per giorno della settimana, su 500 stanze.
+# Per soggiorni di lunghezza crescente confronta:
+# - il prezzo base per il numero di notti, come prima delle tariffe (riferimento: non applica le tariffe)
+# - una sola query per soggiorno che legge le tariffe sovrapposte, con il prezzo calcolato notte per notte una volta per classe di stanze
+# - le somme prefisse del calendario delle tariffe in memoria, che costano lo stesso per ogni durata
+# Misura infine la latenza di /rooms_per_type_and_suggestion (senza cache) con le tariffe attive.
+#
+# Uso: python benchmarks/bench_stay_pricing.py
+from collections import defaultdict
+from datetime import date, timedelta
+
+from common import setup_app, time_ms
+
+START_DATE = date(2030, 1, 1)
+LENGTHS = [1, 7, 30, 365]
+REPEAT = 20
+
+
+# Aggiunge una tariffa stagionale e una per il fine settimana per ogni tipo di stanza, in ogni mese per due anni
+def add_rates(fa):
+    for month in range(24):
+        start = date(START_DATE.year + month // 12, month % 12 + 1, 1)
+        end = date(start.year + (start.month == 12), start.month % 12 + 1, 1)
+        for room_type, price in (('standard', 90 + month), ('superior', 140 + month), ('suite', 240 + month)):
+            fa.add_room_rate(room_type, start.strftime('%Y%m%d'), end.strftime('%Y%m%d'), price)
+            fa.add_room_rate(room_type, start.strftime('%Y%m%d'), end.strftime('%Y%m%d'), price * 1.2, weekdays='4,5')
+
+
+# Prezzo dei soggiorni senza tariffe, come calcolato prima del calendario delle tariffe
+def base_prices(rooms, check_in, check_out):
+    nights = (check_out - check_in).days
+    return [room.price * nights for room in rooms]
+
+
+# Prezzo dei soggiorni con una sola query per soggiorno: vengono lette le tariffe che si sovrappongono al soggiorno,
+# dalla più recente, e il prezzo notte per notte viene calcolato una sola volta per classe di stanze
+def query_prices(fa, rooms, check_in, check_out):
+    rates = fa.RoomRate.query.filter(
+        fa.RoomRate.start_date < check_out, fa.RoomRate.end_date > check_in
+    ).order_by(fa.RoomRate.id.desc()).all()
+    rates_by_type = defaultdict(list)
+    for rate in rates:
+        rates_by_type[(rate.property_id, rate.room_type)].append(rate)
+
+    class_totals = {}
+    totals = []
+    for room in rooms:
+        room_class = (room.property_id, room.room_type, room.price)
+        if room_class not in class_totals:
+            total = 0.0
+            night = check_in
+            while night < check_out:
+                price = room.price
+                for rate in rates_by_type[(room.property_id, room.room_type)]:
+                    if rate.start_date <= night < rate.end_date and (not rate.weekdays or str(night.weekday()) in rate.weekdays.split(',')):
+                        price = rate.price
+                        break
+                total += price
+                night += timedelta(days=1)
+            class_totals[room_class] = round(total, 2)
+        totals.append(class_totals[room_class])
+    return totals
+
+
+def main():
+    fa = setup_app(env={'ROOM_STANDARD_QUANTITY': 250, 'ROOM_SUPERIOR_QUANTITY': 175, 'ROOM_SUITE_QUANTITY': 75, 'SUGGESTION_CACHE_SIZE': 0})
+    client = fa.app.test_client()
+    with fa.app.app_context():
+        add_rates(fa)
+        rates = fa.RoomRate.query.count()
+        rooms = list(fa.room_catalog.all())
+        print(f"{len(rooms)} stanze, {rates} tariffe; tempo medio per calcolare il prezzo del soggiorno di tutte le stanze")
+        print(f"{'notti':>6} {'prezzo base ms':>15} {'una query ms':>13} {'somme prefisse ms':>18}")
+        for length in LENGTHS:
+            check_in, check_out = START_DATE + timedelta(days=40), START_DATE + timedelta(days=40 + length)
+            assert query_prices(fa, rooms, check_in, check_out) == fa.rate_calendar.stay_prices(rooms, check_in, check_out).tolist()
+            base = time_ms(lambda: base_prices(rooms, check_in, check_out), repeat=REPEAT)
+            query = time_ms(lambda: query_prices(fa, rooms, check_in, check_out), repeat=REPEAT)
+            prefix = time_ms(lambda: fa.rate_calendar.stay_prices(rooms, check_in, check_out), repeat=REPEAT)
+            print(f"{length:>6} {base:>15.3f} {query:>13.2f} {prefix:>18.3f}")
+
+    print(f"{'notti':>6} {'ricerca ms':>11}")
+    for length in LENGTHS:
+        check_in = START_DATE + timedelta(days=40)
+        search = {'check_in': check_in.strftime('%Y%m%d'), 'check_out': (check_in + timedelta(days=length)).strftime('%Y%m%d'), 'guests': 6, 'rooms': 3}
+        elapsed = time_ms(lambda: client.post('/rooms_per_type_and_suggestion', json=search), repeat=REPEAT)
+        print(f"{length:>6} {elapsed:>11.2f}")
+
+
+if __name__ == '__main__':
+    main()
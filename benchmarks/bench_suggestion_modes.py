@@ -0,0 +1,29 @@
+# Benchmark delle modalità di risposta di /rooms_per_type_and_suggestion su una struttura con 500 stanze.
+# Per ciascuna modalità ('full' e 'summary') e codifica (nessuna, gzip e, se installato, brotli) misura i byte trasferiti
+# e il tempo medio di una richiesta servita dalla cache dei suggerimenti: serializzazione e compressione dominano.
+#
+# Uso: python benchmarks/bench_suggestion_modes.py
+from common import setup_app, time_ms
+
+REPEAT = 100
+SEARCH = {'check_in': '20300101', 'check_out': '20300104', 'guests': 4, 'rooms': 2}
+
+
+def main():
+    fa = setup_app(env={'ROOM_STANDARD_QUANTITY': 250, 'ROOM_SUPERIOR_QUANTITY': 175, 'ROOM_SUITE_QUANTITY': 75})
+    client = fa.app.test_client()
+    encodings = ['identity', 'gzip'] + (['br'] if fa.brotli is not None else [])
+    print(f"ricerca su 500 stanze, media su {REPEAT} richieste dalla cache")
+    print(f"{'modalità':>8} {'codifica':>9} {'byte':>8} {'ms':>8}")
+    for mode in fa.SUGGESTION_MODES:
+        for encoding in encodings:
+            def search():
+                return client.post('/rooms_per_type_and_suggestion', json={**SEARCH, 'mode': mode},
+                                   headers={'Accept-Encoding': encoding})
+            size = len(search().get_data())
+            elapsed = time_ms(search, repeat=REPEAT)
+            print(f"{mode:>8} {encoding:>9} {size:>8} {elapsed:>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
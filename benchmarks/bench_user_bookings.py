@@ -0,0 +1,35 @@
+# Benchmark di get_user_bookings: verifica che il numero di query resti costante al crescere delle prenotazioni dell'utente.
+#
+# Uso: python benchmarks/bench_user_bookings.py
+from common import setup_app, QueryCounter, create_user, add_bookings, time_ms
+
+BOOKING_COUNTS = [1, 10, 100, 1000]
+
+
+def main():
+    fa = setup_app()
+    print(f"{'prenotazioni':>12} {'query':>6} {'ms':>9}")
+    with fa.app.app_context():
+        # Il catalogo delle stanze viene caricato una sola volta per processo, non a ogni chiamata
+        fa.room_catalog.load()
+        query_counts = set()
+        for index, count in enumerate(BOOKING_COUNTS):
+            user_id = create_user(fa, f'bench{index}')
+            add_bookings(fa, user_id, count)
+            fa.db.session.expire_all()
+
+            with QueryCounter() as counter:
+                bookings = fa.get_user_bookings(user_id)
+            assert len(bookings) == count
+            query_counts.add(counter.count)
+
+            elapsed = time_ms(lambda: fa.get_user_bookings(user_id))
+            print(f"{count:>12} {counter.count:>6} {elapsed:>9.2f}")
+
+    if len(query_counts) != 1:
+        raise SystemExit(f"Il numero di query cresce con le prenotazioni: {sorted(query_counts)}")
+    print("Numero di query costante.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+# Utilità condivise dai benchmark.
+# Ogni benchmark lavora su un database SQLite temporaneo e isolato, così non tocca mai hotel.db.
+# Le variabili d'ambiente vanno impostate prima di importare flask_app, che le legge all'importazione.
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import insert
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Valori di default per le variabili d'ambiente richieste dall'applicazione
+DEFAULT_ENV = {
+    'ROOM_STANDARD_PRICE': '100.0',
+    'ROOM_SUPERIOR_PRICE': '150.0',
+    'ROOM_SUITE_PRICE': '250.0',
+    'ROOM_STANDARD_CAPACITY': '2',
+    'ROOM_SUPERIOR_CAPACITY': '3',
+    'ROOM_SUITE_CAPACITY': '4',
+    'ROOM_STANDARD_QUANTITY': '10',
+    'ROOM_SUPERIOR_QUANTITY': '15',
+    'ROOM_SUITE_QUANTITY': '5',
+    'JWT_SECRET_KEY': 'benchmark-secret-key-benchmark-secret-key',
+    # I benchmark inviano molte richieste dallo stesso utente e dallo stesso indirizzo: il controllo di ammissione
+    # viene attivato solo dal benchmark di sovraccarico, che lo misura
+    'ADMISSION_CONTROL': 'False',
+}
+
+
+# Prepara l'ambiente, importa l'applicazione e la inizializza su un database temporaneo come all'avvio del server:
+# schema con tutte le migrazioni, stanze, catalogo, tariffe e indice di occupazione
+def setup_app(db_path=None, env=None):
+    for key, value in DEFAULT_ENV.items():
+        os.environ.setdefault(key, value)
+    for key, value in (env or {}).items():
+        os.environ[key] = str(value)
+
+    if db_path is None:
+        db_path = os.path.join(tempfile.mkdtemp(prefix='hotel-bench-'), 'hotel.db')
+    os.environ['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+
+    if ROOT_DIR not in sys.path:
+        sys.path.insert(0, ROOT_DIR)
+    import flask_app
+
+    flask_app.initialize(flask_app.app)
+    return flask_app
+
+
+# Conta le istruzioni SQL eseguite da tutti gli engine SQLAlchemy mentre è attivo
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def __enter__(self):
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+        event.listen(Engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+        event.remove(Engine, 'before_cursor_execute', self._on_execute)
+        return False
+
+
+# Crea un utente direttamente nel database e restituisce il suo ID
+def create_user(fa, username, password_hash='benchmark'):
+    user = fa.User(username=username, email=f'{username}@example.com', password=password_hash,
+                   first_name='Bench', surname=username)
+    fa.db.session.add(user)
+    fa.db.session.commit()
+    return user.id
+
+
+# Inserisce n prenotazioni confermate per un utente, da rooms_per_booking stanze ciascuna, su date consecutive non sovrapposte
+# tra loro né con le prenotazioni già presenti (di default a partire dal 1° gennaio 2030 o dalla notte dopo l'ultima occupata).
+# Come create_booking salva prezzo addebitato, prezzi per notte, notti occupate e riepilogo giornaliero,
+# ma con inserimenti in blocco; l'indice di occupazione viene poi ricaricato alla prima ricerca.
+def add_bookings(fa, user_id, n, rooms_per_booking=2, start=None):
+    if start is None:
+        last_night = fa.db.session.query(fa.func.max(fa.RoomNight.night)).scalar()
+        start = max(date(2030, 1, 1), last_night + timedelta(days=1)) if last_night else date(2030, 1, 1)
+    rooms = sorted(fa.room_catalog.all(), key=lambda room: room.id)
+    stays = []
+    for i in range(n):
+        check_in = start + timedelta(days=3 * i)
+        check_out = check_in + timedelta(days=2)
+        booking_rooms = [rooms[(i * rooms_per_booking + j) % len(rooms)] for j in range(rooms_per_booking)]
+        stays.append((check_in, check_out, booking_rooms, fa.charged_nightly_prices(booking_rooms, check_in, check_out)))
+    bookings = [
+        fa.Booking(user_id=user_id, property_id=rooms[0].property_id, check_in=check_in, check_out=check_out, guests=2,
+                   total_price=fa.stay_total(prices))
+        for check_in, check_out, _, prices in stays
+    ]
+    fa.db.session.add_all(bookings)
+    fa.db.session.flush()
+    fa.db.session.execute(insert(fa.BookingRooms), [
+        {'booking_id': booking.id, 'room_id': room.id, 'nightly_prices': fa.encode_nightly_prices(room_prices)}
+        for booking, (_, _, booking_rooms, prices) in zip(bookings, stays) for room, room_prices in zip(booking_rooms, prices)
+    ])
+    fa.db.session.execute(insert(fa.RoomNight), [
+        {'room_id': room.id, 'night': night, 'booking_id': booking.id}
+        for booking, (check_in, check_out, booking_rooms, _) in zip(bookings, stays)
+        for room in booking_rooms for night in fa.stay_nights(check_in, check_out)
+    ])
+    fa.update_daily_occupancy(added=stays)
+    fa.bump_bookings_version(user_id)
+    fa.db.session.commit()
+    fa.occupancy_index.invalidate()
+    return [booking.id for booking in bookings]
+
+
+# Misura il tempo medio in millisecondi di una funzione su più ripetizioni
+def time_ms(func, repeat=5):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) * 1000 / repeat
@@ -0,0 +1,364 @@
+# Test di carico riproducibile su un hotel sintetico.
+# Popola un database temporaneo con un numero configurabile di stanze, utenti e prenotazioni storiche,
+# poi esegue un mix realistico di ricerche, prenotazioni, modifiche, cancellazioni, login e consultazioni dello storico
+# tramite il test client di Flask. Per ogni endpoint riporta latenza p50/p95/p99, throughput e query SQL per richiesta,
+# e salva i risultati in JSON per confrontare le esecuzioni e individuare le regressioni.
+#
+# Uso:
+#   python benchmarks/loadtest.py --output risultati.json
+#   python benchmarks/loadtest.py --rooms 1000 --users 5000 --bookings 50000 --requests 5000 --threads 4
+#   python benchmarks/loadtest.py --output nuovo.json --compare risultati.json --threshold 20
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from datetime import date, timedelta
+
+import numpy as np
+from sqlalchemy import insert
+
+from common import setup_app
+
+PASSWORD = 'Password123!'
+START_DATE = date(2030, 1, 1)
+ROOM_TYPES = ('standard', 'superior', 'suite')
+
+# Peso di ciascuna operazione nel mix di default
+DEFAULT_MIX = 'search=55,book=15,modify=8,cancel=5,history=12,login=5'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Test di carico su un hotel sintetico")
+    parser.add_argument('--rooms', type=int, default=300, help="numero totale di stanze (suddivise 50/35/15 tra standard, superior e suite)")
+    parser.add_argument('--users', type=int, default=500, help="numero di utenti registrati")
+    parser.add_argument('--bookings', type=int, default=5000, help="numero di prenotazioni storiche")
+    parser.add_argument('--days', type=int, default=365, help="orizzonte in giorni delle date di soggiorno")
+    parser.add_argument('--requests', type=int, default=2000, help="numero totale di richieste del test")
+    parser.add_argument('--threads', type=int, default=1, help="numero di client in parallelo")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f"pesi delle operazioni (default {DEFAULT_MIX})")
+    parser.add_argument('--seed', type=int, default=42, help="seme del generatore casuale, per esecuzioni riproducibili")
+    parser.add_argument('--output', help="file JSON in cui salvare i risultati")
+    parser.add_argument('--compare', help="file JSON di un'esecuzione precedente da confrontare")
+    parser.add_argument('--threshold', type=float, default=20.0, help="peggioramento percentuale oltre il quale si segnala una regressione")
+    return parser.parse_args()
+
+
+def parse_mix(mix):
+    weights = {}
+    for item in mix.split(','):
+        name, weight = item.split('=')
+        weights[name.strip()] = float(weight)
+    unknown = set(weights) - set(OPERATIONS)
+    if unknown:
+        raise SystemExit(f"Operazioni sconosciute nel mix: {', '.join(sorted(unknown))}")
+    return weights
+
+
+# Crea stanze, utenti e prenotazioni storiche con inserimenti in blocco.
+# Le prenotazioni confermate non si sovrappongono mai sulla stessa stanza, come nel database reale.
+def seed(fa, args, rng):
+    capacities = {'standard': 2, 'superior': 3, 'suite': 4}
+    prices = {'standard': 100.0, 'superior': 150.0, 'suite': 250.0}
+    quantities = {'standard': args.rooms * 50 // 100, 'superior': args.rooms * 35 // 100}
+    quantities['suite'] = args.rooms - quantities['standard'] - quantities['superior']
+
+    # Tutte le stanze appartengono alla struttura predefinita
+    property_id = fa.ensure_default_property().id
+    rooms = []
+    for room_type in ROOM_TYPES:
+        for _ in range(quantities[room_type]):
+            rooms.append({'property_id': property_id, 'number': str(1000 + len(rooms) + 1), 'price': prices[room_type],
+                          'capacity': capacities[room_type], 'room_type': room_type})
+    fa.db.session.execute(insert(fa.Room), rooms)
+
+    # L'hash della password viene calcolato una sola volta e condiviso da tutti gli utenti
+    password_hash = fa.password_hasher.hash(PASSWORD)
+    users = [{'id': str(uuid.uuid4()), 'username': f'user{i}', 'email': f'user{i}@example.com', 'password': password_hash,
+              'first_name': 'Load', 'surname': f'Test{i}'} for i in range(args.users)]
+    fa.db.session.execute(insert(fa.User), users)
+    fa.db.session.commit()
+
+    # Le stanze inserite in blocco vengono lette dal catalogo, per calcolare i prezzi addebitati come create_booking
+    fa.room_catalog.invalidate()
+    rooms_by_id = {room.id: room for room in fa.room_catalog.all()}
+    room_ids = sorted(rooms_by_id)
+    occupied = set()
+    bookings, booking_rooms, room_nights, stays, pool = [], [], [], [], []
+    for booking_id in range(1, args.bookings + 1):
+        user = rng.choice(users)
+        check_in = START_DATE + timedelta(days=rng.randrange(args.days))
+        nights = [check_in + timedelta(days=n) for n in range(rng.randint(1, 7))]
+        chosen = []
+        for room_id in rng.sample(room_ids, min(rng.randint(1, 3), len(room_ids))):
+            if not any((room_id, night) in occupied for night in nights):
+                chosen.append(room_id)
+        canceled = rng.random() < 0.1
+        if not chosen:
+            continue
+        check_out = nights[-1] + timedelta(days=1)
+        chosen_rooms = [rooms_by_id[room_id] for room_id in chosen]
+        charged_prices = fa.charged_nightly_prices(chosen_rooms, check_in, check_out)
+        bookings.append({'id': booking_id, 'user_id': user['id'], 'property_id': property_id, 'check_in': check_in,
+                         'check_out': check_out, 'guests': len(chosen), 'total_price': fa.stay_total(charged_prices),
+                         'status': 'canceled' if canceled else 'confirmed'})
+        booking_rooms.extend({'booking_id': booking_id, 'room_id': room_id, 'nightly_prices': fa.encode_nightly_prices(room_prices)}
+                             for room_id, room_prices in zip(chosen, charged_prices))
+        if not canceled:
+            stays.append((check_in, check_out, chosen_rooms, charged_prices))
+            for room_id in chosen:
+                for night in nights:
+                    occupied.add((room_id, night))
+                    room_nights.append({'room_id': room_id, 'night': night, 'booking_id': booking_id})
+            pool.append((user['id'], booking_id))
+
+    fa.db.session.execute(insert(fa.Booking), bookings)
+    fa.db.session.execute(insert(fa.BookingRooms), booking_rooms)
+    fa.db.session.execute(insert(fa.RoomNight), room_nights)
+    fa.update_daily_occupancy(added=stays)
+    fa.db.session.commit()
+
+    fa.occupancy_index.invalidate()
+    fa.occupancy_index.ensure_loaded()
+    return users, pool
+
+
+# Parametri casuali di un soggiorno ammissibile: le stanze richieste possono ospitare gli ospiti
+def random_stay(rng, days):
+    check_in = START_DATE + timedelta(days=rng.randrange(days))
+    check_out = check_in + timedelta(days=rng.randint(1, 5))
+    room_types = [rng.choice(ROOM_TYPES) for _ in range(rng.randint(1, 2))]
+    return check_in.strftime('%Y%m%d'), check_out.strftime('%Y%m%d'), len(room_types), room_types
+
+
+# Stato condiviso tra i client: utenti con i relativi token e prenotazioni modificabili o cancellabili
+class Workload:
+    def __init__(self, fa, users, tokens, pool, days):
+        self.fa = fa
+        self.users = users
+        self.tokens = tokens
+        self.pool = pool
+        self.days = days
+        self.lock = threading.Lock()
+
+    def headers(self, user_id):
+        return {'Authorization': f'Bearer {self.tokens[user_id]}'}
+
+    def take_booking(self, rng):
+        with self.lock:
+            if not self.pool:
+                return None
+            index = rng.randrange(len(self.pool))
+            self.pool[index], self.pool[-1] = self.pool[-1], self.pool[index]
+            return self.pool.pop()
+
+    def give_booking(self, user_id, booking_id):
+        with self.lock:
+            self.pool.append((user_id, booking_id))
+
+
+def op_search(client, workload, rng):
+    check_in, check_out, rooms, _ = random_stay(rng, workload.days)
+    return client.post('/rooms_per_type_and_suggestion', json={
+        'check_in': check_in, 'check_out': check_out, 'guests': rng.randint(rooms, rooms * 2), 'rooms': rooms
+    })
+
+
+def op_book(client, workload, rng):
+    user_id = rng.choice(workload.users)['id']
+    check_in, check_out, guests, room_types = random_stay(rng, workload.days)
+    response = client.post('/book', headers=workload.headers(user_id), json={
+        'check_in': check_in, 'check_out': check_out, 'guests': guests, 'room_types': room_types
+    })
+    if response.status_code == 201:
+        workload.give_booking(user_id, response.get_json()['booking_details']['booking_id'])
+    return response
+
+
+def op_modify(client, workload, rng):
+    taken = workload.take_booking(rng)
+    if taken is None:
+        return op_book(client, workload, rng)
+    user_id, booking_id = taken
+    check_in, check_out, guests, room_types = random_stay(rng, workload.days)
+    response = client.post('/modify_booking', headers=workload.headers(user_id), json={
+        'booking_id': booking_id, 'new_check_in': check_in, 'new_check_out': check_out,
+        'new_guests': guests, 'new_room_types': room_types
+    })
+    workload.give_booking(user_id, booking_id)
+    return response
+
+
+def op_cancel(client, workload, rng):
+    taken = workload.take_booking(rng)
+    if taken is None:
+        return op_book(client, workload, rng)
+    user_id, booking_id = taken
+    return client.post('/cancel_booking', headers=workload.headers(user_id), json={'booking_id': booking_id})
+
+
+def op_history(client, workload, rng):
+    user_id = rng.choice(workload.users)['id']
+    return client.get('/user_bookings', headers=workload.headers(user_id))
+
+
+def op_login(client, workload, rng):
+    user = rng.choice(workload.users)
+    return client.post('/login', json={'identifier': user['username'], 'password': PASSWORD, 'include_bookings': False})
+
+
+OPERATIONS = {
+    'search': op_search,
+    'book': op_book,
+    'modify': op_modify,
+    'cancel': op_cancel,
+    'history': op_history,
+    'login': op_login,
+}
+
+
+# Conta le istruzioni SQL eseguite dal thread corrente: il test client esegue la richiesta nel thread chiamante
+class ThreadQueryCounter:
+    def __init__(self):
+        self.local = threading.local()
+
+    def on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.local.count = getattr(self.local, 'count', 0) + 1
+
+    def reset(self):
+        self.local.count = 0
+
+    def value(self):
+        return getattr(self.local, 'count', 0)
+
+
+def run(fa, workload, weights, args):
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    counter = ThreadQueryCounter()
+    event.listen(Engine, 'before_cursor_execute', counter.on_execute)
+    samples = {name: [] for name in weights}
+    lock = threading.Lock()
+    names, cumulative = list(weights), list(np.cumsum(list(weights.values())))
+
+    def client_loop(index, requests):
+        client = fa.app.test_client()
+        rng = random.Random(args.seed * 1000 + index)
+        local = {name: [] for name in weights}
+        for _ in range(requests):
+            name = rng.choices(names, cum_weights=cumulative)[0]
+            counter.reset()
+            start = time.perf_counter()
+            response = OPERATIONS[name](client, workload, rng)
+            elapsed = (time.perf_counter() - start) * 1000
+            local[name].append((elapsed, counter.value(), response.status_code < 500))
+        with lock:
+            for name, values in local.items():
+                samples[name].extend(values)
+
+    per_thread = [args.requests // args.threads + (1 if i < args.requests % args.threads else 0) for i in range(args.threads)]
+    threads = [threading.Thread(target=client_loop, args=(i, n)) for i, n in enumerate(per_thread)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    event.remove(Engine, 'before_cursor_execute', counter.on_execute)
+    return samples, elapsed
+
+
+def summarize(samples, elapsed):
+    endpoints = {}
+    for name, values in samples.items():
+        if not values:
+            continue
+        latencies = np.array([value[0] for value in values])
+        queries = np.array([value[1] for value in values])
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        endpoints[name] = {
+            'requests': len(values),
+            'errors': sum(1 for value in values if not value[2]),
+            'throughput_rps': round(len(values) / elapsed, 2),
+            'mean_ms': round(float(latencies.mean()), 3),
+            'p50_ms': round(float(p50), 3),
+            'p95_ms': round(float(p95), 3),
+            'p99_ms': round(float(p99), 3),
+            'queries_mean': round(float(queries.mean()), 2),
+            'queries_max': int(queries.max()),
+        }
+    total = sum(len(values) for values in samples.values())
+    return {'elapsed_s': round(elapsed, 3), 'throughput_rps': round(total / elapsed, 2), 'endpoints': endpoints}
+
+
+def print_summary(summary):
+    print(f"{'operazione':>10} {'richieste':>9} {'errori':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'query':>6}")
+    for name, stats in summary['endpoints'].items():
+        print(f"{name:>10} {stats['requests']:>9} {stats['errors']:>6} {stats['throughput_rps']:>8.1f} {stats['p50_ms']:>8.2f} "
+              f"{stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f} {stats['queries_mean']:>6.1f}")
+    print(f"totale: {summary['throughput_rps']:.1f} req/s in {summary['elapsed_s']:.1f}s")
+
+
+# Confronta con un'esecuzione precedente: segnala p95 e query in aumento o throughput in calo oltre la soglia
+def compare(summary, baseline, threshold):
+    regressions = []
+    print(f"\n{'operazione':>10} {'p95 prima':>10} {'p95 ora':>8} {'Δ p95':>8} {'Δ req/s':>8} {'Δ query':>8}")
+    for name, stats in summary['endpoints'].items():
+        before = baseline['endpoints'].get(name)
+        if before is None:
+            continue
+        p95_delta = (stats['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0.0
+        rps_delta = (stats['throughput_rps'] - before['throughput_rps']) / before['throughput_rps'] * 100 if before['throughput_rps'] else 0.0
+        query_delta = stats['queries_mean'] - before['queries_mean']
+        print(f"{name:>10} {before['p95_ms']:>10.2f} {stats['p95_ms']:>8.2f} {p95_delta:>+7.1f}% {rps_delta:>+7.1f}% {query_delta:>+8.1f}")
+        if p95_delta > threshold:
+            regressions.append(f"{name}: p95 peggiorato del {p95_delta:.1f}%")
+        if -rps_delta > threshold:
+            regressions.append(f"{name}: throughput calato del {-rps_delta:.1f}%")
+        if query_delta > 0.5:
+            regressions.append(f"{name}: {query_delta:.1f} query in più per richiesta")
+    return regressions
+
+
+def main():
+    args = parse_args()
+    weights = parse_mix(args.mix)
+    rng = random.Random(args.seed)
+
+    # Le stanze vengono create dal test di carico, non da create_rooms, così la dimensione dell'hotel non ha limiti
+    fa = setup_app(env={'ROOM_STANDARD_QUANTITY': 0, 'ROOM_SUPERIOR_QUANTITY': 0, 'ROOM_SUITE_QUANTITY': 0})
+    with fa.app.app_context():
+        start = time.perf_counter()
+        users, pool = seed(fa, args, rng)
+        tokens = {user['id']: fa.create_access_token(identity=user['id']) for user in users}
+        print(f"Hotel sintetico: {args.rooms} stanze, {args.users} utenti, {len(pool)} prenotazioni confermate "
+              f"(creato in {time.perf_counter() - start:.1f}s)")
+
+    workload = Workload(fa, users, tokens, pool, args.days)
+    samples, elapsed = run(fa, workload, weights, args)
+    summary = summarize(samples, elapsed)
+    print_summary(summary)
+
+    result = {'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')}, **summary}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"Risultati salvati in {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('config') != result['config']:
+            print("Attenzione: la configurazione differisce da quella dell'esecuzione di riferimento")
+        regressions = compare(summary, baseline, args.threshold)
+        if regressions:
+            print("\nRegressioni:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("\nNessuna regressione oltre la soglia")
+
+
+if __name__ == '__main__':
+    main()
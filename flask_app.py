@@ -1,24 +1,56 @@
 from socket import gethostname
-from flask import Flask, request, jsonify
+from flask import Flask, Blueprint, current_app, request, jsonify, g, has_request_context, Response, stream_with_context
 # Flask: Framework web leggero per creare applicazioni web in Python.
+# Blueprint: Raccolta di endpoint, hook e comandi registrata sull'applicazione creata da create_app.
+# current_app: Riferimento all'applicazione che sta gestendo la richiesta o il comando corrente.
 # request: Modulo per gestire le richieste HTTP.
 # jsonify: Funzione per convertire i dati in formato JSON.
+# g: Oggetto per conservare dati durante una singola richiesta (ad esempio le metriche raccolte).
+# has_request_context: Funzione che indica se il codice è in esecuzione all'interno di una richiesta HTTP.
+# Response: Classe per costruire risposte personalizzate, ad esempio in streaming.
+# stream_with_context: Funzione che mantiene il contesto della richiesta attivo mentre un generatore produce la risposta.
+
+from flask.json.provider import DefaultJSONProvider
+# DefaultJSONProvider: Serializzatore JSON predefinito di Flask, esteso per usare un encoder più veloce quando disponibile.
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+# orjson: Libreria facoltativa per la codifica e decodifica JSON, molto più veloce del modulo json della libreria standard.
+# Se non è installata le risposte vengono serializzate con il modulo json, con lo stesso risultato.
 
 from flask_sqlalchemy import SQLAlchemy
 # Flask-SQLAlchemy: Estensione per Flask che semplifica l'integrazione con i database SQL.
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 
-from sqlalchemy import and_
+from sqlalchemy import and_, or_, insert, inspect, select, bindparam, func
 # SQLAlchemy: Libreria SQL per Python che fornisce un toolkit ORM (Object-Relational Mapping).
 # and_: Funzione per combinare più condizioni nelle query SQL.
+# or_: Funzione per combinare condizioni alternative nelle query SQL.
+# insert: Costrutto per inserimenti multipli in un'unica istruzione SQL.
+# inspect: Funzione per leggere la struttura di un database esistente (tabelle, colonne), usata dalle migrazioni.
+# select, bindparam: Costrutti per query e aggiornamenti multipli, usati per mantenere i riepiloghi giornalieri.
+# func: Accesso alle funzioni SQL (COUNT, SUM) per le aggregazioni eseguite dal database.
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateTable, AddConstraint
+# CreateTable, AddConstraint: Istruzioni DDL usate dalle migrazioni che ricostruiscono o modificano tabelle esistenti.
+# event, Engine: Sistema di eventi di SQLAlchemy, usato per configurare ogni nuova connessione al database.
+
+from sqlalchemy.exc import IntegrityError
+# IntegrityError: Eccezione sollevata quando un'istruzione viola un vincolo del database (ad esempio una chiave primaria duplicata).
 
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, get_jwt, verify_jwt_in_request
 # Flask-JWT-Extended: Estensione per Flask che aggiunge il supporto per JSON Web Tokens (JWT).
 # JWTManager: Gestore per configurare e gestire i JWT.
 # create_access_token: Funzione per creare un token di accesso JWT.
 # jwt_required: Decoratore per proteggere le route con autenticazione JWT.
 # get_jwt_identity: Funzione per ottenere l'identità dell'utente dal token JWT.
+# get_jwt: Funzione per leggere i claim aggiuntivi del token JWT (ad esempio il ruolo dell'utente).
+# verify_jwt_in_request: Funzione per leggere il token JWT facoltativo di una richiesta, usata dal controllo di ammissione.
 
 # Un sistema di autenticazione solido è fondamentale per garantire la sicurezza di un'applicazione web.
 # L'autenticazione è il processo di verifica dell'identità di un utente, assicurando che solo gli utenti autorizzati possano accedere a determinate risorse o eseguire determinate azioni.
@@ -41,10 +73,11 @@ from flask_jwt_extended import JWTManager, create_access_token, jwt_required, ge
 from flask_cors import CORS
 # Flask-CORS: Estensione per Flask che permette di abilitare le richieste CORS (Cross-Origin Resource Sharing).
 
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
 # Werkzeug: Libreria WSGI per Python che fornisce utilità per la sicurezza.
 # generate_password_hash: Funzione per generare hash delle password.
 # check_password_hash: Funzione per verificare le password hashate.
+# DEFAULT_PBKDF2_ITERATIONS: Numero di iterazioni usato da Werkzeug quando il metodo pbkdf2 non lo specifica.
 
 # Utilizziamo `generate_password_hash` per creare hash sicuri delle password degli utenti.
 # Questo è un requisito fondamentale per proteggere le password memorizzate nel database.
@@ -61,6 +94,12 @@ from werkzeug.security import generate_password_hash, check_password_hash
 
 # L'adozione di queste pratiche di sicurezza aiuta a proteggere gli utenti e a mantenere la fiducia nel sistema, riducendo il rischio di violazioni dei dati e le relative conseguenze legali e reputazionali.
 
+from werkzeug.local import LocalProxy
+# LocalProxy: Oggetto che inoltra ogni accesso all'oggetto restituito da una funzione, usato per lo stato di ciascuna applicazione.
+
+from werkzeug.middleware.proxy_fix import ProxyFix
+# ProxyFix: Middleware che ricava indirizzo e protocollo del client dagli header X-Forwarded-* impostati dai proxy fidati.
+
 from datetime import datetime, timedelta
 # datetime: Modulo per lavorare con date e orari.
 # timedelta: Classe per rappresentare la differenza tra due date o orari.
@@ -75,6 +114,65 @@ import secrets
 # secrets: Modulo per generare numeri casuali sicuri per la crittografia.
 # Ho utilizzato secrets per generare una chiave segreta di backup casuale per il token JWT  alla mancanna di una chiave segreta nel file env.
 
+import time
+# time: Modulo per misurare il tempo, usato per la scadenza delle voci in cache.
+
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+# ThreadPoolExecutor: Pool di thread, usato per calcolare gli hash delle password in parallelo fuori dal thread della richiesta.
+# FutureTimeoutError: Eccezione sollevata quando un hash non viene calcolato entro il timeout del pool.
+
+import sqlite3
+# sqlite3: Driver SQLite della libreria standard, usato per riconoscere le connessioni SQLite a cui applicare i PRAGMA.
+
+import threading
+# threading: Modulo per la sincronizzazione tra thread, usato per proteggere le strutture dati condivise in memoria.
+
+import bisect
+# bisect: Modulo per la ricerca binaria su liste ordinate, usato dall'indice di occupazione delle stanze.
+
+import random
+# random: Modulo per scelte casuali, usato per distribuire le prenotazioni concorrenti su stanze diverse.
+
+import numpy as np
+# NumPy: Libreria per il calcolo vettoriale, usata per costruire la matrice di occupazione stanze × notti del calendario.
+
+import heapq
+# heapq: Modulo per le code di priorità, usato per mantenere le k combinazioni di stanze più economiche
+# e per fondere in ordine lo storico delle prenotazioni attive e archiviate.
+
+import itertools
+# itertools: Funzioni per gli iteratori, usate per concatenare e limitare le sequenze di prenotazioni.
+
+from functools import lru_cache, wraps, partial
+# lru_cache: Decoratore che memorizza i risultati di una funzione, usato per il risolutore delle combinazioni di stanze.
+# partial: Funzione che fissa alcuni argomenti di un'altra funzione, usata per i proxy dello stato dell'applicazione.
+# wraps: Decoratore che preserva nome e attributi di una funzione decorata, usato per i decoratori degli endpoint.
+
+import click
+# click: Libreria usata da Flask per i comandi da terminale, usata per gli argomenti e le opzioni dei comandi personalizzati.
+
+import csv
+# csv: Modulo per leggere e scrivere file CSV, usato per l'esportazione e l'importazione delle prenotazioni.
+
+import io
+# io: Modulo per gestire flussi di testo in memoria e la decodifica del corpo delle richieste in streaming.
+
+import gzip
+# gzip: Modulo per comprimere le risposte più grandi quando il client lo supporta.
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+# brotli: Libreria facoltativa per la compressione Brotli, più efficace di gzip sui testi JSON.
+# Se non è installata le risposte vengono compresse solo con gzip.
+
+import base64
+# base64: Modulo per codificare i cursori di paginazione in stringhe sicure per gli URL.
+
+import hashlib
+# hashlib: Modulo per calcolare hash, usato per generare gli ETag delle risposte.
+
 import uuid
 # uuid: Modulo per generare identificatori univoci universali (UUID).
 # Ho implementato uuid perché in precedenza assegnavo un ID utente INT autoincrementale alla creazione dell'utente.
@@ -82,33 +180,120 @@ import uuid
 # Dopo aver perso qualche ora sul debug di questo errore, ho deciso di utilizzare UUID per generare un ID utente come stringa.
 # Questo ha risolto il problema, poiché UUID genera identificatori univoci in formato stringa, compatibili con i requisiti del token JWT.
 
-app = Flask(__name__)
-
-# Abilito CORS
-CORS(app)
-
 # Carico le variabili d'ambiente dall' .env file
 load_dotenv()
 
-secure_key = secrets.token_hex(16)
-# Configuro il database SQLite
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///hotel.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', secure_key)
+# Opzioni dell'engine e del pool di connessioni, impostate solo se presenti nel file .env
+# (ogni pool accetta opzioni diverse: ad esempio SQLite in memoria non supporta max_overflow)
+def engine_options_from_env():
+    options = {}
+    for env_var, option, convert in [
+        ('DB_POOL_SIZE', 'pool_size', int),
+        ('DB_MAX_OVERFLOW', 'max_overflow', int),
+        ('DB_POOL_TIMEOUT', 'pool_timeout', float),
+        ('DB_POOL_RECYCLE', 'pool_recycle', int),
+        ('DB_POOL_PRE_PING', 'pool_pre_ping', lambda value: value.lower() == 'true'),
+        ('DB_ECHO', 'echo', lambda value: value.lower() == 'true'),
+    ]:
+        value = os.getenv(env_var)
+        if value:
+            options[option] = convert(value)
+    return options
 
-db = SQLAlchemy(app)
-jwt = JWTManager(app)
+# Configurazione di default dell'applicazione, letta dal file .env al momento della creazione
+def default_config():
+    return {
+        # Configuro il database (SQLite di default, sovrascrivibile dal file .env)
+        'SQLALCHEMY_DATABASE_URI': os.getenv('SQLALCHEMY_DATABASE_URI', 'sqlite:///hotel.db'),
+        'SQLALCHEMY_TRACK_MODIFICATIONS': os.getenv('SQLALCHEMY_TRACK_MODIFICATIONS', 'False').lower() == 'true',
+        'SQLALCHEMY_ENGINE_OPTIONS': engine_options_from_env(),
+        # Senza JWT_SECRET_KEY la chiave viene generata alla creazione dell'applicazione: con gunicorn e preload_app
+        # l'applicazione viene creata una sola volta nel processo principale, quindi tutti i worker condividono la stessa chiave
+        'JWT_SECRET_KEY': os.getenv('JWT_SECRET_KEY', secrets.token_hex(16)),
+        # Serializzatore JSON: orjson se installato, altrimenti il modulo json della libreria standard
+        'JSON_PROVIDER': os.getenv('JSON_PROVIDER', 'orjson' if orjson is not None else 'json'),
+        # Numero di proxy fidati davanti all'applicazione (0 se è esposta direttamente): con un valore positivo l'indirizzo
+        # del client, usato dal limite di richieste per IP, viene letto da X-Forwarded-For invece che dalla connessione
+        'TRUSTED_PROXY_HOPS': int(os.getenv('TRUSTED_PROXY_HOPS', 0)),
+    }
 
-# Verifico che tutte le variabili d'ambiente richieste siano presenti
+# PRAGMA applicati a ogni nuova connessione SQLite (disattivabili con SQLITE_TUNING=False):
+# - journal_mode=WAL: i lettori non bloccano lo scrittore e viceversa, invece di serializzarsi sul journal di rollback
+# - synchronous=NORMAL: in modalità WAL resta sicuro in caso di crash dell'applicazione e riduce le sincronizzazioni su disco
+# - busy_timeout: attesa in millisecondi prima di restituire "database is locked" quando un altro scrittore è attivo
+# - mmap_size: byte del database letti tramite memory mapping invece che con chiamate read()
+# - cache_size: dimensione della cache delle pagine (valori negativi in KiB)
+SQLITE_TUNING = os.getenv('SQLITE_TUNING', 'True').lower() == 'true'
+SQLITE_PRAGMAS = {
+    'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+    'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', 268435456)),
+    'cache_size': int(os.getenv('SQLITE_CACHE_SIZE', -65536)),
+}
+
+@event.listens_for(Engine, 'connect')
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    if not SQLITE_TUNING or not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+# Estensioni create senza applicazione e collegate a quella creata da create_app
+db = SQLAlchemy()
+jwt = JWTManager()
+
+# Endpoint, hook delle richieste e comandi CLI dell'applicazione (cli_group=None li registra come comandi di primo livello)
+bp = Blueprint('hotel', __name__, cli_group=None)
+
+# Variabili d'ambiente richieste dall'applicazione
 required_env_vars = [
     'ROOM_STANDARD_PRICE', 'ROOM_SUPERIOR_PRICE', 'ROOM_SUITE_PRICE',
     'ROOM_STANDARD_CAPACITY', 'ROOM_SUPERIOR_CAPACITY', 'ROOM_SUITE_CAPACITY',
     'ROOM_STANDARD_QUANTITY', 'ROOM_SUPERIOR_QUANTITY', 'ROOM_SUITE_QUANTITY'
 ]
 
-for var in required_env_vars:
-    if not os.getenv(var):
-        raise EnvironmentError(f"Manca variabile d'ambiente: {var}")
+# Verifico che tutte le variabili d'ambiente richieste siano presenti
+def check_required_env_vars():
+    for var in required_env_vars:
+        if not os.getenv(var):
+            raise EnvironmentError(f"Manca variabile d'ambiente: {var}")
+
+# Struttura predefinita, usata quando una richiesta non indica la struttura: i database creati prima del supporto
+# a più strutture vengono assegnati a questa struttura dalla migrazione
+DEFAULT_PROPERTY_CODE = os.getenv('DEFAULT_PROPERTY_CODE', 'main')
+DEFAULT_PROPERTY_NAME = os.getenv('DEFAULT_PROPERTY_NAME', 'Hotel')
+
+# Numero di combinazioni alternative restituite insieme a quella suggerita
+SUGGESTION_ALTERNATIVES = int(os.getenv('SUGGESTION_ALTERNATIVES', 3))
+
+# Numero massimo di stanze e di ospiti di una ricerca: il costo del risolutore delle combinazioni cresce con stanze² × ospiti,
+# quindi i limiti impediscono che una singola richiesta anonima occupi un worker per secondi
+SUGGESTION_MAX_ROOMS = int(os.getenv('SUGGESTION_MAX_ROOMS', 20))
+SUGGESTION_MAX_GUESTS = int(os.getenv('SUGGESTION_MAX_GUESTS', 80))
+
+# Numero massimo di notti restituite dal calendario delle disponibilità
+CALENDAR_MAX_NIGHTS = 366
+
+# Numero massimo di tentativi di allocazione di una prenotazione in caso di conflitto con richieste concorrenti
+BOOKING_MAX_ATTEMPTS = int(os.getenv('BOOKING_MAX_ATTEMPTS', 5))
+
+# Intervallo in secondi tra due sincronizzazioni dell'indice di occupazione con le prenotazioni degli altri processi worker
+# (0 per disattivarla) e margine in secondi con cui vengono rilette le prenotazioni modificate di recente
+INVENTORY_SYNC_SECONDS = float(os.getenv('INVENTORY_SYNC_SECONDS', 2))
+INVENTORY_SYNC_LOOKBACK = float(os.getenv('INVENTORY_SYNC_LOOKBACK', 30))
+
+# Numero massimo di soggiorni in una singola prenotazione di gruppo
+BOOKING_BATCH_MAX_ITEMS = int(os.getenv('BOOKING_BATCH_MAX_ITEMS', 100))
+
+# Righe lette dal database per ogni blocco dell'esportazione e prenotazioni salvate per ogni transazione dell'importazione
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', 1000))
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', 1000))
+
+# Numero massimo di errori riportati nella risposta di un'importazione
+IMPORT_MAX_REPORTED_ERRORS = 100
 
 ####################################################
 # Definizione dei modelli
@@ -124,40 +309,97 @@ class User(db.Model):
     role = db.Column(db.String(20), nullable=False, default='user')  # 'user' o 'admin'
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    bookings_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     # Questo modello rappresenta gli utenti del sistema.
     # Ogni utente ha un ID univoco, un nome utente, un'email, una password, un nome, un cognome e un ruolo.
     # Il ruolo può essere 'user' o 'admin'.
     # Le date di creazione e aggiornamento vengono gestite automaticamente.
+    # bookings_version viene incrementato a ogni prenotazione creata, cancellata o modificata dell'utente
+    # e identifica la versione del suo storico (usata per gli ETag di /user_bookings).
+
+# Modello Struttura
+class Property(db.Model):
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    code = db.Column(db.String(50), unique=True, nullable=False)
+    name = db.Column(db.String(120), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    # Questo modello rappresenta una struttura (hotel) gestita dall'applicazione.
+    # Ogni struttura ha un ID univoco, un codice univoco usato nelle richieste e un nome.
+    # Stanze e prenotazioni appartengono a una struttura.
 
 # Modello Stanza
 class Room(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    number = db.Column(db.String(10), unique=True, nullable=False)
+    property_id = db.Column(db.Integer, db.ForeignKey('property.id'), nullable=False)
+    number = db.Column(db.String(10), nullable=False)
     price = db.Column(db.Float, nullable=False)
     capacity = db.Column(db.Integer, nullable=False)
     room_type = db.Column(db.String(50), nullable=False)
     bookings = db.relationship('BookingRooms', backref='room', lazy=True)
 
-    # Questo modello rappresenta le stanze disponibili nell'hotel.
-    # Ogni stanza ha un ID univoco, un numero, un prezzo per notte, una capacità e un tipo.
+    # Il numero di stanza è univoco all'interno di una struttura: strutture diverse possono avere la stessa stanza 101
+    __table_args__ = (
+        db.UniqueConstraint('property_id', 'number', name='uq_room_property_id_number'),
+    )
+
+    # Questo modello rappresenta le stanze disponibili in una struttura.
+    # Ogni stanza ha un ID univoco, la struttura a cui appartiene, un numero, un prezzo per notte, una capacità e un tipo.
+    # Il prezzo è quello base: nelle notti coperte da una tariffa (RoomRate) vale il prezzo della tariffa.
     # La relazione 'bookings' collega le stanze alle prenotazioni.
 
+# Modello Tariffa
+class RoomRate(db.Model):
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    property_id = db.Column(db.Integer, db.ForeignKey('property.id'), nullable=False)
+    room_type = db.Column(db.String(50), nullable=False)
+    start_date = db.Column(db.Date, nullable=False)
+    end_date = db.Column(db.Date, nullable=False)
+    weekdays = db.Column(db.String(20))  # Giorni della settimana separati da virgole (0 = lunedì), tutti se vuoto
+    price = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    # Con SQLite la tabella usa AUTOINCREMENT: l'ID di una tariffa eliminata non viene mai riassegnato, quindi ogni
+    # aggiunta fa crescere l'ID massimo e i processi worker si accorgono del cambiamento delle tariffe.
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    # Questo modello rappresenta una tariffa stagionale o per giorno della settimana di un tipo di stanza di una struttura.
+    # La tariffa fissa il prezzo per notte delle notti dall'inizio (incluso) alla fine (esclusa), eventualmente solo nei giorni indicati.
+    # Quando più tariffe coprono la stessa notte vale quella inserita per ultima.
+
 # Modello Prenotazione
 class Booking(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.String, db.ForeignKey('user.id'), nullable=False)
+    property_id = db.Column(db.Integer, db.ForeignKey('property.id'), nullable=False)
     check_in = db.Column(db.Date, nullable=False)
     check_out = db.Column(db.Date, nullable=False)
     guests = db.Column(db.Integer, nullable=False)
     status = db.Column(db.String(20), nullable=False, default='confirmed')  # 'confirmed' o 'canceled'
+    total_price = db.Column(db.Float, nullable=False, default=0.0, server_default='0')
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
     rooms = db.relationship('BookingRooms', backref='booking', lazy=True)
 
+    # Indici secondari per le query più frequenti:
+    # - sovrapposizione di date (check_in < ? AND check_out > ? AND status != 'canceled')
+    # - storico di un utente (user_id = ? ORDER BY created_at)
+    # - prenotazioni modificate di recente (updated_at >= ?), per sincronizzare gli indici dei processi worker
+    # Con SQLite la tabella usa AUTOINCREMENT: l'ID di una prenotazione eliminata (ad esempio archiviata) non viene mai riassegnato,
+    # quindi una nuova prenotazione non può avere lo stesso ID di una prenotazione archiviata.
+    __table_args__ = (
+        db.Index('ix_booking_check_in_check_out_status', 'check_in', 'check_out', 'status'),
+        db.Index('ix_booking_user_id_created_at', 'user_id', 'created_at'),
+        db.Index('ix_booking_updated_at', 'updated_at'),
+        {'sqlite_autoincrement': True},
+    )
+
     # Questo modello rappresenta le prenotazioni effettuate dagli utenti.
-    # Ogni prenotazione ha un ID univoco, un ID utente, date di check-in e check-out, numero di ospiti e stato.
+    # Ogni prenotazione ha un ID univoco, un ID utente, la struttura, date di check-in e check-out, numero di ospiti e stato.
     # Lo stato può essere 'confirmed' o 'canceled'.
+    # total_price è il prezzo addebitato al momento della prenotazione (o dell'ultima modifica), secondo le tariffe in vigore:
+    # lo storico lo legge così com'è, senza ricalcolarlo.
     # Le date di creazione e aggiornamento vengono gestite automaticamente.
     # La relazione 'rooms' collega le prenotazioni alle stanze.
 
@@ -166,9 +408,84 @@ class BookingRooms(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     booking_id = db.Column(db.Integer, db.ForeignKey('booking.id'), nullable=False)
     room_id = db.Column(db.Integer, db.ForeignKey('room.id'), nullable=False)
+    nightly_prices = db.Column(db.Text)  # Prezzi addebitati per ogni notte del soggiorno, separati da virgole
+
+    # Indici per raggiungere le stanze di una prenotazione e le prenotazioni di una stanza senza scansioni complete
+    __table_args__ = (
+        db.Index('ix_booking_rooms_booking_id', 'booking_id'),
+        db.Index('ix_booking_rooms_room_id_booking_id', 'room_id', 'booking_id'),
+    )
 
     # Questo modello rappresenta l'associazione tra prenotazioni e stanze.
-    # Ogni associazione ha un ID univoco, un ID prenotazione e un ID stanza.
+    # Ogni associazione ha un ID univoco, un ID prenotazione, un ID stanza e i prezzi per notte addebitati per la stanza:
+    # il riepilogo giornaliero somma e sottrae esattamente questi importi, anche se nel frattempo le tariffe sono cambiate.
+
+# Modello Notte/Stanza
+class RoomNight(db.Model):
+    room_id = db.Column(db.Integer, db.ForeignKey('room.id'), primary_key=True)
+    night = db.Column(db.Date, primary_key=True)
+    booking_id = db.Column(db.Integer, db.ForeignKey('booking.id'), nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_room_night_booking_id', 'booking_id'),
+    )
+
+    # Questo modello rappresenta l'occupazione di una stanza per una singola notte.
+    # La chiave primaria (room_id, night) garantisce a livello di database che una stanza non possa essere
+    # assegnata a due prenotazioni nella stessa notte, anche quando più richieste prenotano nello stesso istante.
+    # Le righe vengono inserite nella stessa transazione della prenotazione ed eliminate alla cancellazione.
+
+# Modello Riepilogo giornaliero di occupazione
+class DailyOccupancy(db.Model):
+    property_id = db.Column(db.Integer, db.ForeignKey('property.id'), primary_key=True)
+    night = db.Column(db.Date, primary_key=True)
+    room_type = db.Column(db.String(50), primary_key=True)
+    rooms_sold = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+
+    # Questo modello rappresenta, per ogni struttura, notte e tipo di stanza, il numero di stanze vendute e il ricavo corrispondente.
+    # Viene aggiornato in modo incrementale nella stessa transazione di prenotazioni, cancellazioni e modifiche,
+    # così i report di occupazione leggono una riga per notte e tipo invece di scorrere tutte le prenotazioni.
+
+# Modello Prenotazione archiviata
+class ArchivedBooking(db.Model):
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.String, db.ForeignKey('user.id'), nullable=False)
+    property_id = db.Column(db.Integer, db.ForeignKey('property.id'), nullable=False)
+    check_in = db.Column(db.Date, nullable=False)
+    check_out = db.Column(db.Date, nullable=False)
+    guests = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    total_price = db.Column(db.Float, nullable=False, default=0.0, server_default='0')
+    created_at = db.Column(db.DateTime, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    # Indici per lo storico di un utente e per le prenotazioni archiviate di recente (sincronizzazione dei processi worker)
+    __table_args__ = (
+        db.Index('ix_archived_booking_user_id_created_at', 'user_id', 'created_at'),
+        db.Index('ix_archived_booking_archived_at', 'archived_at'),
+    )
+
+    # Questo modello rappresenta le prenotazioni concluse o cancellate spostate fuori dalla tabella Booking.
+    # Le colonne e gli ID sono quelli della prenotazione originale, più la data di archiviazione.
+    # Le prenotazioni archiviate compaiono nello storico e nelle esportazioni ma non vengono più lette dalle ricerche.
+
+# Modello Prenotazione/Stanza archiviata
+class ArchivedBookingRooms(db.Model):
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    booking_id = db.Column(db.Integer, db.ForeignKey('archived_booking.id'), nullable=False)
+    room_id = db.Column(db.Integer, db.ForeignKey('room.id'), nullable=False)
+    nightly_prices = db.Column(db.Text)
+
+    __table_args__ = (
+        db.Index('ix_archived_booking_rooms_booking_id', 'booking_id'),
+    )
+
+    # Questo modello rappresenta l'associazione tra prenotazioni archiviate e stanze, nello stesso ordine di BookingRooms.
+
+# Tabelle delle prenotazioni attive e archiviate, lette entrambe dallo storico degli utenti e dalle esportazioni
+BOOKING_TABLES = ((Booking, BookingRooms), (ArchivedBooking, ArchivedBookingRooms))
 
 # Relazioni
     # Un utente può avere molte prenotazioni (user_id in Booking).
@@ -196,12 +513,1532 @@ class BookingRooms(db.Model):
     # Ad esempio, un utente potrebbe prenotare una stanza standard per sé e una stanza superior per un collega nello stesso periodo.
 
 
+# Modello Migrazione dello schema
+class SchemaMigration(db.Model):
+    version = db.Column(db.Integer, primary_key=True)
+    description = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    # Questo modello registra le migrazioni dello schema già applicate al database.
+    # Ogni riga corrisponde a una versione: le migrazioni con versione non ancora registrata vengono applicate all'avvio.
+
+
+####################################################
+# Migrazioni dello schema
+####################################################
+# db.create_all() crea solo le tabelle mancanti: non aggiunge indici o colonne a tabelle già esistenti.
+# Per aggiornare in loco i database già in uso (ad esempio un hotel.db creato con una versione precedente)
+# ogni modifica dello schema viene registrata come migrazione numerata e applicata una sola volta, in ordine di versione.
+MIGRATIONS = []
+
+# Decoratore che registra una funzione come migrazione con la versione e la descrizione indicate
+def migration(version, description):
+    def decorator(func):
+        MIGRATIONS.append((version, description, func))
+        return func
+    return decorator
+
+# Crea gli indici indicati (definiti nei modelli) se non esistono già, in modo portabile tra i database supportati
+def create_indexes(*index_names):
+    connection = db.session.connection()
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name in index_names:
+                index.create(bind=connection, checkfirst=True)
+
+@migration(1, "Indici per le query di disponibilità, storico utente e associazioni prenotazione/stanza")
+def add_booking_indexes():
+    create_indexes(
+        'ix_booking_check_in_check_out_status',
+        'ix_booking_user_id_created_at',
+        'ix_booking_rooms_booking_id',
+        'ix_booking_rooms_room_id_booking_id',
+    )
+
+@migration(2, "Tabella delle notti occupate per stanza, popolata dalle prenotazioni confermate")
+def add_room_nights():
+    connection = db.session.connection()
+    RoomNight.__table__.create(bind=connection, checkfirst=True)
+
+    rows = db.session.query(
+        BookingRooms.room_id, Booking.check_in, Booking.check_out, Booking.id
+    ).join(Booking, Booking.id == BookingRooms.booking_id).filter(Booking.status != 'canceled').order_by(Booking.id).all()
+
+    # In caso di prenotazioni sovrapposte già presenti nel database, la notte resta alla prenotazione più vecchia
+    occupied = set()
+    room_nights = []
+    for room_id, check_in, check_out, booking_id in rows:
+        for night in stay_nights(check_in, check_out):
+            if (room_id, night) in occupied:
+                print(f"Attenzione: la stanza {room_id} risulta già occupata la notte {night} (prenotazione {booking_id})")
+                continue
+            occupied.add((room_id, night))
+            room_nights.append({"room_id": room_id, "night": night, "booking_id": booking_id})
+
+    if room_nights:
+        db.session.execute(insert(RoomNight), room_nights)
+
+# Aggiunge a una tabella esistente una colonna definita nel modello, se non è già presente
+def add_column(model, column_name):
+    connection = db.session.connection()
+    table = model.__table__
+    if column_name in {column['name'] for column in inspect(connection).get_columns(table.name)}:
+        return
+    column = table.c[column_name]
+    preparer = connection.dialect.identifier_preparer
+    ddl = f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.format_column(column)} {column.type.compile(dialect=connection.dialect)}"
+    if column.server_default is not None:
+        ddl += f" DEFAULT {column.server_default.arg}"
+    if not column.nullable:
+        ddl += " NOT NULL"
+    connection.exec_driver_sql(ddl)
+
+@migration(3, "Versione dello storico prenotazioni per utente")
+def add_user_bookings_version():
+    add_column(User, 'bookings_version')
+
+@migration(4, "Riepilogo giornaliero di occupazione e ricavi per tipo di stanza")
+def add_daily_occupancy():
+    # Il riepilogo viene popolato dalla migrazione 6, quando le stanze hanno già la loro struttura
+    DailyOccupancy.__table__.create(bind=db.session.connection(), checkfirst=True)
+
+@migration(5, "Indice sulle prenotazioni modificate di recente, per la sincronizzazione tra processi worker")
+def add_booking_updated_at_index():
+    create_indexes('ix_booking_updated_at')
+
+# Porta una tabella esistente alla definizione attuale del modello quando cambiano colonne o vincoli di unicità.
+# SQLite non permette di aggiungere colonne NOT NULL senza default né di modificare i vincoli con ALTER TABLE:
+# la tabella viene ricostruita con la nuova definizione e i dati vengono copiati, come raccomandato da SQLite.
+# Con gli altri database le colonne mancanti vengono aggiunte e i vincoli di unicità aggiornati con ALTER TABLE.
+# defaults indica il valore da assegnare alle righe esistenti per le colonne nuove; le colonne non indicate ricevono il loro default del server.
+# Con rebuild la tabella viene ricostruita anche se colonne e vincoli non sono cambiati (ad esempio per le opzioni della tabella su SQLite).
+def migrate_table(model, defaults, rebuild=False):
+    connection = db.session.connection()
+    table = model.__table__
+    inspector = inspect(connection)
+    existing_columns = [column['name'] for column in inspector.get_columns(table.name)]
+    existing_uniques = {tuple(constraint['column_names']): constraint['name'] for constraint in inspector.get_unique_constraints(table.name)}
+    model_uniques = {tuple(column.name for column in constraint.columns): constraint
+                     for constraint in table.constraints if isinstance(constraint, db.UniqueConstraint)}
+    missing_columns = [column for column in table.columns if column.name not in existing_columns]
+    if not missing_columns and set(existing_uniques) == set(model_uniques) and not rebuild:
+        return
+    defaults = {**{column.name: column.server_default.arg for column in missing_columns if column.server_default is not None}, **defaults}
+
+    preparer = connection.dialect.identifier_preparer
+    if connection.dialect.name == 'sqlite':
+        # La nuova tabella viene definita in metadati separati, insieme alle tabelle a cui fanno riferimento le sue chiavi esterne
+        metadata = db.MetaData()
+        for referred_table in {foreign_key.column.table for foreign_key in table.foreign_keys}:
+            referred_table.to_metadata(metadata)
+        new_table = table.to_metadata(metadata, name=f"{table.name}__new")
+        connection.execute(CreateTable(new_table))
+        copied = [column.name for column in table.columns if column.name in existing_columns]
+        added = [column.name for column in missing_columns]
+        connection.execute(
+            new_table.insert().from_select(
+                copied + added,
+                select(*[db.column(name) for name in copied], *[db.literal(defaults[name]) for name in added]).select_from(db.table(table.name))
+            )
+        )
+        connection.exec_driver_sql(f"DROP TABLE {preparer.format_table(table)}")
+        connection.exec_driver_sql(f"ALTER TABLE {preparer.quote(new_table.name)} RENAME TO {preparer.format_table(table)}")
+    else:
+        for column in missing_columns:
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.exec_driver_sql(
+                f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.format_column(column)} {column_type} "
+                f"DEFAULT {db.literal(defaults[column.name]).compile(dialect=connection.dialect, compile_kwargs={'literal_binds': True})} NOT NULL"
+            )
+        for columns, name in existing_uniques.items():
+            if columns not in model_uniques:
+                connection.exec_driver_sql(f"ALTER TABLE {preparer.format_table(table)} DROP CONSTRAINT {preparer.quote(name)}")
+        for columns, constraint in model_uniques.items():
+            if columns not in existing_uniques:
+                connection.execute(AddConstraint(constraint))
+    create_indexes(*[index.name for index in table.indexes])
+
+@migration(6, "Strutture: stanze e prenotazioni associate a una struttura, numeri di stanza univoci per struttura")
+def add_properties():
+    connection = db.session.connection()
+    Property.__table__.create(bind=connection, checkfirst=True)
+    default_property = ensure_default_property()
+    migrate_table(Room, {'property_id': default_property.id})
+    migrate_table(Booking, {'property_id': default_property.id})
+
+    # Il riepilogo giornaliero è un dato derivato: viene ricreato con la struttura nella chiave e ricostruito dalla migrazione 10,
+    # quando le stanze delle prenotazioni hanno i prezzi per notte addebitati
+    DailyOccupancy.__table__.drop(bind=connection, checkfirst=True)
+    DailyOccupancy.__table__.create(bind=connection)
+
+@migration(7, "Tabelle delle prenotazioni archiviate")
+def add_archived_bookings():
+    connection = db.session.connection()
+    ArchivedBooking.__table__.create(bind=connection, checkfirst=True)
+    ArchivedBookingRooms.__table__.create(bind=connection, checkfirst=True)
+
+@migration(8, "Tariffe per notte e prezzo addebitato sulle prenotazioni")
+def add_room_rates():
+    connection = db.session.connection()
+    RoomRate.__table__.create(bind=connection, checkfirst=True)
+
+    # Le prenotazioni esistenti sono state pagate al prezzo base delle stanze: il prezzo addebitato è ricavato da quello
+    for booking_model, rooms_model in BOOKING_TABLES:
+        add_column(booking_model, 'total_price')
+        rows = db.session.query(
+            booking_model.id, booking_model.check_in, booking_model.check_out, func.sum(Room.price)
+        ).join(rooms_model, rooms_model.booking_id == booking_model.id).join(Room, Room.id == rooms_model.room_id).group_by(booking_model.id).all()
+        if rows:
+            table = booking_model.__table__
+            db.session.execute(
+                table.update().where(table.c.id == bindparam('key_id')).values(total_price=bindparam('charged_price')),
+                [{"key_id": booking_id, "charged_price": round(price * (check_out - check_in).days, 2)} for booking_id, check_in, check_out, price in rows]
+            )
+    # Il riepilogo giornaliero viene ricostruito dalla migrazione 10, con i prezzi per notte addebitati
+
+# Con SQLite ricostruisce la tabella del modello con AUTOINCREMENT, se non lo usa già, e fa ripartire il contatore degli ID da max_id.
+# Con gli altri database gli ID delle righe eliminate non vengono comunque riassegnati.
+def enable_sqlite_autoincrement(model, max_id):
+    connection = db.session.connection()
+    if connection.dialect.name != 'sqlite':
+        return
+    table_name = model.__table__.name
+    table_sql = connection.exec_driver_sql("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)).scalar()
+    if 'AUTOINCREMENT' not in table_sql.upper():
+        migrate_table(model, {}, rebuild=True)
+    connection.exec_driver_sql("DELETE FROM sqlite_sequence WHERE name = ?", (table_name,))
+    connection.exec_driver_sql("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table_name, max_id))
+
+@migration(9, "ID delle prenotazioni mai riassegnati dopo un'eliminazione (AUTOINCREMENT su SQLite)")
+def add_booking_autoincrement():
+    # Il contatore riparte dall'ID più alto mai assegnato, anche se quella prenotazione è già stata archiviata
+    max_id = max(db.session.query(func.max(Booking.id)).scalar() or 0, db.session.query(func.max(ArchivedBooking.id)).scalar() or 0)
+    enable_sqlite_autoincrement(Booking, max_id)
+
+@migration(10, "Prezzi per notte addebitati per ogni stanza delle prenotazioni")
+def add_booking_nightly_prices():
+    # Per le prenotazioni esistenti il prezzo addebitato viene ripartito tra le notti secondo le tariffe attuali
+    for booking_model, rooms_model in BOOKING_TABLES:
+        add_column(rooms_model, 'nightly_prices')
+        rows = db.session.query(
+            booking_model.id, booking_model.check_in, booking_model.check_out, booking_model.total_price, rooms_model.id, rooms_model.room_id
+        ).join(rooms_model, rooms_model.booking_id == booking_model.id).order_by(booking_model.id, rooms_model.id).all()
+        updates = []
+        for _, booking_rows in itertools.groupby(rows, key=lambda row: row[0]):
+            booking_rows = list(booking_rows)
+            _, check_in, check_out, total_price, _, _ = booking_rows[0]
+            prices = charged_nightly_prices([room_catalog.get(row[5]) for row in booking_rows], check_in, check_out, total_price)
+            updates += [{"key_id": row[4], "prices": encode_nightly_prices(room_prices)} for row, room_prices in zip(booking_rows, prices)]
+        if updates:
+            table = rooms_model.__table__
+            db.session.execute(table.update().where(table.c.id == bindparam('key_id')).values(nightly_prices=bindparam('prices')), updates)
+    rebuild_daily_occupancy()
+
+@migration(11, "ID delle tariffe mai riassegnati dopo un'eliminazione (AUTOINCREMENT su SQLite)")
+def add_room_rate_autoincrement():
+    enable_sqlite_autoincrement(RoomRate, db.session.query(func.max(RoomRate.id)).scalar() or 0)
+
+# Applica, in ordine di versione, tutte le migrazioni non ancora registrate nel database
+def run_migrations():
+    SchemaMigration.__table__.create(bind=db.engine, checkfirst=True)
+    applied_versions = {version for (version,) in db.session.query(SchemaMigration.version).all()}
+
+    for version, description, func in sorted(MIGRATIONS, key=lambda item: item[0]):
+        if version in applied_versions:
+            continue
+        try:
+            # Ogni migrazione viene applicata e registrata nella stessa transazione
+            func()
+            db.session.add(SchemaMigration(version=version, description=description))
+            db.session.commit()
+            print(f"Migrazione {version} applicata: {description}")
+        except Exception as e:
+            db.session.rollback()
+            raise Exception(f"Errore durante la migrazione {version}: {e}")
+
+
+####################################################
+# Stato dell'applicazione
+####################################################
+# Catalogo delle stanze, calendario delle tariffe, indice di occupazione e cache dei risultati rispecchiano il database
+# di un'applicazione: ogni applicazione creata da create_app ha i propri, salvati in app.extensions['hotel'],
+# così due applicazioni collegate a database diversi non vedono le stanze e le prenotazioni l'una dell'altra.
+# Allo stesso modo ogni applicazione ha il proprio pool di hashing, controllo di ammissione e limiti di richieste.
+# I nomi a livello di modulo sono proxy verso lo stato dell'applicazione attiva e si usano come oggetti unici.
+APP_STATE_FACTORIES = {}
+
+# Restituisce l'oggetto di stato indicato dell'applicazione attiva
+def app_state(name):
+    return current_app.extensions['hotel'][name]
+
+# Registra un oggetto di stato creato per ogni applicazione con factory e restituisce il proxy verso quello dell'applicazione attiva
+def app_local(name, factory):
+    APP_STATE_FACTORIES[name] = factory
+    return LocalProxy(partial(app_state, name))
+
+# Crea lo stato di una nuova applicazione
+def init_app_state(app):
+    app.extensions['hotel'] = {name: factory() for name, factory in APP_STATE_FACTORIES.items()}
+
+
+####################################################
+# Catalogo delle stanze in memoria
+####################################################
+# Record immutabile e compatto di una stanza: __slots__ evita il dizionario per istanza
+# e gli attributi non possono essere modificati dopo la creazione, così lo stesso record può essere condiviso tra le richieste.
+class RoomRecord:
+    __slots__ = ('id', 'number', 'price', 'capacity', 'room_type', 'property_id', '_fragments')
+
+    def __init__(self, id, number, price, capacity, room_type, property_id):
+        object.__setattr__(self, 'id', id)
+        object.__setattr__(self, 'number', number)
+        object.__setattr__(self, 'price', price)
+        object.__setattr__(self, 'capacity', capacity)
+        object.__setattr__(self, 'room_type', room_type)
+        object.__setattr__(self, 'property_id', property_id)
+        object.__setattr__(self, '_fragments', {})
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RoomRecord è immutabile")
+
+    # Restituisce il dizionario con cui la stanza compare nelle risposte JSON nel formato indicato (vedi ROOM_FORMATS).
+    # Viene costruito una sola volta per record e riusato da tutte le risposte: il record è immutabile e viene sostituito
+    # quando il catalogo viene ricaricato, quindi non diventa mai obsoleto. Il dizionario restituito è condiviso e non va modificato.
+    # Si risparmia solo la costruzione del dizionario: la codifica in JSON avviene a ogni risposta, perché orjson 3.8
+    # non permette di inserire byte già codificati (orjson.Fragment richiede la versione 3.9) e il modulo json nemmeno.
+    def fragment(self, room_format):
+        fragment = self._fragments.get(room_format)
+        if fragment is None:
+            fragment = {key: getattr(self, attribute) for key, attribute in ROOM_FORMATS[room_format]}
+            self._fragments[room_format] = fragment
+        return fragment
+
+    def __repr__(self):
+        return f"RoomRecord(id={self.id}, number={self.number!r}, room_type={self.room_type!r})"
+
+# Formati con cui una stanza compare nelle risposte: coppie (campo JSON, attributo della stanza).
+# - 'suggestion': ricerche e suggerimenti
+# - 'booking': dettagli di una prenotazione creata, modificata o cancellata
+# - 'history': storico delle prenotazioni di un utente
+ROOM_FORMATS = {
+    'suggestion': (('id', 'id'), ('number', 'number'), ('price', 'price'), ('capacity', 'capacity'), ('room_type', 'room_type')),
+    'booking': (('room_id', 'id'), ('room_number', 'number'), ('room_type', 'room_type'), ('price', 'price')),
+    'history': (('id', 'id'), ('number', 'number'), ('type', 'room_type')),
+}
+
+# Converte una lista di stanze nel formato indicato, riusando i dizionari già costruiti (la codifica JSON resta per risposta)
+def serialize_rooms(rooms, room_format):
+    return [room.fragment(room_format) for room in rooms]
+
+# Catalogo di processo delle strutture e delle stanze.
+# I dati delle stanze (numero, prezzo, capacità, tipo) cambiano solo quando vengono create in create_rooms:
+# il catalogo li carica una volta con un'unica query e li serve senza SQL e senza costruire oggetti ORM a ogni richiesta.
+# Le stanze sono raggruppate anche per struttura, così una ricerca scorre solo le stanze della struttura richiesta.
+# Chi modifica le stanze deve chiamare invalidate(), così il catalogo viene ricaricato alla lettura successiva.
+class RoomCatalog:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rooms = ()
+        self._by_id = {}
+        self._by_property = {}
+        self._properties = {}
+        self._property_codes = {}
+        self._data = None
+        self._loaded = False
+        # Versione del catalogo: cambia quando un caricamento trova dati diversi e a ogni invalidazione
+        self.version = 0
+
+    # Carica tutte le strutture e tutte le stanze ordinate per ID.
+    # Se strutture e stanze non sono cambiate il catalogo resta quello attuale e la versione non cambia,
+    # così i risultati in cache e il calendario delle tariffe restano validi.
+    def load(self):
+        properties = {code: property_id for property_id, code in db.session.query(Property.id, Property.code).all()}
+        rows = tuple(tuple(row) for row in db.session.query(
+            Room.id, Room.number, Room.price, Room.capacity, Room.room_type, Room.property_id
+        ).order_by(Room.id).all())
+        if self._loaded and (properties, rows) == self._data:
+            return
+        rooms = tuple(RoomRecord(*row) for row in rows)
+        by_property = defaultdict(list)
+        for room in rooms:
+            by_property[room.property_id].append(room)
+        with self._lock:
+            self._rooms = rooms
+            self._by_id = {room.id: room for room in rooms}
+            self._by_property = {property_id: tuple(property_rooms) for property_id, property_rooms in by_property.items()}
+            self._properties = properties
+            self._property_codes = {property_id: code for code, property_id in properties.items()}
+            self._data = (properties, rows)
+            self._loaded = True
+            self.version += 1
+
+    # Carica il catalogo solo se non è ancora stato caricato
+    def ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+
+    # Svuota il catalogo: verrà ricaricato dal database alla prossima lettura
+    def invalidate(self):
+        with self._lock:
+            self._rooms = ()
+            self._by_id = {}
+            self._by_property = {}
+            self._properties = {}
+            self._property_codes = {}
+            self._data = None
+            self._loaded = False
+            self.version += 1
+
+    # Restituisce le stanze di una struttura (o di tutte le strutture se property_id è None), ordinate per ID
+    def all(self, property_id=None):
+        self.ensure_loaded()
+        if property_id is None:
+            return self._rooms
+        return self._by_property.get(property_id, ())
+
+    # Restituisce l'ID della struttura con il codice indicato; se non è presente (ad esempio creata con seed-property
+    # da un altro processo) ricarica il catalogo. Un codice inesistente viene verificato con una sola query sulla struttura,
+    # senza ricaricare il catalogo: le richieste con codici non validi non invalidano i dati delle altre strutture.
+    def property_id(self, code):
+        self.ensure_loaded()
+        property_id = self._properties.get(code)
+        if property_id is None and db.session.query(Property.id).filter_by(code=code).scalar() is not None:
+            self.load()
+            property_id = self._properties.get(code)
+        if property_id is None:
+            raise ValueError(f"Struttura {code} non trovata")
+        return property_id
+
+    # Restituisce il codice della struttura con l'ID indicato
+    def property_code(self, property_id):
+        self.ensure_loaded()
+        return self._property_codes.get(property_id)
+
+    # Restituisce la stanza con l'ID indicato; se non è presente (ad esempio creata da un altro processo) ricarica il catalogo,
+    # solo dopo aver verificato con una query sulla stanza che esista davvero
+    def get(self, room_id):
+        self.ensure_loaded()
+        room = self._by_id.get(room_id)
+        if room is None and db.session.query(Room.id).filter_by(id=room_id).scalar() is not None:
+            self.load()
+            room = self._by_id.get(room_id)
+        return room
+
+# Catalogo condiviso da tutte le richieste del processo, uno per applicazione
+room_catalog = app_local('room_catalog', RoomCatalog)
+
+
+####################################################
+# Calendario delle tariffe in memoria
+####################################################
+# Calendario di processo dei prezzi per notte.
+# Le tariffe (RoomRate) vengono applicate, in ordine di inserimento, a un array denso di prezzi per notte per ogni classe
+# di stanze con lo stesso prezzo (struttura, tipo, prezzo base), sull'intervallo di notti coperto dalle tariffe:
+# le notti fuori dall'intervallo, o non coperte da alcuna tariffa, costano il prezzo base della stanza.
+# Per ogni array vengono mantenute le somme prefisse, così il prezzo di un soggiorno è la differenza di due elementi:
+# O(1) per stanza indipendentemente dal numero di notti, e per più stanze un'unica operazione vettoriale.
+# Il calendario viene ricostruito quando cambiano le tariffe (anche da un altro processo, con sync_if_due) o il catalogo delle stanze.
+class RateCalendar:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Stato sostituito in blocco a ogni caricamento, così le letture non richiedono il lock:
+        # (righe per classe, somme prefisse classi × (notti + 1), prima notte, numero di notti)
+        self._state = ({}, np.zeros((0, 1)), None, 0)
+        self._signature = None
+        self._catalog_version = None
+        self._last_sync = 0.0
+        # Versione del calendario: cambia a ogni caricamento, così i risultati in cache calcolati con le tariffe precedenti diventano obsoleti
+        self.version = 0
+
+    # Identifica l'insieme delle tariffe: le tariffe non vengono modificate, solo aggiunte o eliminate, e i loro ID
+    # non vengono mai riassegnati (AUTOINCREMENT), quindi ogni aggiunta cambia l'ID massimo e ogni eliminazione il numero
+    def _read_signature(self):
+        return tuple(db.session.query(func.count(RoomRate.id), func.max(RoomRate.id)).one())
+
+    # Costruisce gli array dei prezzi per notte e le relative somme prefisse a partire dalle tariffe e dal catalogo delle stanze
+    def load(self):
+        with self._lock:
+            signature = self._read_signature()
+            catalog_version = room_catalog.version
+            rates = db.session.query(
+                RoomRate.property_id, RoomRate.room_type, RoomRate.start_date, RoomRate.end_date, RoomRate.weekdays, RoomRate.price
+            ).order_by(RoomRate.id).all()
+
+            # Una riga per classe di stanze: le stanze della stessa classe hanno sempre lo stesso prezzo per notte
+            classes = sorted({(room.property_id, room.room_type, room.price) for room in room_catalog.all()})
+            rows = {room_class: row for row, room_class in enumerate(classes)}
+            rows_by_type = defaultdict(list)
+            for (property_id, room_type, base_price), row in rows.items():
+                rows_by_type[(property_id, room_type)].append(row)
+
+            origin = min((rate.start_date for rate in rates), default=None)
+            days = (max(rate.end_date for rate in rates) - origin).days if rates else 0
+            prices = np.repeat(np.array([base_price for _, _, base_price in classes], dtype=float).reshape(-1, 1), days, axis=1)
+            if rates:
+                night_weekdays = (origin.weekday() + np.arange(days)) % 7
+                for property_id, room_type, start_date, end_date, weekdays, price in rates:
+                    type_rows = rows_by_type.get((property_id, room_type))
+                    if not type_rows:
+                        continue
+                    start, end = (start_date - origin).days, (end_date - origin).days
+                    nights = np.arange(start, end)
+                    if weekdays:
+                        nights = nights[np.isin(night_weekdays[start:end], [int(day) for day in weekdays.split(',')])]
+                    prices[np.ix_(type_rows, nights)] = price
+            prefix = np.zeros((len(classes), days + 1))
+            np.cumsum(prices, axis=1, out=prefix[:, 1:])
+
+            self._state = (rows, prefix, origin, days)
+            self._signature = signature
+            self._catalog_version = catalog_version
+            self._last_sync = time.monotonic()
+            self.version += 1
+
+    # Ricostruisce il calendario se non è ancora stato caricato o se il catalogo delle stanze è cambiato
+    def ensure_loaded(self):
+        if self._catalog_version != room_catalog.version:
+            self.load()
+
+    # Righe degli array delle stanze indicate, ricostruendo il calendario se una stanza appartiene a una classe non ancora nota
+    def _rows_of(self, rooms):
+        self.ensure_loaded()
+        state = self._state
+        try:
+            return state, np.fromiter((state[0][(room.property_id, room.room_type, room.price)] for room in rooms), dtype=int, count=len(rooms))
+        except KeyError:
+            self.load()
+            state = self._state
+            return state, np.fromiter((state[0][(room.property_id, room.room_type, room.price)] for room in rooms), dtype=int, count=len(rooms))
+
+    # Prezzi dei soggiorni [check_in, check_out) delle stanze indicate, come array NumPy, in un'unica operazione vettoriale.
+    # Le notti dentro l'intervallo del calendario si leggono dalle somme prefisse, quelle fuori costano il prezzo base.
+    def stay_prices(self, rooms, check_in, check_out):
+        base_prices = np.array([room.price for room in rooms], dtype=float)
+        nights = (check_out - check_in).days
+        (_, prefix, origin, days), rows = self._rows_of(rooms)
+        if origin is None:
+            return base_prices * nights
+        start = min(max((check_in - origin).days, 0), days)
+        end = min(max((check_out - origin).days, 0), days)
+        return np.round(prefix[rows, end] - prefix[rows, start] + (nights - (end - start)) * base_prices, 2)
+
+    # Prezzi per notte delle stanze indicate nel soggiorno [check_in, check_out), come matrice stanze × notti
+    def nightly_prices(self, rooms, check_in, check_out):
+        base_prices = np.array([room.price for room in rooms], dtype=float)
+        prices = np.repeat(base_prices.reshape(-1, 1), (check_out - check_in).days, axis=1)
+        (_, prefix, origin, days), rows = self._rows_of(rooms)
+        if origin is not None:
+            start = min(max((check_in - origin).days, 0), days)
+            end = min(max((check_out - origin).days, 0), days)
+            if end > start:
+                offset = start - (check_in - origin).days
+                prices[:, offset:offset + end - start] = np.diff(prefix[rows, start:end + 1], axis=1)
+        return prices
+
+    # Ricarica il calendario se sono trascorsi almeno INVENTORY_SYNC_SECONDS secondi dall'ultimo controllo
+    # e nel frattempo le tariffe sono cambiate (ad esempio aggiunte da un altro processo)
+    def sync_if_due(self):
+        if not INVENTORY_SYNC_SECONDS or self._catalog_version is None or time.monotonic() - self._last_sync < INVENTORY_SYNC_SECONDS:
+            return
+        self._last_sync = time.monotonic()
+        if self._read_signature() != self._signature:
+            self.load()
+
+# Calendario condiviso da tutte le richieste del processo, uno per applicazione
+rate_calendar = app_local('rate_calendar', RateCalendar)
+
+# Aggiunge una tariffa per le notti [start_date, end_date) delle stanze di un tipo di una struttura, eventualmente solo
+# in alcuni giorni della settimana (0 = lunedì), e ricarica il calendario. La tariffa prevale su quelle aggiunte prima.
+def add_room_rate(room_type, start_date, end_date, price, property_code=None, weekdays=None):
+    try:
+        start = datetime.strptime(start_date, '%Y%m%d').date()
+        end = datetime.strptime(end_date, '%Y%m%d').date()
+        if end <= start:
+            raise ValueError("La data di fine deve essere successiva alla data di inizio.")
+        if price <= 0:
+            raise ValueError("Il prezzo deve essere positivo.")
+        property_id = resolve_property_id(property_code)
+        if not any(room.room_type == room_type for room in room_catalog.all(property_id)):
+            raise ValueError(f"Tipo di stanza {room_type} non presente nella struttura")
+        if weekdays:
+            days = sorted({int(day) for day in weekdays.split(',')})
+            if any(day < 0 or day > 6 for day in days):
+                raise ValueError("I giorni della settimana devono essere compresi tra 0 (lunedì) e 6 (domenica).")
+            weekdays = ','.join(str(day) for day in days)
+
+        rate = RoomRate(property_id=property_id, room_type=room_type, start_date=start, end_date=end, weekdays=weekdays or None, price=price)
+        db.session.add(rate)
+        db.session.commit()
+    except ValueError:
+        db.session.rollback()
+        raise
+    except Exception as e:
+        db.session.rollback()
+        raise Exception(f"Errore durante l'aggiunta della tariffa: {e}")
+    rate_calendar.load()
+    return rate
+
+
+####################################################
+# Indice di occupazione in memoria
+####################################################
+# Indice di processo delle occupazioni delle stanze.
+# Per ogni stanza mantiene la lista, ordinata per check-in, degli intervalli prenotati (check_in, check_out, booking_id).
+# Poiché una stanza non può avere due prenotazioni sovrapposte, anche i check-out risultano ordinati:
+# verificare se una stanza è libera costa quindi una ricerca binaria, O(log prenotazioni), senza alcuna query SQL.
+# L'indice viene costruito una sola volta (all'avvio o alla prima ricerca) con un'unica query su Booking/BookingRooms
+# e viene aggiornato da create_booking, cancel_booking_by_id e modify_booking dopo ogni commit andato a buon fine.
+class OccupancyIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        # room_id -> lista ordinata di (check_in, check_out, booking_id)
+        self._intervals = defaultdict(list)
+        # booking_id -> (check_in, check_out, [room_id, ...])
+        self._bookings = {}
+        self._loaded = False
+        # Versione dell'inventario: cambia a ogni modifica delle occupazioni, così i risultati in cache calcolati prima diventano obsoleti.
+        # version cambia quando l'intero indice viene ricaricato; le modifiche delle singole prenotazioni cambiano solo la versione
+        # della struttura a cui appartengono le stanze, così non invalidano i risultati delle altre strutture.
+        self.version = 0
+        self._property_versions = defaultdict(int)
+        # Stato della sincronizzazione con gli altri processi worker
+        self._sync_lock = threading.Lock()
+        self._synced_until = None
+        self._last_sync = 0.0
+
+    # Costruisce l'indice leggendo con una sola query tutte le associazioni prenotazione/stanza non cancellate
+    def load(self):
+        # Le prenotazioni modificate durante la lettura verranno riapplicate dalla prima sincronizzazione
+        loaded_at = datetime.utcnow()
+        rows = db.session.query(
+            Booking.id, Booking.check_in, Booking.check_out, BookingRooms.room_id
+        ).join(BookingRooms, BookingRooms.booking_id == Booking.id).filter(Booking.status != 'canceled').all()
+
+        intervals = defaultdict(list)
+        bookings = {}
+        for booking_id, check_in, check_out, room_id in rows:
+            intervals[room_id].append((check_in, check_out, booking_id))
+            bookings.setdefault(booking_id, (check_in, check_out, []))[2].append(room_id)
+        for room_intervals in intervals.values():
+            room_intervals.sort()
+
+        with self._lock:
+            self._intervals = intervals
+            self._bookings = bookings
+            self._loaded = True
+            self._synced_until = loaded_at
+            self._last_sync = time.monotonic()
+            self.version += 1
+
+    # Costruisce l'indice solo se non è ancora stato caricato
+    def ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.load()
+
+    # Svuota l'indice: verrà ricostruito dal database alla prossima ricerca
+    def invalidate(self):
+        with self._lock:
+            self._intervals = defaultdict(list)
+            self._bookings = {}
+            self._loaded = False
+            self.version += 1
+
+    # Versione delle occupazioni di una struttura
+    def version_of(self, property_id):
+        return (self.version, self._property_versions[property_id])
+
+    # Cambia la versione delle strutture a cui appartengono le stanze indicate
+    def _touch_locked(self, room_ids):
+        for property_id in {room.property_id for room in map(room_catalog.get, room_ids) if room is not None}:
+            self._property_versions[property_id] += 1
+
+    # Registra una prenotazione confermata (o ne sostituisce le stanze e le date se già presente)
+    def add_booking(self, booking_id, check_in, check_out, room_ids):
+        with self._lock:
+            self._touch_locked(room_ids)
+            # Se l'indice non è ancora stato costruito, la prenotazione verrà letta dal database al caricamento
+            if not self._loaded:
+                return
+            self._remove_locked(booking_id)
+            self._add_locked(booking_id, check_in, check_out, room_ids)
+
+    def _add_locked(self, booking_id, check_in, check_out, room_ids):
+        for room_id in room_ids:
+            bisect.insort(self._intervals[room_id], (check_in, check_out, booking_id))
+        self._bookings[booking_id] = (check_in, check_out, list(room_ids))
+
+    # Rimuove una prenotazione cancellata dall'indice
+    def remove_booking(self, booking_id):
+        with self._lock:
+            entry = self._bookings.get(booking_id)
+            if entry:
+                self._touch_locked(entry[2])
+            self._remove_locked(booking_id)
+
+    def _remove_locked(self, booking_id):
+        entry = self._bookings.pop(booking_id, None)
+        if not entry:
+            return
+        check_in, check_out, room_ids = entry
+        for room_id in room_ids:
+            room_intervals = self._intervals.get(room_id)
+            if not room_intervals:
+                continue
+            position = bisect.bisect_left(room_intervals, (check_in, check_out, booking_id))
+            if position < len(room_intervals) and room_intervals[position][2] == booking_id:
+                del room_intervals[position]
+
+    # Restituisce gli ID delle stanze associate a una prenotazione presente nell'indice
+    def booking_room_ids(self, booking_id):
+        with self._lock:
+            entry = self._bookings.get(booking_id)
+            return set(entry[2]) if entry else set()
+
+    def _is_free_locked(self, room_id, check_in, check_out, ignore_booking_id):
+        room_intervals = self._intervals.get(room_id)
+        if not room_intervals:
+            return True
+        # Primo intervallo che inizia dal check-out richiesto in poi: quelli successivi non possono sovrapporsi
+        position = bisect.bisect_left(room_intervals, (check_out,))
+        # Risale gli intervalli precedenti: il primo che termina entro il check-in chiude la ricerca
+        while position > 0:
+            position -= 1
+            interval_check_in, interval_check_out, booking_id = room_intervals[position]
+            if booking_id == ignore_booking_id:
+                continue
+            return interval_check_out <= check_in
+        return True
+
+    # Verifica se una stanza è libera nell'intervallo [check_in, check_out), eventualmente ignorando una prenotazione
+    def is_room_free(self, room_id, check_in, check_out, ignore_booking_id=None):
+        with self._lock:
+            return self._is_free_locked(room_id, check_in, check_out, ignore_booking_id)
+
+    # Filtra le stanze libere nell'intervallo richiesto: O(stanze × log prenotazioni)
+    def filter_available(self, rooms, check_in, check_out, ignore_booking_id=None):
+        with self._lock:
+            return [room for room in rooms if self._is_free_locked(room.id, check_in, check_out, ignore_booking_id)]
+
+    # Restituisce gli intervalli (room_id, check_in, check_out) che si sovrappongono a [start, end), senza query SQL,
+    # limitati alle stanze indicate (ad esempio quelle di una struttura) o estesi a tutte le stanze se room_ids è None
+    def overlapping_intervals(self, start, end, room_ids=None):
+        result = []
+        with self._lock:
+            if room_ids is None:
+                room_ids = list(self._intervals)
+            for room_id in room_ids:
+                room_intervals = self._intervals.get(room_id)
+                if not room_intervals:
+                    continue
+                position = bisect.bisect_left(room_intervals, (end,))
+                while position > 0:
+                    position -= 1
+                    interval_check_in, interval_check_out, booking_id = room_intervals[position]
+                    if interval_check_out <= start:
+                        break
+                    result.append((room_id, interval_check_in, interval_check_out))
+        return result
+
+    # Rilegge dal database le occupazioni delle stanze indicate, ad esempio dopo un conflitto con un'altra richiesta concorrente
+    def reload_rooms(self, room_ids):
+        room_ids = set(room_ids)
+        if not room_ids:
+            return
+        rows = db.session.query(
+            Booking.id, Booking.check_in, Booking.check_out, BookingRooms.room_id
+        ).join(BookingRooms, BookingRooms.booking_id == Booking.id).filter(
+            BookingRooms.room_id.in_(room_ids), Booking.status != 'canceled'
+        ).all()
+
+        with self._lock:
+            self._touch_locked(room_ids)
+            if not self._loaded:
+                return
+            for room_id in room_ids:
+                self._intervals[room_id] = []
+            for booking_id, check_in, check_out, room_id in rows:
+                self._intervals[room_id].append((check_in, check_out, booking_id))
+                entry = self._bookings.setdefault(booking_id, (check_in, check_out, []))
+                if room_id not in entry[2]:
+                    entry[2].append(room_id)
+            for room_id in room_ids:
+                self._intervals[room_id].sort()
+
+    # Applica all'indice le prenotazioni create, modificate o cancellate dagli altri processi worker.
+    # Ogni processo mantiene il proprio indice: vengono rilette le prenotazioni con updated_at successivo all'ultima
+    # sincronizzazione, meno INVENTORY_SYNC_LOOKBACK secondi per includere le transazioni confermate in ritardo.
+    # Riapplicare una prenotazione già presente non cambia l'indice né la sua versione.
+    def sync(self):
+        if not self._loaded or not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            synced_until = datetime.utcnow()
+            rows = db.session.query(
+                Booking.id, Booking.check_in, Booking.check_out, Booking.status, BookingRooms.room_id
+            ).join(BookingRooms, BookingRooms.booking_id == Booking.id).filter(
+                Booking.updated_at >= self._synced_until - timedelta(seconds=INVENTORY_SYNC_LOOKBACK)
+            ).all()
+
+            changed = {}
+            for booking_id, check_in, check_out, status, room_id in rows:
+                changed.setdefault(booking_id, (check_in, check_out, status, []))[3].append(room_id)
+            # Le prenotazioni archiviate da un altro processo non sono più in Booking: vengono rimosse dall'indice
+            archived_ids = [booking_id for (booking_id,) in db.session.query(ArchivedBooking.id).filter(
+                ArchivedBooking.archived_at >= self._synced_until - timedelta(seconds=INVENTORY_SYNC_LOOKBACK)
+            )]
+
+            with self._lock:
+                for booking_id in archived_ids:
+                    current = self._bookings.get(booking_id)
+                    if current:
+                        self._touch_locked(current[2])
+                        self._remove_locked(booking_id)
+                for booking_id, (check_in, check_out, status, room_ids) in changed.items():
+                    current = self._bookings.get(booking_id)
+                    if status == 'canceled':
+                        if current:
+                            self._touch_locked(current[2])
+                            self._remove_locked(booking_id)
+                    elif not current or current[:2] != (check_in, check_out) or set(current[2]) != set(room_ids):
+                        self._touch_locked(set(room_ids) | set(current[2] if current else ()))
+                        self._remove_locked(booking_id)
+                        self._add_locked(booking_id, check_in, check_out, room_ids)
+                self._synced_until = synced_until
+                self._last_sync = time.monotonic()
+        finally:
+            self._sync_lock.release()
+
+    # Sincronizza l'indice se sono trascorsi almeno INVENTORY_SYNC_SECONDS secondi dall'ultima sincronizzazione
+    def sync_if_due(self):
+        if INVENTORY_SYNC_SECONDS and self._loaded and time.monotonic() - self._last_sync >= INVENTORY_SYNC_SECONDS:
+            self.sync()
+
+# Indice condiviso da tutte le richieste del processo, uno per applicazione.
+# Nota: con più processi worker ogni processo mantiene il proprio indice, sincronizzato periodicamente con sync_if_due.
+occupancy_index = app_local('occupancy_index', OccupancyIndex)
+
+
+# Versione complessiva dell'inventario di una struttura: cambia quando cambiano le sue occupazioni, il catalogo delle stanze o le tariffe
+def inventory_version(property_id):
+    return (occupancy_index.version_of(property_id), room_catalog.version, rate_calendar.version)
+
+
+####################################################
+# Cache dei risultati
+####################################################
+# Cache LRU con scadenza (TTL) per i risultati delle ricerche.
+# Ogni voce è salvata insieme alla versione dell'inventario con cui è stata calcolata: se nel frattempo una prenotazione
+# è stata creata, cancellata o modificata la versione non coincide più e la voce viene scartata, quindi non si restituiscono mai risultati obsoleti.
+# Quando la cache è piena viene eliminata la voce usata meno di recente.
+class ResultCache:
+    def __init__(self, max_size, ttl_seconds):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.expirations = 0
+
+    # Restituisce il valore in cache per la chiave e la versione indicate, oppure None
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            entry_version, expires_at, value = entry
+            if entry_version != version:
+                # L'inventario è cambiato dopo il calcolo del risultato
+                del self._entries[key]
+                self.invalidations += 1
+                self.misses += 1
+                return None
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    # Salva un valore calcolato con la versione dell'inventario indicata
+    def put(self, key, version, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (version, time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    # Svuota la cache
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    # Restituisce i contatori della cache
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "expirations": self.expirations
+            }
+
+# Cache dei risultati partizionata per struttura: ogni struttura ha una propria cache LRU con la stessa dimensione massima,
+# così un picco di ricerche su un hotel non elimina né invalida i risultati degli altri
+class PartitionedResultCache:
+    def __init__(self, max_size, ttl_seconds):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._partitions = {}
+
+    # Restituisce la cache della partizione indicata, creandola se necessario
+    def partition(self, partition_key):
+        with self._lock:
+            cache = self._partitions.get(partition_key)
+            if cache is None:
+                cache = self._partitions[partition_key] = ResultCache(self.max_size, self.ttl_seconds)
+            return cache
+
+    def get(self, partition_key, key, version):
+        return self.partition(partition_key).get(key, version)
+
+    def put(self, partition_key, key, version, value):
+        self.partition(partition_key).put(key, version, value)
+
+    # Svuota tutte le partizioni
+    def clear(self):
+        with self._lock:
+            partitions = list(self._partitions.values())
+        for cache in partitions:
+            cache.clear()
+
+    # Restituisce i contatori sommati su tutte le partizioni e quelli di ciascuna partizione
+    def stats(self):
+        with self._lock:
+            partitions = dict(self._partitions)
+        partition_stats = {partition_key: cache.stats() for partition_key, cache in partitions.items()}
+        totals = {"size": 0, "max_size": self.max_size, "ttl_seconds": self.ttl_seconds,
+                  "hits": 0, "misses": 0, "evictions": 0, "invalidations": 0, "expirations": 0}
+        for stats in partition_stats.values():
+            for name in ("size", "hits", "misses", "evictions", "invalidations", "expirations"):
+                totals[name] += stats[name]
+        totals["partitions"] = partition_stats
+        return totals
+
+# Cache dei risultati di /rooms_per_type_and_suggestion, partizionata per struttura e configurabile dal file .env, una per applicazione
+suggestion_cache = app_local('suggestion_cache', partial(
+    PartitionedResultCache,
+    max_size=int(os.getenv('SUGGESTION_CACHE_SIZE', 1024)),
+    ttl_seconds=float(os.getenv('SUGGESTION_CACHE_TTL', 30))
+))
+
+
+####################################################
+# Hashing delle password
+####################################################
+# Eccezione sollevata quando il pool di hashing ha già raggiunto il numero massimo di operazioni in attesa
+class HashingOverloaded(Exception):
+    pass
+
+# Restituisce il metodo di hashing in forma completa, come Werkzeug lo scrive all'inizio dell'hash salvato
+# (ad esempio 'pbkdf2:sha256' diventa 'pbkdf2:sha256:1000000'), per confrontarlo con quello delle password esistenti
+def normalize_hash_method(method):
+    name, *args = method.split(':')
+    if name == 'pbkdf2':
+        hash_name = args[0] if len(args) > 0 else 'sha256'
+        iterations = int(args[1]) if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f"pbkdf2:{hash_name}:{iterations}"
+    if name == 'scrypt':
+        n, r, p = map(int, args) if args else (2**15, 8, 1)
+        return f"scrypt:{n}:{r}:{p}"
+    raise ValueError(f"Metodo di hashing non valido: {method}")
+
+# Pool limitato per il calcolo degli hash delle password.
+# L'hashing (pbkdf2/scrypt) è volutamente lento: eseguirlo nel thread della richiesta blocca il worker per tutta la durata.
+# Gli hash vengono calcolati da un pool di thread dedicato (hashlib rilascia il GIL, quindi i calcoli procedono in parallelo)
+# e al massimo max_pending operazioni possono essere in corso o in attesa: oltre questo limite la richiesta viene rifiutata
+# subito con HashingOverloaded, invece di accodarsi e saturare tutti i worker durante un picco di login.
+# Anche un'operazione rimasta in attesa oltre timeout secondi solleva HashingOverloaded: il calcolo prosegue nel pool
+# e ne libera il posto al termine, ma la richiesta non resta bloccata.
+class PasswordHasher:
+    def __init__(self, method, workers, max_pending, timeout):
+        self.method = method
+        self.normalized_method = normalize_hash_method(method)
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingOverloaded("Troppe richieste di autenticazione in corso, riprovare tra poco.")
+        try:
+            future = self._executor.submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise HashingOverloaded("Il calcolo dell'hash della password ha superato il tempo massimo, riprovare tra poco.")
+
+    # Calcola l'hash di una password con il metodo configurato
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    # Verifica una password rispetto all'hash salvato
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    # Indica se un hash salvato è stato calcolato con parametri diversi da quelli configurati
+    def needs_rehash(self, password_hash):
+        return password_hash.split('$', 1)[0] != self.normalized_method
+
+# Pool di hashing configurabile dal file .env, uno per applicazione
+password_hasher = app_local('password_hasher', partial(
+    PasswordHasher,
+    method=os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256'),
+    workers=int(os.getenv('PASSWORD_HASH_WORKERS', os.cpu_count() or 2)),
+    max_pending=int(os.getenv('PASSWORD_HASH_MAX_PENDING', 32)),
+    timeout=float(os.getenv('PASSWORD_HASH_TIMEOUT', 30))
+))
+
+# Secondi suggeriti al client prima di riprovare quando il pool di hashing è saturo
+PASSWORD_HASH_RETRY_AFTER = 1
+
+
+####################################################
+# Autorizzazione
+####################################################
+# Dati stabili dell'utente inclusi nel token come claim aggiuntivi da /register e /login:
+# le decisioni di autorizzazione si prendono leggendo il token, senza recuperare l'utente dal database a ogni richiesta
+def user_claims(user):
+    return {"role": user.role or 'user', "username": user.username}
+
+# Cache con scadenza (TTL) dei pochi dati dell'utente che devono restare aggiornati anche con un token già emesso (il ruolo).
+# Ogni utente viene letto dal database al massimo una volta ogni ttl_seconds; quando la cache è piena
+# viene eliminato l'utente letto meno di recente.
+class UserCache:
+    def __init__(self, max_size, ttl_seconds):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    # Restituisce i dati aggiornati dell'utente ({"role": ...}), oppure None se l'utente non esiste
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        row = db.session.query(User.role).filter_by(id=user_id).first()
+        fields = {"role": row.role} if row else None
+        if self.max_size > 0:
+            with self._lock:
+                self._entries[user_id] = (time.monotonic() + self.ttl_seconds, fields)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return fields
+
+    # Scarta i dati in cache di un utente (ad esempio dopo un cambio di ruolo), o di tutti gli utenti
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+# Cache degli utenti configurabile dal file .env, una per applicazione
+user_cache = app_local('user_cache', partial(
+    UserCache,
+    max_size=int(os.getenv('USER_CACHE_SIZE', 10000)),
+    ttl_seconds=float(os.getenv('USER_CACHE_TTL', 30))
+))
+
+# Ruolo dell'utente autenticato letto dai claim del token.
+# I token emessi prima dell'introduzione dei claim non contengono il ruolo: in quel caso viene letto dalla cache degli utenti.
+def current_user_role():
+    role = get_jwt().get('role')
+    if role is None:
+        fields = user_cache.get(get_jwt_identity())
+        role = fields["role"] if fields else None
+    return role
+
+# Indica se l'utente autenticato è un amministratore.
+# Un utente senza il claim di amministratore non richiede alcuna query. Il claim di amministratore viene invece confermato
+# dalla cache degli utenti, così la revoca del ruolo ha effetto entro USER_CACHE_TTL secondi anche con un token già emesso.
+def is_admin():
+    if current_user_role() != 'admin':
+        return False
+    fields = user_cache.get(get_jwt_identity())
+    return fields is not None and fields["role"] == 'admin'
+
+# Decoratore per gli endpoint riservati agli amministratori: richiede un token valido di un utente con ruolo 'admin'
+def admin_required(fn):
+    @wraps(fn)
+    @jwt_required()
+    def wrapper(*args, **kwargs):
+        if not is_admin():
+            return jsonify({"error": "Operazione riservata agli amministratori"}), 403
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+####################################################
+# Controllo di ammissione
+####################################################
+# Durante i picchi di traffico (ad esempio una promozione) le ricerche e le prenotazioni si accumulano finché tutti
+# i worker sono occupati e la latenza cresce per tutti. Il controllo di ammissione limita il lavoro in corso:
+# - un limite di richieste al secondo (token bucket) per utente autenticato e, per le richieste anonime, per indirizzo IP: oltre il limite 429
+# - un numero massimo di richieste in esecuzione, complessivo e per endpoint: le richieste in eccesso attendono in coda
+# - una richiesta che resta in coda oltre ADMISSION_MAX_QUEUE_MS, o che trova la coda piena, viene scartata con 503
+# Le richieste in coda vengono ammesse in ordine di priorità: prima le scritture (prenotazioni, modifiche, cancellazioni),
+# poi le letture degli utenti autenticati, infine le ricerche anonime, che non possono occupare gli ultimi posti riservati alle scritture.
+ADMISSION_CONTROL = os.getenv('ADMISSION_CONTROL', 'True').lower() == 'true'
+
+# Priorità delle richieste in coda (valori più bassi vengono ammessi prima)
+PRIORITY_WRITE = 0
+PRIORITY_USER = 1
+PRIORITY_ANONYMOUS = 2
+
+# Limite di richieste al secondo per chiave (utente o indirizzo IP) con l'algoritmo token bucket:
+# ogni chiave dispone di burst gettoni che si ricaricano al ritmo di rate al secondo, e ogni richiesta ne consuma uno.
+# Con rate uguale a 0 il limite è disattivato. Vengono ricordate al massimo max_keys chiavi, eliminando quella usata meno di recente.
+class TokenBucketLimiter:
+    def __init__(self, rate, burst, max_keys=100000):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+        self.limited = 0
+
+    # Consuma un gettone della chiave indicata. Restituisce 0 se la richiesta è consentita,
+    # altrimenti i secondi da attendere prima che sia disponibile un nuovo gettone
+    def take(self, key):
+        if self.rate <= 0:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / self.rate
+                self.limited += 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+# Limita le richieste in esecuzione, complessivamente (max_concurrent) e per endpoint (endpoint_limits).
+# Le richieste che non possono partire subito attendono in coda fino a max_queue_seconds; quando una richiesta termina,
+# i posti liberi vengono assegnati direttamente alle richieste in coda in ordine di priorità e di arrivo, svegliando solo quelle ammesse.
+# Le richieste anonime non possono occupare gli ultimi reserved_for_writes posti e, con la coda piena,
+# una richiesta con priorità maggiore prende il posto in coda dell'ultima arrivata con priorità minore, che viene scartata.
+class AdmissionController:
+    def __init__(self, max_concurrent, reserved_for_writes, max_queue, max_queue_seconds, endpoint_limits):
+        self.max_concurrent = max_concurrent
+        self.reserved_for_writes = min(reserved_for_writes, max_concurrent - 1)
+        self.max_queue = max_queue
+        self.max_queue_seconds = max_queue_seconds
+        self.endpoint_limits = endpoint_limits
+        self._lock = threading.Lock()
+        self._active = 0
+        self._active_by_endpoint = defaultdict(int)
+        # Coda ordinata per (priorità, ordine di arrivo) e, per ogni voce, endpoint, evento da segnalare ed esito dell'attesa
+        self._waiting = []
+        self._waiters = {}
+        self._sequence = 0
+        self.admitted = 0
+        self.shed = 0
+
+    # Indica se una richiesta può partire con i posti attualmente liberi
+    def _can_start(self, endpoint, priority):
+        limit = self.max_concurrent - (self.reserved_for_writes if priority == PRIORITY_ANONYMOUS else 0)
+        return self._active < limit and self._active_by_endpoint[endpoint] < self.endpoint_limits.get(endpoint, self.max_concurrent)
+
+    def _start(self, endpoint):
+        self._active += 1
+        self._active_by_endpoint[endpoint] += 1
+        self.admitted += 1
+
+    # Assegna i posti liberi alle richieste in coda, in ordine di priorità e di arrivo
+    def _dispatch(self):
+        position = 0
+        while position < len(self._waiting) and self._active < self.max_concurrent:
+            key = self._waiting[position]
+            waiter = self._waiters[key]
+            if self._can_start(waiter["endpoint"], key[0]):
+                self._start(waiter["endpoint"])
+                del self._waiting[position]
+                del self._waiters[key]
+                waiter["admitted"] = True
+                waiter["event"].set()
+            else:
+                position += 1
+
+    # Attende un posto per una richiesta. Restituisce False se la richiesta va scartata (coda piena o attesa troppo lunga).
+    # Dopo ogni rilascio i posti liberi vengono assegnati alla coda, quindi le richieste in coda sono tutte bloccate da un limite:
+    # una nuova richiesta che può partire non toglie il posto a nessuna di esse.
+    def acquire(self, endpoint, priority):
+        with self._lock:
+            if self._can_start(endpoint, priority):
+                self._start(endpoint)
+                return True
+            if len(self._waiting) >= self.max_queue:
+                # Coda piena: la richiesta viene scartata, a meno che in coda ci sia una richiesta con priorità minore da scartare al suo posto
+                if self.max_queue <= 0 or self._waiting[-1][0] <= priority:
+                    self.shed += 1
+                    return False
+                evicted = self._waiters.pop(self._waiting.pop())
+                evicted["event"].set()
+            self._sequence += 1
+            key = (priority, self._sequence)
+            waiter = {"endpoint": endpoint, "event": threading.Event(), "admitted": False}
+            bisect.insort(self._waiting, key)
+            self._waiters[key] = waiter
+
+        waiter["event"].wait(self.max_queue_seconds)
+        with self._lock:
+            # Il posto potrebbe essere stato assegnato appena scaduta l'attesa
+            if not waiter["admitted"]:
+                if self._waiters.pop(key, None) is not None:
+                    self._waiting.remove(key)
+                self.shed += 1
+            return waiter["admitted"]
+
+    # Libera il posto occupato da una richiesta terminata e lo assegna alle richieste in coda
+    def release(self, endpoint):
+        with self._lock:
+            self._active -= 1
+            self._active_by_endpoint[endpoint] -= 1
+            self._dispatch()
+
+    # Restituisce i contatori del controllo di ammissione
+    def stats(self):
+        with self._lock:
+            return {
+                "active": self._active,
+                "waiting": len(self._waiting),
+                "admitted": self.admitted,
+                "shed": self.shed
+            }
+
+# Thread di ogni processo worker di gunicorn, letti dalla stessa variabile di gunicorn.conf.py.
+# Una richiesta in coda occupa un thread quanto una in esecuzione, e un worker non esegue mai più richieste dei suoi thread:
+# con limiti pari o superiori ai thread il controllo di ammissione non interverrebbe mai. Per questo i limiti di default
+# sono ricavati dai thread: metà eseguono richieste, fino a ADMISSION_RESERVED_FOR_WRITES thread restano sempre liberi
+# per le scritture in arrivo e i rimanenti ospitano la coda.
+SERVER_THREADS = int(os.getenv('GUNICORN_THREADS', 8))
+ADMISSION_MAX_CONCURRENT = int(os.getenv('ADMISSION_MAX_CONCURRENT', max(SERVER_THREADS // 2, 1)))
+ADMISSION_RESERVED_FOR_WRITES = int(os.getenv('ADMISSION_RESERVED_FOR_WRITES', max(SERVER_THREADS // 8, 1)))
+ADMISSION_MAX_QUEUE = int(os.getenv('ADMISSION_MAX_QUEUE', max(SERVER_THREADS - ADMISSION_MAX_CONCURRENT - ADMISSION_RESERVED_FOR_WRITES, 0)))
+
+# Numero massimo di richieste in esecuzione per endpoint, in proporzione a ADMISSION_MAX_CONCURRENT e sovrascrivibile
+# dal file .env con ADMISSION_<ENDPOINT>_CONCURRENCY (ad esempio ADMISSION_SEARCH_CONCURRENCY). Ricerche e calcoli
+# sono eseguiti in Python e si contendono il GIL: oltre pochi thread per processo non aumentano le richieste servite,
+# ma solo la latenza di ciascuna.
+ADMISSION_ENDPOINT_DEFAULTS = {
+    'search': max(ADMISSION_MAX_CONCURRENT // 2, 1),
+    'calendar': max(ADMISSION_MAX_CONCURRENT // 4, 1),
+    'book': ADMISSION_MAX_CONCURRENT,
+    'book_batch': 1,
+    'modify_booking': max(ADMISSION_MAX_CONCURRENT // 2, 1),
+    'cancel_booking': max(ADMISSION_MAX_CONCURRENT // 2, 1),
+}
+
+# Controllo di ammissione e limiti di richieste configurabili dal file .env, uno per applicazione
+admission_controller = app_local('admission_controller', partial(
+    AdmissionController,
+    max_concurrent=ADMISSION_MAX_CONCURRENT,
+    reserved_for_writes=ADMISSION_RESERVED_FOR_WRITES,
+    max_queue=ADMISSION_MAX_QUEUE,
+    max_queue_seconds=float(os.getenv('ADMISSION_MAX_QUEUE_MS', 500)) / 1000,
+    endpoint_limits={
+        endpoint: int(os.getenv(f'ADMISSION_{endpoint.upper()}_CONCURRENCY', limit))
+        for endpoint, limit in ADMISSION_ENDPOINT_DEFAULTS.items()
+    }
+))
+user_rate_limiter = app_local('user_rate_limiter', partial(
+    TokenBucketLimiter,
+    rate=float(os.getenv('RATE_LIMIT_USER_PER_SECOND', 10)),
+    burst=int(os.getenv('RATE_LIMIT_USER_BURST', 20))
+))
+ip_rate_limiter = app_local('ip_rate_limiter', partial(
+    TokenBucketLimiter,
+    rate=float(os.getenv('RATE_LIMIT_IP_PER_SECOND', 20)),
+    burst=int(os.getenv('RATE_LIMIT_IP_BURST', 40))
+))
+
+# Secondi suggeriti al client prima di riprovare quando una richiesta viene scartata per sovraccarico
+ADMISSION_RETRY_AFTER = int(os.getenv('ADMISSION_RETRY_AFTER', 1))
+
+# Identità dell'utente se la richiesta contiene un token valido, altrimenti None.
+# Un token non valido viene trattato come una richiesta anonima: sarà l'endpoint a rifiutarlo.
+def optional_jwt_identity():
+    try:
+        verify_jwt_in_request(optional=True)
+        return get_jwt_identity()
+    except Exception:
+        return None
+
+# Decoratore che applica il controllo di ammissione a un endpoint (write=True per le scritture, che hanno la priorità).
+# Va applicato prima di jwt_required, così le richieste in eccesso vengono scartate prima di qualsiasi altro lavoro.
+def admission_control(endpoint, write=False):
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ADMISSION_CONTROL:
+                return fn(*args, **kwargs)
+
+            # Limite di richieste al secondo: per utente se autenticato, altrimenti per indirizzo IP
+            # (gli utenti autenticati non condividono il limite di chi si collega dalla stessa rete)
+            identity = optional_jwt_identity()
+            if identity:
+                wait = user_rate_limiter.take(identity)
+            else:
+                wait = ip_rate_limiter.take(request.remote_addr)
+            if wait > 0:
+                return jsonify({"error": "Troppe richieste, riprovare più tardi"}), 429, {"Retry-After": str(int(wait) + 1)}
+
+            priority = PRIORITY_WRITE if write else PRIORITY_USER if identity else PRIORITY_ANONYMOUS
+            controller = app_state('admission_controller')
+            if not controller.acquire(endpoint, priority):
+                return jsonify({"error": "Servizio temporaneamente sovraccarico, riprovare più tardi"}), 503, {"Retry-After": str(ADMISSION_RETRY_AFTER)}
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                controller.release(endpoint)
+        return wrapper
+    return decorator
+
+
+####################################################
+# Metriche delle prestazioni
+####################################################
+# Istogramma cumulativo in formato Prometheus: per ogni soglia conta le osservazioni minori o uguali
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[position] += 1
+        self.sum += value
+        self.count += 1
+
+# Metriche delle richieste HTTP del processo, raccolte per endpoint e metodo:
+# latenza, numero di istruzioni SQL e tempo SQL per richiesta, dimensione della risposta e conteggio per codice di stato.
+# Con più processi worker ogni processo espone le proprie metriche.
+class RequestMetrics:
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    SQL_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+    SQL_TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+    SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = defaultdict(int)
+        self._histograms = {}
+
+    def _histogram(self, name, labels, buckets):
+        key = (name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram(buckets)
+        return histogram
+
+    # Registra una richiesta completata
+    def observe(self, endpoint, method, status, duration, sql_count, sql_time, response_size):
+        labels = (endpoint, method)
+        with self._lock:
+            self._requests[(endpoint, method, status)] += 1
+            self._histogram('hotel_http_request_duration_seconds', labels, self.LATENCY_BUCKETS).observe(duration)
+            self._histogram('hotel_http_request_sql_statements', labels, self.SQL_COUNT_BUCKETS).observe(sql_count)
+            self._histogram('hotel_http_request_sql_duration_seconds', labels, self.SQL_TIME_BUCKETS).observe(sql_time)
+            self._histogram('hotel_http_response_size_bytes', labels, self.SIZE_BUCKETS).observe(response_size)
+
+    # Restituisce le metriche nel formato testuale di Prometheus
+    def render(self):
+        descriptions = {
+            'hotel_http_request_duration_seconds': "Latenza delle richieste HTTP in secondi.",
+            'hotel_http_request_sql_statements': "Numero di istruzioni SQL eseguite per richiesta.",
+            'hotel_http_request_sql_duration_seconds': "Tempo speso in SQL per richiesta, in secondi.",
+            'hotel_http_response_size_bytes': "Dimensione del corpo della risposta in byte.",
+        }
+        lines = [
+            "# HELP hotel_http_requests_total Numero di richieste HTTP completate.",
+            "# TYPE hotel_http_requests_total counter",
+        ]
+        with self._lock:
+            for (endpoint, method, status), count in sorted(self._requests.items()):
+                lines.append(f'hotel_http_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}')
+            for name, description in descriptions.items():
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} histogram")
+                for (histogram_name, (endpoint, method)), histogram in sorted(self._histograms.items()):
+                    if histogram_name != name:
+                        continue
+                    labels = f'endpoint="{endpoint}",method="{method}"'
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+                    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                    lines.append(f'{name}_sum{{{labels}}} {histogram.sum}')
+                    lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+# Metriche delle richieste del processo
+request_metrics = RequestMetrics()
+
+# Soglia in millisecondi oltre la quale una richiesta viene registrata nel log insieme alle query SQL eseguite (0 per disattivare)
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', 0))
+
+# Conteggio e durata delle istruzioni SQL eseguite durante la richiesta corrente, tramite gli eventi dell'engine SQLAlchemy
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_sql_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_sql_statement(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start_time'].pop()
+    if not has_request_context() or 'sql_count' not in g:
+        return
+    g.sql_count += 1
+    g.sql_time += elapsed
+    if SLOW_REQUEST_MS:
+        g.sql_statements.append((elapsed, statement))
+
+@bp.before_app_request
+def start_request_metrics():
+    g.request_start_time = time.perf_counter()
+    g.sql_count = 0
+    g.sql_time = 0.0
+    g.sql_statements = []
+
+@bp.after_app_request
+def record_request_metrics(response):
+    if 'request_start_time' not in g:
+        return response
+    duration = time.perf_counter() - g.request_start_time
+    # Per le risposte in streaming la dimensione non è nota in anticipo
+    response_size = response.content_length or 0
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    request_metrics.observe(endpoint, request.method, response.status_code, duration, g.sql_count, g.sql_time, response_size)
+
+    # Registra le richieste lente con le query eseguite, così i pattern N+1 emergono subito
+    if SLOW_REQUEST_MS and duration * 1000 >= SLOW_REQUEST_MS:
+        statements = "\n".join(f"    {elapsed * 1000:.2f} ms  {statement}" for elapsed, statement in g.sql_statements)
+        current_app.logger.warning(
+            f"Richiesta lenta: {request.method} {request.path} {response.status_code} in {duration * 1000:.1f} ms, "
+            f"{g.sql_count} query SQL ({g.sql_time * 1000:.1f} ms)\n{statements}"
+        )
+    return response
+
+# Prima di ogni richiesta, se è il momento, allinea l'indice di occupazione e il calendario delle tariffe con le modifiche degli altri processi worker
+@bp.before_app_request
+def sync_occupancy_index():
+    occupancy_index.sync_if_due()
+    rate_calendar.sync_if_due()
+
+
+####################################################
+# Compressione delle risposte
+####################################################
+# Le risposte JSON e testuali più grandi di COMPRESSION_MIN_BYTES vengono compresse con brotli (se installato) o gzip,
+# in base all'header Accept-Encoding del client. Le risposte più piccole non vengono compresse: il risparmio di banda
+# non ripaga il tempo di compressione. Le risposte in streaming (esportazioni) non vengono compresse.
+COMPRESSION = os.getenv('COMPRESSION', 'True').lower() == 'true'
+COMPRESSION_MIN_BYTES = int(os.getenv('COMPRESSION_MIN_BYTES', 1024))
+COMPRESSION_GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', 6))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv('COMPRESSION_BROTLI_QUALITY', 4))
+COMPRESSIBLE_MIMETYPES = {'application/json', 'application/x-ndjson', 'text/csv', 'text/plain'}
+
+# Sceglie la codifica da usare tra quelle accettate dal client, preferendo brotli; None se il client non ne accetta nessuna
+def choose_content_encoding(accept_encodings):
+    if brotli is not None and accept_encodings.quality('br') > 0:
+        return 'br'
+    if accept_encodings.quality('gzip') > 0:
+        return 'gzip'
+    return None
+
+# Comprime i dati con la codifica indicata
+def compress_body(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=COMPRESSION_GZIP_LEVEL)
+
+# Registrato dopo record_request_metrics, viene eseguito prima di esso: le metriche riportano la dimensione compressa
+@bp.after_app_request
+def compress_response(response):
+    if (not COMPRESSION or response.is_streamed or response.direct_passthrough
+            or response.status_code < 200 or response.status_code in (204, 206, 304)
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES or 'Content-Encoding' in response.headers):
+        return response
+    # La risposta dipende dall'header Accept-Encoding anche quando è troppo piccola per essere compressa
+    response.vary.add('Accept-Encoding')
+    if (response.content_length or 0) < COMPRESSION_MIN_BYTES:
+        return response
+    encoding = choose_content_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+    response.set_data(compress_body(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
 ####################################################
 # Funzioni di utilità
 ####################################################
-def create_rooms():
-    # Verifica se ci sono già stanze nel database
-    if Room.query.count() == 0:
+# Restituisce la struttura predefinita, creandola se non esiste ancora (senza eseguire il commit)
+def ensure_default_property():
+    default_property = Property.query.filter_by(code=DEFAULT_PROPERTY_CODE).first()
+    if default_property is None:
+        default_property = Property(code=DEFAULT_PROPERTY_CODE, name=DEFAULT_PROPERTY_NAME)
+        db.session.add(default_property)
+        db.session.flush()
+    return default_property
+
+# Crea le stanze di una struttura (di default quella predefinita), se non ne ha ancora.
+# Prezzi e capacità vengono letti dal file .env; le quantità per tipo si possono indicare in quantities,
+# altrimenti vengono lette anch'esse dal file .env.
+def create_rooms(property_id=None, quantities=None):
+    if property_id is None:
+        property_id = ensure_default_property().id
+        db.session.commit()
+
+    # Verifica se ci sono già stanze nella struttura
+    if Room.query.filter_by(property_id=property_id).count() == 0:
         rooms = []
 
         try:
@@ -212,9 +2049,10 @@ def create_rooms():
             standard_capacity = int(os.getenv('ROOM_STANDARD_CAPACITY'))
             superior_capacity = int(os.getenv('ROOM_SUPERIOR_CAPACITY'))
             suite_capacity = int(os.getenv('ROOM_SUITE_CAPACITY'))
-            standard_quantity = int(os.getenv('ROOM_STANDARD_QUANTITY'))
-            superior_quantity = int(os.getenv('ROOM_SUPERIOR_QUANTITY'))
-            suite_quantity = int(os.getenv('ROOM_SUITE_QUANTITY'))
+            quantities = quantities or {}
+            standard_quantity = int(quantities.get('standard', os.getenv('ROOM_STANDARD_QUANTITY')))
+            superior_quantity = int(quantities.get('superior', os.getenv('ROOM_SUPERIOR_QUANTITY')))
+            suite_quantity = int(quantities.get('suite', os.getenv('ROOM_SUITE_QUANTITY')))
 
         # Gestisce gli errori di tipo e di valore delle variabili d'ambiente
         except TypeError as e:
@@ -227,6 +2065,7 @@ def create_rooms():
         # Crea stanze di tipo standard
         for i in range(1, standard_quantity + 1):
             rooms.append(Room(
+                property_id=property_id,
                 number=f"{100+i}",
                 price=standard_price,
                 capacity=standard_capacity,
@@ -236,6 +2075,7 @@ def create_rooms():
         # Crea stanze di tipo superior
         for i in range(standard_quantity + 1, standard_quantity + superior_quantity + 1):
             rooms.append(Room(
+                property_id=property_id,
                 number=f"{200+i}",
                 price=superior_price,
                 capacity=superior_capacity,
@@ -245,6 +2085,7 @@ def create_rooms():
         # Crea stanze di tipo suite
         for i in range(standard_quantity + superior_quantity + 1, standard_quantity + superior_quantity + suite_quantity + 1):
             rooms.append(Room(
+                property_id=property_id,
                 number=f"{300+i}",
                 price=suite_price,
                 capacity=suite_capacity,
@@ -255,6 +2096,8 @@ def create_rooms():
             # Salva tutte le stanze create nel database
             db.session.bulk_save_objects(rooms)
             db.session.commit()
+            # Le stanze sono cambiate: il catalogo verrà ricaricato alla prossima lettura
+            room_catalog.invalidate()
             print(f"{len(rooms)} stanze create.")
         except Exception as e:
             # Gestisce gli errori durante il salvataggio delle stanze e annulla la transazione
@@ -262,9 +2105,13 @@ def create_rooms():
             print(f"Errore durante la creazione delle stanze: {e}")
     else:
         # Messaggio se le stanze sono già presenti nel database
-        print("Le stanze sono già presenti nel database.")
+        print("Le stanze della struttura sono già presenti nel database.")
+
+# Restituisce l'ID della struttura con il codice indicato, o della struttura predefinita se il codice manca
+def resolve_property_id(code=None):
+    return room_catalog.property_id(code or DEFAULT_PROPERTY_CODE)
 
-def get_available_rooms(check_in_date, check_out_date, old_booking_id=None):
+def get_available_rooms(check_in_date, check_out_date, old_booking_id=None, property_id=None):
     try:
         # Converte le date in oggetti datetime
         check_in = datetime.strptime(check_in_date, '%Y%m%d').date()
@@ -276,30 +2123,15 @@ def get_available_rooms(check_in_date, check_out_date, old_booking_id=None):
         if check_out < check_in:
             raise ValueError("La data di check-out non può essere precedente alla data di check-in.")
 
-        # Recupera tutte le stanze dal database
-        all_rooms = Room.query.all()
-
-        # Recupera le prenotazioni che si sovrappongono con l'intervallo di date specificato e che non sono cancellate
-        overlapping_bookings = Booking.query.filter(
-            and_(
-                Booking.check_in < check_out,
-                Booking.check_out > check_in,
-                Booking.status != 'canceled'
-            )
-        ).all()
-
-        # Ottiene gli ID delle stanze che sono prenotate
-        booked_room_ids = {booking_room.room_id for booking in overlapping_bookings for booking_room in booking.rooms}
+        # Recupera dal catalogo in memoria le stanze della struttura: il costo dipende dalle sue dimensioni, non dall'intera flotta
+        all_rooms = room_catalog.all(property_id or resolve_property_id())
 
-        # Se old_booking_id è presente, escludi le stanze di quella prenotazione dagli ID delle stanze prenotate
-        if old_booking_id:
-            old_booking = Booking.query.filter_by(id=old_booking_id).first()
-            if old_booking:
-                old_booking_room_ids = {room.room_id for room in old_booking.rooms}
-                booked_room_ids -= old_booking_room_ids
+        # Se old_booking_id è presente, le stanze di quella prenotazione vengono considerate libere
+        ignore_booking_id = int(old_booking_id) if old_booking_id else None
 
-        # Filtra le stanze prenotate
-        available_rooms = [room for room in all_rooms if room.id not in booked_room_ids]
+        # Filtra le stanze prenotate usando l'indice di occupazione in memoria, senza query sulle prenotazioni
+        occupancy_index.ensure_loaded()
+        available_rooms = occupancy_index.filter_available(all_rooms, check_in, check_out, ignore_booking_id)
 
         # Restituisce le stanze disponibili
         return available_rooms
@@ -307,30 +2139,291 @@ def get_available_rooms(check_in_date, check_out_date, old_booking_id=None):
         # Gestisce eventuali errori durante il recupero delle stanze disponibili
         raise Exception(f"{e}")
 
+# Serializza le righe (prenotazione, ID stanza) prodotte da una query con join in una lista di prenotazioni.
+# Le righe devono essere ordinate per prenotazione: quelle consecutive con lo stesso ID vengono raggruppate.
+# Il prezzo totale è quello addebitato e salvato sulla prenotazione, senza ricalcolarlo dalle tariffe.
+# I dati delle stanze vengono letti dal catalogo in memoria.
+def serialize_booking_rows(rows):
+    bookings_list = []
+    current = None
+    for booking_id, check_in, check_out, guests, status, property_id, total_price, room_id, created_at in rows:
+        if current is None or current["id"] != booking_id:
+            current = {
+                "id": booking_id,
+                "property": room_catalog.property_code(property_id),
+                "check_in": check_in.strftime('%d/%m/%Y'),
+                "check_out": check_out.strftime('%d/%m/%Y'),
+                "guests": guests,
+                "status": status,
+                "rooms": [],
+                "total_price": total_price
+            }
+            bookings_list.append(current)
+        # Con il join esterno una prenotazione senza stanze produce una riga con la stanza a None
+        if room_id is not None:
+            room = room_catalog.get(room_id)
+            current["rooms"].append(room.fragment('history'))
+    return bookings_list
+
+# Costruisce la query che recupera in un'unica volta le prenotazioni non cancellate di un utente, insieme agli ID delle stanze associate,
+# ordinate per data di creazione decrescente: il numero di query non dipende dal numero di prenotazioni.
+# booking_model e rooms_model indicano le tabelle da leggere: quelle attive (default) o quelle archiviate.
+def user_bookings_query(user_id, booking_model=Booking, rooms_model=BookingRooms):
+    return db.session.query(
+        booking_model.id, booking_model.check_in, booking_model.check_out, booking_model.guests, booking_model.status,
+        booking_model.property_id, booking_model.total_price, rooms_model.room_id, booking_model.created_at
+    ).outerjoin(rooms_model, rooms_model.booking_id == booking_model.id
+    ).filter(booking_model.user_id == user_id, booking_model.status != 'canceled'
+    ).order_by(booking_model.created_at.desc(), booking_model.id.desc(), rooms_model.id)
+
+# Recupera le righe dello storico di un utente dalle prenotazioni attive e da quelle archiviate, eventualmente solo per gli ID indicati.
+# Ogni tabella viene letta nell'ordine del proprio indice (user_id, created_at) e le due sequenze vengono fuse mantenendo
+# l'ordine per data di creazione decrescente: una query per tabella, indipendentemente dal numero di prenotazioni.
+def user_bookings_rows(user_id, booking_ids=None):
+    results = []
+    for booking_model, rooms_model in BOOKING_TABLES:
+        query = user_bookings_query(user_id, booking_model, rooms_model)
+        if booking_ids is not None:
+            query = query.filter(booking_model.id.in_(booking_ids))
+        results.append(query.all())
+    return list(heapq.merge(*results, key=lambda row: (row.created_at, row.id), reverse=True))
+
 # Recupera le prenotazioni di un utente dal database dalla più recente
 def get_user_bookings(user_id):
     try:
-        # Recupera tutte le prenotazioni per un dato utente con status diverso da 'canceled' e le ordina per data di creazione decrescente
-        bookings = Booking.query.filter_by(user_id=user_id).filter(Booking.status != 'canceled').order_by(Booking.created_at.desc()).all()
-        
+        # Recupera le prenotazioni dell'utente e le relative stanze, attive e archiviate
+        rows = user_bookings_rows(user_id)
+
         # Crea una lista di dizionari con i dettagli delle prenotazioni
-        bookings_list = [{
-            "id": booking.id,
-            "check_in": booking.check_in.strftime('%d/%m/%Y'),
-            "check_out": booking.check_out.strftime('%d/%m/%Y'),
-            "guests": booking.guests,
-            "status": booking.status,
-            "rooms": [{"id": room.room.id, "number": room.room.number, "type": room.room.room_type} for room in booking.rooms],
-            "total_price": sum(room.room.price * (booking.check_out - booking.check_in).days for room in booking.rooms)
-        } for booking in bookings]
-        
+        bookings_list = serialize_booking_rows(rows)
+
         # Restituisce la lista delle prenotazioni
         return bookings_list
     except Exception as e:
         # Gestisce eventuali errori durante il recupero delle prenotazioni
         raise Exception(f"Errore durante il recupero delle prenotazioni: {e}")
 
-def create_booking(user_id, check_in, check_out, guests, room_types):
+# Numero di prenotazioni per pagina di default e massimo per /user_bookings
+USER_BOOKINGS_PAGE_SIZE = 20
+USER_BOOKINGS_MAX_PAGE_SIZE = 100
+
+# Codifica la posizione (created_at, id) dell'ultima prenotazione di una pagina in un cursore opaco
+def encode_bookings_cursor(created_at, booking_id):
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{booking_id}".encode()).decode()
+
+# Decodifica un cursore di paginazione in (created_at, id)
+def decode_bookings_cursor(cursor):
+    try:
+        created_at, booking_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), int(booking_id)
+    except Exception:
+        raise ValueError("Cursore di paginazione non valido.")
+
+# Recupera una pagina delle prenotazioni di un utente con paginazione keyset su (created_at, id), dalla più recente.
+# Invece di OFFSET, ogni pagina riparte dalla posizione dell'ultima prenotazione della pagina precedente:
+# il costo di una pagina non dipende da quante prenotazioni la precedono e l'indice (user_id, created_at) viene usato direttamente.
+# window può essere 'upcoming' (soggiorni non ancora conclusi) o 'past' (soggiorni conclusi).
+def get_user_bookings_page(user_id, limit=None, cursor=None, window=None):
+    try:
+        limit = limit or USER_BOOKINGS_PAGE_SIZE
+        if limit <= 0 or limit > USER_BOOKINGS_MAX_PAGE_SIZE:
+            raise ValueError(f"Il numero di prenotazioni per pagina deve essere compreso tra 1 e {USER_BOOKINGS_MAX_PAGE_SIZE}.")
+
+        if window not in (None, 'all', 'upcoming', 'past'):
+            raise ValueError("La finestra deve essere 'upcoming', 'past' o 'all'.")
+        cursor_position = decode_bookings_cursor(cursor) if cursor else None
+        today = datetime.utcnow().date()
+
+        # La pagina viene cercata sia tra le prenotazioni attive sia tra quelle archiviate
+        candidates = []
+        for booking_model, _ in BOOKING_TABLES:
+            page_query = db.session.query(booking_model.id, booking_model.created_at).filter(
+                booking_model.user_id == user_id, booking_model.status != 'canceled'
+            )
+
+            # Filtra per finestra temporale rispetto alla data odierna
+            if window == 'upcoming':
+                page_query = page_query.filter(booking_model.check_out >= today)
+            elif window == 'past':
+                page_query = page_query.filter(booking_model.check_out < today)
+
+            # Riparte dalla posizione indicata dal cursore
+            if cursor_position:
+                cursor_created_at, cursor_id = cursor_position
+                page_query = page_query.filter(or_(
+                    booking_model.created_at < cursor_created_at,
+                    and_(booking_model.created_at == cursor_created_at, booking_model.id < cursor_id)
+                ))
+
+            # Legge una prenotazione in più per sapere se esiste una pagina successiva
+            candidates.append(page_query.order_by(booking_model.created_at.desc(), booking_model.id.desc()).limit(limit + 1).all())
+
+        # Fonde le due sequenze ordinate e tiene le prime limit + 1 prenotazioni
+        page = list(itertools.islice(heapq.merge(*candidates, key=lambda row: (row.created_at, row.id), reverse=True), limit + 1))
+        has_more = len(page) > limit
+        page = page[:limit]
+
+        # Recupera i dettagli e le stanze delle prenotazioni della pagina
+        bookings_list = []
+        if page:
+            rows = user_bookings_rows(user_id, [booking_id for booking_id, _ in page])
+            bookings_list = serialize_booking_rows(rows)
+
+        return {
+            "bookings": bookings_list,
+            "next_cursor": encode_bookings_cursor(page[-1][1], page[-1][0]) if has_more else None
+        }
+    except ValueError:
+        raise
+    except Exception as e:
+        raise Exception(f"Errore durante il recupero delle prenotazioni: {e}")
+
+# Calcola l'ETag dello storico prenotazioni di un utente a partire dalla versione del suo storico e dai parametri della richiesta.
+# Con una finestra temporale il risultato dipende anche dalla data odierna, che entra quindi nell'ETag.
+def user_bookings_etag(user_id, bookings_version, query_string, window=None):
+    today = datetime.utcnow().date().isoformat() if window in ('upcoming', 'past') else ''
+    return hashlib.sha1(f"{user_id}|{bookings_version}|{query_string}|{today}".encode()).hexdigest()
+
+# Incrementa, nella transazione corrente, la versione dello storico prenotazioni di un utente
+def bump_bookings_version(user_id):
+    User.query.filter_by(id=user_id).update(
+        {User.bookings_version: User.bookings_version + 1}, synchronize_session=False
+    )
+
+# Restituisce le notti di un soggiorno: dalla data di check-in inclusa a quella di check-out esclusa
+def stay_nights(check_in, check_out):
+    return [check_in + timedelta(days=offset) for offset in range((check_out - check_in).days)]
+
+# Seleziona una stanza disponibile per ciascun tipo richiesto.
+# La scelta tra le stanze dello stesso tipo è casuale, così le richieste concorrenti per le stesse date
+# tendono a contendersi stanze diverse invece di scontrarsi tutte sulla prima stanza libera.
+def select_rooms_by_type(available_rooms, room_types):
+    # Raggruppa le stanze disponibili per tipo
+    available_rooms_by_type = {}
+    for room in available_rooms:
+        available_rooms_by_type.setdefault(room.room_type, []).append(room)
+
+    # Seleziona le stanze in base ai tipi richiesti
+    selected_rooms = []
+    for room_type in room_types:
+        candidates = available_rooms_by_type.get(room_type)
+        if not candidates:
+            raise ValueError(f"Stanze di tipo {room_type} non disponibili per il periodo richiesto")
+        selected_rooms.append(candidates.pop(random.randrange(len(candidates))))
+    return selected_rooms
+
+# Aggiunge alla sessione corrente le associazioni prenotazione/stanza e le notti occupate, senza eseguire il commit
+def add_booking_rooms(booking_id, check_in, check_out, rooms, prices):
+    nights = stay_nights(check_in, check_out)
+    db.session.execute(insert(BookingRooms), [
+        {"booking_id": booking_id, "room_id": room.id, "nightly_prices": encode_nightly_prices(room_prices)}
+        for room, room_prices in zip(rooms, prices)
+    ])
+    db.session.execute(insert(RoomNight), [
+        {"room_id": room.id, "night": night, "booking_id": booking_id} for room in rooms for night in nights
+    ])
+
+# Prezzi per notte addebitati per le stanze di un soggiorno secondo le tariffe in vigore: una lista per stanza, arrotondata al centesimo.
+# Con total_price i prezzi vengono riproporzionati in modo che il loro totale sia esattamente total_price.
+def charged_nightly_prices(rooms, check_in, check_out, total_price=None):
+    prices = rate_calendar.nightly_prices(rooms, check_in, check_out)
+    if total_price is not None and prices.sum():
+        prices = prices * (total_price / prices.sum())
+    prices = np.round(prices, 2).tolist()
+    if total_price is not None and prices:
+        # I centesimi persi negli arrotondamenti vengono assegnati all'ultima notte della prima stanza
+        prices[0][-1] = round(prices[0][-1] + total_price - stay_total(prices), 2)
+    return prices
+
+# Prezzo totale di un soggiorno a partire dai prezzi per notte delle sue stanze
+def stay_total(prices):
+    return round(sum(sum(room_prices) for room_prices in prices), 2)
+
+# Rappresentazione dei prezzi per notte di una stanza salvata in BookingRooms
+def encode_nightly_prices(room_prices):
+    return ','.join(str(price) for price in room_prices)
+
+# Prezzi per notte di una stanza salvati in BookingRooms; le associazioni senza prezzi valgono il prezzo base della stanza
+def decode_nightly_prices(encoded, base_price, check_in, check_out):
+    if encoded is None:
+        return [base_price] * (check_out - check_in).days
+    return [float(price) for price in encoded.split(',')]
+
+# Aggiorna in modo incrementale il riepilogo giornaliero di occupazione e ricavi, senza eseguire il commit.
+# added e removed sono liste di soggiorni (check_in, check_out, stanze, prezzi per notte addebitati per ogni stanza),
+# rispettivamente venduti e liberati: il ricavo di ogni notte è quello addebitato, quindi una cancellazione o una modifica
+# toglie dal riepilogo esattamente il ricavo registrato, anche se nel frattempo le tariffe sono cambiate.
+# Le variazioni vengono sommate per (notte, tipo di stanza) e applicate con un UPDATE multiplo per le righe esistenti
+# e un INSERT multiplo per quelle mancanti, nella stessa transazione della prenotazione.
+def update_daily_occupancy(added=(), removed=()):
+    deltas = defaultdict(lambda: [0, 0.0])
+    for sign, stays in ((1, added), (-1, removed)):
+        for check_in, check_out, rooms, prices in stays:
+            nights = stay_nights(check_in, check_out)
+            for room, room_prices in zip(rooms, prices):
+                for night, price in zip(nights, room_prices):
+                    delta = deltas[(room.property_id, night, room.room_type)]
+                    delta[0] += sign
+                    delta[1] += sign * price
+    # In una modifica le notti e le stanze rimaste invariate si annullano
+    deltas = {key: delta for key, delta in deltas.items() if delta[0] or delta[1]}
+    if not deltas:
+        return
+
+    property_ids = {property_id for property_id, _, _ in deltas}
+    nights = [night for _, night, _ in deltas]
+    existing = set(db.session.query(DailyOccupancy.property_id, DailyOccupancy.night, DailyOccupancy.room_type).filter(
+        DailyOccupancy.property_id.in_(property_ids), DailyOccupancy.night >= min(nights), DailyOccupancy.night <= max(nights)
+    ).tuples())
+
+    table = DailyOccupancy.__table__
+    updates = [
+        {"key_property_id": property_id, "key_night": night, "key_room_type": room_type, "sold_delta": sold, "revenue_delta": revenue}
+        for (property_id, night, room_type), (sold, revenue) in deltas.items() if (property_id, night, room_type) in existing
+    ]
+    if updates:
+        db.session.execute(
+            table.update().where(
+                table.c.property_id == bindparam('key_property_id'),
+                table.c.night == bindparam('key_night'),
+                table.c.room_type == bindparam('key_room_type')
+            ).values(
+                rooms_sold=table.c.rooms_sold + bindparam('sold_delta'), revenue=table.c.revenue + bindparam('revenue_delta')
+            ),
+            updates
+        )
+    # Se due transazioni concorrenti inseriscono la stessa riga, la seconda fallisce con IntegrityError e viene ritentata
+    inserts = [
+        {"property_id": property_id, "night": night, "room_type": room_type, "rooms_sold": sold, "revenue": revenue}
+        for (property_id, night, room_type), (sold, revenue) in deltas.items() if (property_id, night, room_type) not in existing
+    ]
+    if inserts:
+        db.session.execute(insert(DailyOccupancy), inserts)
+
+# Soggiorni confermati (check_in, check_out, stanze, prezzi per notte addebitati) delle prenotazioni di una tabella (attiva o archiviata),
+# letti dal database a blocchi di EXPORT_CHUNK_SIZE righe
+def confirmed_stays(booking_model, rooms_model):
+    rows = db.session.query(
+        booking_model.id, booking_model.check_in, booking_model.check_out, rooms_model.room_id, rooms_model.nightly_prices
+    ).join(rooms_model, rooms_model.booking_id == booking_model.id).filter(
+        booking_model.status != 'canceled'
+    ).order_by(booking_model.id, rooms_model.id).yield_per(EXPORT_CHUNK_SIZE)
+    # Il catalogo dell'applicazione viene risolto una sola volta, non per ogni riga
+    get_room = room_catalog.get
+    for _, booking_rows in itertools.groupby(rows, key=lambda row: row.id):
+        booking_rows = list(booking_rows)
+        check_in, check_out = booking_rows[0].check_in, booking_rows[0].check_out
+        rooms = [get_room(row.room_id) for row in booking_rows]
+        yield check_in, check_out, rooms, [
+            decode_nightly_prices(row.nightly_prices, room.price, check_in, check_out) for row, room in zip(booking_rows, rooms)
+        ]
+
+# Ricostruisce da zero il riepilogo giornaliero a partire dai soggiorni confermati, attivi e archiviati, senza eseguire il commit
+def rebuild_daily_occupancy():
+    DailyOccupancy.query.delete()
+    update_daily_occupancy(added=itertools.chain(*[confirmed_stays(booking_model, rooms_model) for booking_model, rooms_model in BOOKING_TABLES]))
+
+def create_booking(user_id, check_in, check_out, guests, room_types, property_id=None):
     try:
          # Verifica che il numero di ospiti sia positivo
         if guests <= 0:
@@ -340,93 +2433,245 @@ def create_booking(user_id, check_in, check_out, guests, room_types):
         if not room_types:
             raise ValueError("Deve essere selezionato almeno un tipo di stanza.")
         
-        # Verifica la disponibilità delle stanze
-        available_rooms = get_available_rooms(check_in, check_out)
+        check_in_date = datetime.strptime(check_in, '%Y%m%d').date()
+        check_out_date = datetime.strptime(check_out, '%Y%m%d').date()
+        property_id = property_id or resolve_property_id()
 
-        # Raggruppa le stanze disponibili per tipo
-        available_rooms_by_type = {}
-        for room in available_rooms:
-            available_rooms_by_type.setdefault(room.room_type, []).append(room)
+        # Allocazione ottimistica: la prenotazione, le sue stanze e le notti occupate vengono salvate in un'unica transazione.
+        # Se un'altra richiesta concorrente occupa nel frattempo una delle stanze scelte, la chiave primaria di RoomNight
+        # fa fallire il commit: si rileggono le occupazioni delle stanze in conflitto e si ritenta, fino a BOOKING_MAX_ATTEMPTS volte.
+        for attempt in range(1, BOOKING_MAX_ATTEMPTS + 1):
+            # Verifica la disponibilità delle stanze e seleziona quelle dei tipi richiesti
+            available_rooms = get_available_rooms(check_in, check_out, property_id=property_id)
+            selected_rooms = select_rooms_by_type(available_rooms, room_types)
 
-        # Seleziona le stanze in base ai tipi richiesti
-        selected_rooms = []
-        for room_type in room_types:
-            if room_type in available_rooms_by_type and available_rooms_by_type[room_type]:
-                selected_rooms.append(available_rooms_by_type[room_type].pop(0))
-            else:
-                raise ValueError(f"Stanze di tipo {room_type} non disponibili per il periodo richiesto")
+            try:
+                # Crea la prenotazione, con il prezzo del soggiorno secondo le tariffe in vigore, e ne ottiene l'ID senza chiudere la transazione
+                prices = charged_nightly_prices(selected_rooms, check_in_date, check_out_date)
+                new_booking = Booking(user_id=user_id, property_id=property_id, check_in=check_in_date, check_out=check_out_date, guests=guests,
+                                      total_price=stay_total(prices))
+                db.session.add(new_booking)
+                db.session.flush()
 
-        # Crea la prenotazione
-        check_in_date = datetime.strptime(check_in, '%Y%m%d').date()
-        check_out_date = datetime.strptime(check_out, '%Y%m%d').date()
-        new_booking = Booking(user_id=user_id, check_in=check_in_date, check_out=check_out_date, guests=guests)
-        db.session.add(new_booking)
-        db.session.commit()
+                # Associa le stanze alla prenotazione, con i prezzi per notte addebitati, e ne occupa le notti
+                add_booking_rooms(new_booking.id, check_in_date, check_out_date, selected_rooms, prices)
+                update_daily_occupancy(added=[(check_in_date, check_out_date, selected_rooms, prices)])
+                bump_bookings_version(user_id)
+                db.session.commit()
+                break
+            except IntegrityError:
+                db.session.rollback()
+                occupancy_index.reload_rooms([room.id for room in selected_rooms])
+                if attempt == BOOKING_MAX_ATTEMPTS:
+                    raise ValueError("Le stanze richieste sono state prenotate da altri utenti, riprovare.")
+
+        # Aggiorna l'indice di occupazione con le stanze appena prenotate
+        occupancy_index.add_booking(new_booking.id, check_in_date, check_out_date, [room.id for room in selected_rooms])
+
+        return {"message": "Prenotazione effettuata con successo", **new_booking_details(new_booking, selected_rooms)}
+    except Exception as e:
+        # Gestisce eventuali errori durante la creazione della prenotazione
+        db.session.rollback()
+        raise Exception(f"Errore durante la creazione della prenotazione: {e}")
+
+# Prepara i dati di risposta di una prenotazione appena creata, con le stanze assegnate e il prezzo addebitato
+def new_booking_details(booking, selected_rooms):
+    return {
+        "booking_id": booking.id,
+        "check_in": booking.check_in.strftime('%d/%m/%Y'),
+        "check_out": booking.check_out.strftime('%d/%m/%Y'),
+        "guests": booking.guests,
+        "rooms": serialize_rooms(selected_rooms, 'booking'),
+        "total_price": booking.total_price
+    }
+
+# Valida un soggiorno di una prenotazione di gruppo e restituisce (check_in, check_out, ospiti, tipi di stanza)
+def parse_batch_item(item):
+    if not isinstance(item, dict):
+        raise ValueError("Soggiorno non valido")
+    check_in = item.get('check_in')
+    check_out = item.get('check_out')
+    guests = item.get('guests')
+    room_types = item.get('room_types')
 
-        # Associa le stanze alla prenotazione
+    if not check_in or not check_out or not guests or not room_types:
+        raise ValueError("Dati mancanti")
+    if guests <= 0:
+        raise ValueError("Il numero di ospiti deve essere positivo.")
+
+    check_in_date = datetime.strptime(check_in, '%Y%m%d').date()
+    check_out_date = datetime.strptime(check_out, '%Y%m%d').date()
+    if check_out_date <= check_in_date:
+        raise ValueError("La data di check-out deve essere successiva alla data di check-in.")
+    return check_in_date, check_out_date, guests, room_types
+
+# Assegna le stanze ai soggiorni di un gruppo leggendo una sola volta dall'indice le occupazioni
+# sull'unione dei loro intervalli di date. Le stanze assegnate a un soggiorno vengono segnate come occupate,
+# così i soggiorni successivi dello stesso gruppo non possono riusarle nelle stesse notti.
+# Restituisce le stanze selezionate e gli errori dei soggiorni non assegnabili, entrambi indicizzati per posizione.
+def allocate_batch(stays, property_id):
+    start = min(check_in for check_in, _, _, _ in stays.values())
+    end = max(check_out for _, check_out, _, _ in stays.values())
+
+    all_rooms = room_catalog.all(property_id)
+    occupancy_index.ensure_loaded()
+    busy = defaultdict(list)
+    for room_id, check_in, check_out in occupancy_index.overlapping_intervals(start, end, [room.id for room in all_rooms]):
+        busy[room_id].append((check_in, check_out))
+
+    allocations, errors = {}, {}
+    for index, (check_in, check_out, guests, room_types) in stays.items():
+        available_rooms = [
+            room for room in all_rooms
+            if all(busy_check_out <= check_in or busy_check_in >= check_out for busy_check_in, busy_check_out in busy.get(room.id, ()))
+        ]
+        try:
+            selected_rooms = select_rooms_by_type(available_rooms, room_types)
+        except ValueError as e:
+            errors[index] = str(e)
+            continue
         for room in selected_rooms:
-            booking_room = BookingRooms(booking_id=new_booking.id, room_id=room.id)
-            db.session.add(booking_room)
+            busy[room.id].append((check_in, check_out))
+        allocations[index] = selected_rooms
+    return allocations, errors
 
-        db.session.commit()
+# Crea in un'unica transazione le prenotazioni di un gruppo di soggiorni.
+# Con all_or_nothing basta un soggiorno non valido o non disponibile per non salvare nulla;
+# altrimenti vengono salvati tutti i soggiorni assegnabili e gli altri vengono segnalati singolarmente.
+def create_bookings_batch(user_id, items, all_or_nothing=True, property_id=None):
+    try:
+        property_id = property_id or resolve_property_id()
+        if not items:
+            raise ValueError("Deve essere indicato almeno un soggiorno.")
+        if len(items) > BOOKING_BATCH_MAX_ITEMS:
+            raise ValueError(f"Una prenotazione di gruppo può contenere al massimo {BOOKING_BATCH_MAX_ITEMS} soggiorni.")
 
-        # Calcola il prezzo totale
-        staying_days = (check_out_date - check_in_date).days
-        total_price = sum(room.price * staying_days for room in selected_rooms)
+        # Valida tutti i soggiorni prima di allocare
+        stays, invalid = {}, {}
+        for index, item in enumerate(items):
+            try:
+                stays[index] = parse_batch_item(item)
+            except ValueError as e:
+                invalid[index] = str(e)
 
-        # Prepara i dati di risposta
-        booked_rooms_info = [{
-            "room_id": room.id,
-            "room_number": room.number,
-            "room_type": room.room_type,
-            "price": room.price
-        } for room in selected_rooms]
+        # Allocazione ottimistica come in create_booking: in caso di conflitto con una richiesta concorrente
+        # si rileggono le occupazioni delle stanze coinvolte e si ritenta l'intero gruppo
+        new_bookings, allocations, errors = {}, {}, dict(invalid)
+        for attempt in range(1, BOOKING_MAX_ATTEMPTS + 1):
+            allocations, allocation_errors = allocate_batch(stays, property_id) if stays else ({}, {})
+            errors = {**invalid, **allocation_errors}
+            if not allocations or (all_or_nothing and errors):
+                allocations = {}
+                break
 
-        return {
-            "message": "Prenotazione effettuata con successo",
-            "booking_id": new_booking.id,
-            "check_in": check_in_date.strftime('%d/%m/%Y'),
-            "check_out": check_out_date.strftime('%d/%m/%Y'),
-            "guests": guests,
-            "rooms": booked_rooms_info,
-            "total_price": total_price
+            try:
+                # Prezzi per notte addebitati per le stanze di ciascun soggiorno, secondo le tariffe in vigore
+                prices = {
+                    index: charged_nightly_prices(selected_rooms, stays[index][0], stays[index][1]) for index, selected_rooms in allocations.items()
+                }
+                new_bookings = {
+                    index: Booking(user_id=user_id, property_id=property_id, check_in=stays[index][0], check_out=stays[index][1], guests=stays[index][2],
+                                   total_price=stay_total(prices[index]))
+                    for index in allocations
+                }
+                db.session.add_all(new_bookings.values())
+                db.session.flush()
+
+                # Associazioni e notti occupate di tutto il gruppo con due soli inserimenti
+                db.session.execute(insert(BookingRooms), [
+                    {"booking_id": new_bookings[index].id, "room_id": room.id, "nightly_prices": encode_nightly_prices(room_prices)}
+                    for index, selected_rooms in allocations.items() for room, room_prices in zip(selected_rooms, prices[index])
+                ])
+                db.session.execute(insert(RoomNight), [
+                    {"room_id": room.id, "night": night, "booking_id": new_bookings[index].id}
+                    for index, selected_rooms in allocations.items()
+                    for night in stay_nights(stays[index][0], stays[index][1])
+                    for room in selected_rooms
+                ])
+                update_daily_occupancy(added=[
+                    (stays[index][0], stays[index][1], selected_rooms, prices[index]) for index, selected_rooms in allocations.items()
+                ])
+                bump_bookings_version(user_id)
+                db.session.commit()
+                break
+            except IntegrityError:
+                db.session.rollback()
+                occupancy_index.reload_rooms({room.id for selected_rooms in allocations.values() for room in selected_rooms})
+                if attempt == BOOKING_MAX_ATTEMPTS:
+                    raise ValueError("Le stanze richieste sono state prenotate da altri utenti, riprovare.")
+
+        # Aggiorna l'indice di occupazione e prepara l'esito di ciascun soggiorno
+        results = []
+        for index in range(len(items)):
+            if index in allocations:
+                booking = new_bookings[index]
+                occupancy_index.add_booking(booking.id, booking.check_in, booking.check_out, [room.id for room in allocations[index]])
+                results.append({"index": index, "status": "booked", **new_booking_details(booking, allocations[index])})
+            else:
+                error = errors.get(index, "Prenotazione di gruppo annullata: altri soggiorni non sono disponibili.")
+                results.append({"index": index, "status": "failed", "error": error})
+
+        return {
+            "booked": len(allocations),
+            "failed": len(items) - len(allocations),
+            "results": results
         }
+    except ValueError:
+        db.session.rollback()
+        raise
     except Exception as e:
-        # Gestisce eventuali errori durante la creazione della prenotazione
+        # Gestisce eventuali errori durante la creazione delle prenotazioni
         db.session.rollback()
-        raise Exception(f"Errore durante la creazione della prenotazione: {e}")
+        raise Exception(f"Errore durante la prenotazione di gruppo: {e}")
 
-def cancel_booking_by_id(booking_id, user_id):
-    try:
-        # Recupera l'utente dal database
-        user = User.query.get(user_id)
-        if not user:
-            raise ValueError("Utente non trovato")
-
-        # Se l'utente è un admin, può cancellare qualsiasi prenotazione
-        if user.role == 'admin':
-            booking = Booking.query.filter_by(id=booking_id).first()
-        else:
-            # Altrimenti, può cancellare solo le proprie prenotazioni
-            booking = Booking.query.filter_by(id=booking_id, user_id=user_id).first()
+# Restituisce le stanze di una prenotazione, nell'ordine in cui sono state associate, leggendone i dati dal catalogo,
+# e i prezzi per notte addebitati per ciascuna stanza
+def booking_rooms_of(booking):
+    rows = db.session.query(BookingRooms.room_id, BookingRooms.nightly_prices).filter_by(booking_id=booking.id).order_by(BookingRooms.id).all()
+    rooms = [room_catalog.get(room_id) for room_id, _ in rows]
+    prices = [decode_nightly_prices(encoded, room.price, booking.check_in, booking.check_out) for (_, encoded), room in zip(rows, rooms)]
+    return rooms, prices
+
+# Recupera una prenotazione verificando che l'utente possa gestirla:
+# un admin può gestire qualsiasi prenotazione, un utente solo le proprie.
+# Il ruolo viene deciso dall'endpoint a partire dai claim del token, senza leggere l'utente dal database.
+def find_user_booking(booking_id, user_id, admin=False):
+    # Se l'utente è un admin, può gestire qualsiasi prenotazione
+    if admin:
+        booking = Booking.query.filter_by(id=booking_id).first()
+    else:
+        # Altrimenti, può gestire solo le proprie prenotazioni
+        booking = Booking.query.filter_by(id=booking_id, user_id=user_id).first()
 
-        if not booking:
-            raise ValueError("Prenotazione non trovata")
+    if not booking:
+        # Le prenotazioni archiviate restano nello storico ma non possono più essere modificate o cancellate
+        archived = db.session.get(ArchivedBooking, booking_id)
+        if archived and (admin or archived.user_id == user_id):
+            raise ValueError("La prenotazione è archiviata e non può essere modificata")
+        raise ValueError("Prenotazione non trovata")
+    return booking
+
+def cancel_booking_by_id(booking_id, user_id, admin=False):
+    try:
+        # Recupera la prenotazione verificando i permessi dell'utente
+        booking = find_user_booking(booking_id, user_id, admin)
 
         if booking.status == 'canceled':
             raise ValueError("La prenotazione è già stata cancellata")
 
-        # Imposta lo stato della prenotazione a 'canceled'
+        # Imposta lo stato della prenotazione a 'canceled' e libera le notti occupate nella stessa transazione
+        rooms, prices = booking_rooms_of(booking)
         booking.status = 'canceled'
+        RoomNight.query.filter_by(booking_id=booking.id).delete()
+        update_daily_occupancy(removed=[(booking.check_in, booking.check_out, rooms, prices)])
+        bump_bookings_version(booking.user_id)
         db.session.commit()
 
+        # Libera le stanze della prenotazione nell'indice di occupazione
+        occupancy_index.remove_booking(booking.id)
+
         # Prepara i dettagli delle stanze prenotate
-        booked_rooms_info = [{
-            "room_id": room.room.id,
-            "room_number": room.room.number,
-            "room_type": room.room.room_type,
-            "price": room.room.price
-        } for room in booking.rooms]
+        booked_rooms_info = serialize_rooms(rooms, 'booking')
 
         # Restituisce i dettagli della prenotazione cancellata
         return {
@@ -440,26 +2685,284 @@ def cancel_booking_by_id(booking_id, user_id):
     except Exception as e:
         raise Exception(f"Errore durante la cancellazione della prenotazione: {e}")
 
-# Modifica una prenotazione:  prima la cancellazione e poi la creazione di una nuova prenotazione
-def modify_booking(booking_id, user_id, new_check_in, new_check_out, new_guests, new_room_types):
+# Modifica una prenotazione in loco, in un'unica transazione.
+# Le stanze già assegnate che restano libere per le nuove date e corrispondono ai tipi richiesti vengono mantenute;
+# solo la differenza viene riallocata. Durante la verifica le stanze della prenotazione stessa sono considerate libere,
+# e se l'allocazione fallisce la prenotazione originale resta invariata.
+def modify_booking(booking_id, user_id, new_check_in, new_check_out, new_guests, new_room_types, admin=False):
     try:
-        # Cancella la prenotazione esistente e ottiene i dettagli della prenotazione cancellata
-        canceled_booking_details = cancel_booking_by_id(booking_id, user_id)
+        # Verifica che il numero di ospiti sia positivo
+        if new_guests <= 0:
+            raise ValueError("Il numero di ospiti deve essere positivo.")
+
+        # Verifica che il tipo di stanza non sia vuoto
+        if not new_room_types:
+            raise ValueError("Deve essere selezionato almeno un tipo di stanza.")
+
+        # Recupera la prenotazione verificando i permessi dell'utente
+        booking = find_user_booking(booking_id, user_id, admin)
+        if booking.status == 'canceled':
+            raise ValueError("La prenotazione è stata cancellata e non può essere modificata")
+
+        # Recupera le stanze attualmente assegnate e prepara i dettagli della prenotazione originale
+        old_rooms, old_prices = booking_rooms_of(booking)
+        canceled_booking_details = {
+            "booking_id": booking.id,
+            "check_in": booking.check_in.strftime('%Y-%m-%d'),
+            "check_out": booking.check_out.strftime('%Y-%m-%d'),
+            "guests": booking.guests,
+            "rooms": serialize_rooms(old_rooms, 'booking'),
+            "status": booking.status
+        }
 
-        # Crea una nuova prenotazione
-        new_booking_details = create_booking(user_id, new_check_in, new_check_out, new_guests, new_room_types)
+        check_in_date = datetime.strptime(new_check_in, '%Y%m%d').date()
+        check_out_date = datetime.strptime(new_check_out, '%Y%m%d').date()
+        old_room_ids = {room.id for room in old_rooms}
+        old_check_in, old_check_out = booking.check_in, booking.check_out
+
+        for attempt in range(1, BOOKING_MAX_ATTEMPTS + 1):
+            # Stanze libere per le nuove date, considerando libere quelle della prenotazione stessa
+            available_rooms = get_available_rooms(new_check_in, new_check_out, booking.id, booking.property_id)
+            available_room_ids = {room.id for room in available_rooms}
+
+            # Mantiene, per ogni tipo richiesto, una delle stanze già assegnate se è ancora libera per le nuove date
+            kept_rooms_by_type = defaultdict(list)
+            for room in old_rooms:
+                if room.id in available_room_ids:
+                    kept_rooms_by_type[room.room_type].append(room)
+            kept_rooms = []
+            missing_room_types = []
+            for room_type in new_room_types:
+                if kept_rooms_by_type[room_type]:
+                    kept_rooms.append(kept_rooms_by_type[room_type].pop(0))
+                else:
+                    missing_room_types.append(room_type)
+
+            # Alloca solo le stanze mancanti tra quelle libere non già mantenute
+            kept_room_ids = {room.id for room in kept_rooms}
+            added_rooms = select_rooms_by_type(
+                [room for room in available_rooms if room.id not in kept_room_ids], missing_room_types
+            )
+            new_rooms = kept_rooms + added_rooms
+            new_room_ids = [room.id for room in new_rooms]
+            removed_room_ids = old_room_ids - set(new_room_ids)
+
+            try:
+                # Aggiorna la prenotazione, con i prezzi per notte del nuovo soggiorno secondo le tariffe in vigore,
+                # le associazioni con le stanze e le notti occupate nella stessa transazione
+                new_prices = charged_nightly_prices(new_rooms, check_in_date, check_out_date)
+                booking.check_in = check_in_date
+                booking.check_out = check_out_date
+                booking.guests = new_guests
+                booking.total_price = stay_total(new_prices)
+                # updated_at viene aggiornato esplicitamente: se cambiano solo le stanze nessuna colonna della prenotazione cambia
+                # e senza UPDATE gli altri processi worker non vedrebbero la modifica durante la sincronizzazione dell'indice
+                booking.updated_at = datetime.utcnow()
+                if kept_rooms:
+                    table = BookingRooms.__table__
+                    db.session.execute(
+                        table.update().where(table.c.booking_id == booking.id, table.c.room_id == bindparam('key_room_id'))
+                        .values(nightly_prices=bindparam('prices')),
+                        [{"key_room_id": room.id, "prices": encode_nightly_prices(room_prices)} for room, room_prices in zip(kept_rooms, new_prices)]
+                    )
+                if removed_room_ids:
+                    BookingRooms.query.filter(
+                        BookingRooms.booking_id == booking.id, BookingRooms.room_id.in_(removed_room_ids)
+                    ).delete(synchronize_session=False)
+                RoomNight.query.filter_by(booking_id=booking.id).delete(synchronize_session=False)
+                if added_rooms:
+                    db.session.execute(insert(BookingRooms), [
+                        {"booking_id": booking.id, "room_id": room.id, "nightly_prices": encode_nightly_prices(room_prices)}
+                        for room, room_prices in zip(added_rooms, new_prices[len(kept_rooms):])
+                    ])
+                db.session.execute(insert(RoomNight), [
+                    {"room_id": room_id, "night": night, "booking_id": booking.id}
+                    for room_id in new_room_ids for night in stay_nights(check_in_date, check_out_date)
+                ])
+                update_daily_occupancy(
+                    added=[(check_in_date, check_out_date, new_rooms, new_prices)],
+                    removed=[(old_check_in, old_check_out, old_rooms, old_prices)]
+                )
+                bump_bookings_version(booking.user_id)
+                db.session.commit()
+                break
+            except IntegrityError:
+                db.session.rollback()
+                occupancy_index.reload_rooms([room.id for room in added_rooms])
+                if attempt == BOOKING_MAX_ATTEMPTS:
+                    raise ValueError("Le stanze richieste sono state prenotate da altri utenti, riprovare.")
+
+        # Aggiorna l'indice di occupazione con le nuove date e stanze della prenotazione
+        occupancy_index.add_booking(booking.id, check_in_date, check_out_date, new_room_ids)
+
+        new_booking_details = {
+            "message": "Prenotazione modificata con successo",
+            "booking_id": booking.id,
+            "check_in": check_in_date.strftime('%d/%m/%Y'),
+            "check_out": check_out_date.strftime('%d/%m/%Y'),
+            "guests": new_guests,
+            "rooms": serialize_rooms(new_rooms, 'booking'),
+            "total_price": booking.total_price
+        }
 
         user_bookings = get_user_bookings(user_id)
-        # Restituisce i dettagli della prenotazione cancellata e della nuova prenotazione
+        # Restituisce i dettagli della prenotazione prima e dopo la modifica
         return {
             "canceled_booking": canceled_booking_details,
             "new_booking": new_booking_details,
             "user_bookings": user_bookings
         }
     except Exception as e:
+        db.session.rollback()
         raise Exception(f"Errore durante la modifica della prenotazione: {e}")
 
-def get_room_suggestions(check_in, check_out, guests, rooms_requested, old_booking_id=None):
+# Calcola, per ogni tipo di stanza, il numero di stanze libere in ciascuna notte dell'intervallo [start_date, end_date).
+# Invece di una ricerca per ogni notte, gli intervalli occupati vengono "dipinti" in una matrice stanze × notti:
+# per ogni intervallo si aggiunge +1 alla notte di inizio e -1 a quella di fine, e la somma cumulativa lungo le notti
+# restituisce l'occupazione di ogni stanza in ogni notte. Il costo è O(prenotazioni + stanze × notti) in operazioni vettoriali.
+def get_availability_calendar(start_date, end_date, property_id=None):
+    try:
+        # Converte le date in oggetti datetime
+        start = datetime.strptime(start_date, '%Y%m%d').date()
+        end = datetime.strptime(end_date, '%Y%m%d').date()
+
+        # Verifica che l'intervallo sia valido
+        nights = (end - start).days
+        if nights <= 0:
+            raise ValueError("La data di fine deve essere successiva alla data di inizio.")
+        if nights > CALENDAR_MAX_NIGHTS:
+            raise ValueError(f"L'intervallo richiesto non può superare {CALENDAR_MAX_NIGHTS} notti.")
+
+        # Recupera le stanze della struttura dal catalogo e assegna a ciascuna una riga della matrice
+        rooms = room_catalog.all(property_id or resolve_property_id())
+        room_rows = {room.id: row for row, room in enumerate(rooms)}
+
+        # Recupera dall'indice di occupazione gli intervalli delle stanze della struttura che si sovrappongono al calendario
+        occupancy_index.ensure_loaded()
+        intervals = occupancy_index.overlapping_intervals(start, end, room_rows)
+
+        # Matrice delle differenze: +1 alla prima notte occupata, -1 alla notte di check-out (limitate al calendario)
+        deltas = np.zeros((len(rooms), nights + 1), dtype=np.int32)
+        if intervals:
+            rows = np.fromiter((room_rows[room_id] for room_id, _, _ in intervals), dtype=np.intp, count=len(intervals))
+            first_nights = np.fromiter((max((check_in - start).days, 0) for _, check_in, _ in intervals), dtype=np.intp, count=len(intervals))
+            last_nights = np.fromiter((min((check_out - start).days, nights) for _, _, check_out in intervals), dtype=np.intp, count=len(intervals))
+            np.add.at(deltas, (rows, first_nights), 1)
+            np.add.at(deltas, (rows, last_nights), -1)
+        occupied = np.cumsum(deltas[:, :nights], axis=1) > 0
+
+        # Somma le stanze libere per tipo con un prodotto matriciale tra l'appartenenza al tipo e la matrice delle stanze libere
+        room_types = sorted({room.room_type for room in rooms})
+        type_membership = np.zeros((len(room_types), len(rooms)), dtype=np.int32)
+        for row, room in enumerate(rooms):
+            type_membership[room_types.index(room.room_type), row] = 1
+        free_per_type = type_membership @ (~occupied).astype(np.int32)
+
+        capacities = {room.room_type: room.capacity for room in rooms}
+        return {
+            "start_date": start.strftime('%Y%m%d'),
+            "end_date": end.strftime('%Y%m%d'),
+            "nights": [(start + timedelta(days=offset)).strftime('%Y%m%d') for offset in range(nights)],
+            "room_types": [{
+                "room_type": room_type,
+                "capacity": capacities[room_type],
+                "total": int(type_membership[index].sum()),
+                "free": free_per_type[index].tolist()
+            } for index, room_type in enumerate(room_types)]
+        }
+    except ValueError:
+        raise
+    except Exception as e:
+        raise Exception(f"Errore durante il calcolo del calendario delle disponibilità: {e}")
+
+# Report di occupazione e ricavi per tipo di stanza e notte nell'intervallo [start_date, end_date),
+# letto dal riepilogo giornaliero: il costo dipende dal numero di notti, non dal numero di prenotazioni
+def get_occupancy_report(start_date, end_date, property_id=None):
+    try:
+        # Converte le date in oggetti datetime
+        start = datetime.strptime(start_date, '%Y%m%d').date()
+        end = datetime.strptime(end_date, '%Y%m%d').date()
+
+        # Verifica che l'intervallo sia valido
+        nights = (end - start).days
+        if nights <= 0:
+            raise ValueError("La data di fine deve essere successiva alla data di inizio.")
+        if nights > CALENDAR_MAX_NIGHTS:
+            raise ValueError(f"L'intervallo richiesto non può superare {CALENDAR_MAX_NIGHTS} notti.")
+
+        # Numero totale di stanze per tipo della struttura, dal catalogo in memoria
+        property_id = property_id or resolve_property_id()
+        rooms_per_type = defaultdict(int)
+        for room in room_catalog.all(property_id):
+            rooms_per_type[room.room_type] += 1
+
+        rollups = {
+            (night, room_type): (rooms_sold, revenue)
+            for night, room_type, rooms_sold, revenue in db.session.query(
+                DailyOccupancy.night, DailyOccupancy.room_type, DailyOccupancy.rooms_sold, DailyOccupancy.revenue
+            ).filter(DailyOccupancy.property_id == property_id, DailyOccupancy.night >= start, DailyOccupancy.night < end)
+        }
+
+        # Le notti senza vendite compaiono comunque nel report, con occupazione e ricavo a zero
+        report = []
+        totals = {room_type: {"rooms_sold": 0, "revenue": 0.0} for room_type in sorted(rooms_per_type)}
+        for offset in range(nights):
+            night = start + timedelta(days=offset)
+            per_type = {}
+            for room_type, total_rooms in sorted(rooms_per_type.items()):
+                rooms_sold, revenue = rollups.get((night, room_type), (0, 0.0))
+                per_type[room_type] = {
+                    "rooms_sold": rooms_sold,
+                    "occupancy": round(rooms_sold / total_rooms, 4) if total_rooms else 0.0,
+                    "revenue": revenue
+                }
+                totals[room_type]["rooms_sold"] += rooms_sold
+                totals[room_type]["revenue"] += revenue
+            report.append({"date": night.strftime('%Y-%m-%d'), "room_types": per_type})
+
+        for room_type, total in totals.items():
+            total["occupancy"] = round(total["rooms_sold"] / (rooms_per_type[room_type] * nights), 4) if rooms_per_type[room_type] else 0.0
+        return {"nights": report, "totals": totals}
+    except ValueError:
+        raise
+    except Exception as e:
+        raise Exception(f"Errore durante il calcolo del report di occupazione: {e}")
+
+# Risolutore delle combinazioni di stanze (knapsack limitato con programmazione dinamica sulle classi di stanze).
+# room_classes è una tupla di (tipo, capacità, prezzo del soggiorno, stanze libere): il vettore di disponibilità.
+# Restituisce fino a top_k soluzioni (costo del soggiorno, conteggi per classe) in ordine di costo crescente,
+# ciascuna con esattamente rooms_requested stanze e capacità totale di almeno guests ospiti.
+# Lo stato della programmazione dinamica è (stanze usate, capacità raggiunta limitata a guests), quindi il costo
+# è O(classi × stanze richieste² × ospiti × top_k): dipende dal numero di tipi, non dal numero di stanze dell'hotel.
+# I risultati sono memorizzati per (vettore di disponibilità, ospiti, stanze), che si ripetono spesso tra ricerche diverse.
+@lru_cache(maxsize=1024)
+def solve_room_mix(room_classes, guests, rooms_requested, top_k):
+    states = {(0, 0): [(0.0, ())]}
+    for room_type, capacity, price, available in room_classes:
+        next_states = defaultdict(list)
+        for (rooms_used, capacity_reached), candidates in states.items():
+            for count in range(min(available, rooms_requested - rooms_used) + 1):
+                key = (rooms_used + count, min(guests, capacity_reached + count * capacity))
+                for cost, counts in candidates:
+                    next_states[key].append((cost + count * price, counts + (count,)))
+        # Per ogni stato si conservano solo le top_k combinazioni più economiche
+        states = {key: heapq.nsmallest(top_k, candidates) for key, candidates in next_states.items()}
+    return states.get((rooms_requested, guests), [])
+
+# Verifica tipo e dimensione di una ricerca: ospiti e camere devono essere numeri interi (ad esempio non "2" nel JSON)
+# entro i limiti configurati. Le ricerche non valide vengono rifiutate con ValueError, prima di qualsiasi calcolo.
+def validate_search_size(guests, rooms_requested):
+    for value in (guests, rooms_requested):
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise ValueError("Il numero di ospiti e di camere deve essere un numero intero.")
+    if rooms_requested > SUGGESTION_MAX_ROOMS:
+        raise ValueError(f"Si possono cercare al massimo {SUGGESTION_MAX_ROOMS} camere per volta.")
+    if guests > SUGGESTION_MAX_GUESTS:
+        raise ValueError(f"Si possono cercare camere per al massimo {SUGGESTION_MAX_GUESTS} ospiti per volta.")
+
+def get_room_suggestions(check_in, check_out, guests, rooms_requested, old_booking_id=None, property_id=None):
+    validate_search_size(guests, rooms_requested)
+
     try:
          # Verifica che il numero di ospiti sia positivo
         if guests <= 0:
@@ -471,7 +2974,7 @@ def get_room_suggestions(check_in, check_out, guests, rooms_requested, old_booki
         
 
         # Verifica la disponibilità delle stanze
-        available_rooms = get_available_rooms(check_in, check_out, old_booking_id)
+        available_rooms = get_available_rooms(check_in, check_out, old_booking_id, property_id)
 
         # Verifica se la capacità totale delle stanze disponibili può ospitare gli ospiti
         total_capacity = sum(room.capacity for room in available_rooms)
@@ -489,68 +2992,64 @@ def get_room_suggestions(check_in, check_out, guests, rooms_requested, old_booki
             rooms_by_type[room.room_type].append(room)
             room_type_counts[room.room_type] += 1
 
-        # Trova una combinazione valida di stanze che possa ospitare il numero di ospiti e il numero di stanze richiesto
-        valid_combinations = []
-        for room_type, rooms in rooms_by_type.items():
-            rooms.sort(key=lambda room: room.price)  # Ordina le stanze per prezzo in ordine crescente
+        # Raggruppa le stanze disponibili in classi equivalenti (stesso tipo, capacità e prezzo base):
+        # il risolutore lavora sul numero di stanze libere per classe, non sulle singole stanze
+        rooms_by_class = defaultdict(list)
+        for room in available_rooms:
+            rooms_by_class[(room.room_type, room.capacity, room.price)].append(room)
+        class_keys = sorted(rooms_by_class)
+
+        # Le stanze di una classe hanno lo stesso prezzo per notte: il prezzo del soggiorno di ogni classe
+        # si calcola dal calendario delle tariffe con un'unica operazione vettoriale sulle somme prefisse
+        check_in_date = datetime.strptime(check_in, '%Y%m%d').date()
+        check_out_date = datetime.strptime(check_out, '%Y%m%d').date()
+        class_prices = rate_calendar.stay_prices([rooms_by_class[key][0] for key in class_keys], check_in_date, check_out_date)
+        room_classes = tuple(
+            (room_type, capacity, stay_price, len(rooms_by_class[(room_type, capacity, price)]))
+            for (room_type, capacity, price), stay_price in zip(class_keys, class_prices.tolist())
+        )
+
+        # Trova le combinazioni più economiche con esattamente il numero di stanze richiesto e capacità sufficiente per gli ospiti
+        solutions = solve_room_mix(room_classes, guests, rooms_requested, SUGGESTION_ALTERNATIVES + 1)
+        if not solutions:
+            raise ValueError("Nessuna combinazione di camere disponibili può ospitare il numero di ospiti richiesto con il numero di camere indicato.")
+
+        # Converte i conteggi per classe nelle stanze concrete: per ogni classe si prendono le prime n stanze libere
+        combinations = []
+        for cost, counts in solutions:
             combination = []
-            total_capacity = 0
-            for room in rooms:
-                if len(combination) < rooms_requested and total_capacity < guests:
-                    combination.append(room)
-                    total_capacity += room.capacity
-                if len(combination) == rooms_requested and total_capacity >= guests:
-                    break
-            if len(combination) == rooms_requested and total_capacity >= guests:
-                valid_combinations.append(combination)
-
-        # Seleziona la prima combinazione valida o le prime stanze disponibili se non viene trovata una combinazione valida
-        selected_combination = valid_combinations[0] if valid_combinations else available_rooms[:rooms_requested]
-
-        # Assicura che la combinazione selezionata abbia il numero corretto di stanze e possa ospitare gli ospiti
-        total_selected_capacity = sum(room.capacity for room in selected_combination)
-        if total_selected_capacity < guests:
-            additional_rooms_needed = guests - total_selected_capacity
-            additional_rooms = [room for room in available_rooms if room not in selected_combination]
-            for room in additional_rooms:
-                if additional_rooms_needed <= 0:
-                    break
-                selected_combination.append(room)
-                additional_rooms_needed -= room.capacity
-
-        # Calcola il numero di giorni tra check_in e check_out
-        check_in_date = datetime.strptime(check_in, '%Y%m%d')
-        check_out_date = datetime.strptime(check_out, '%Y%m%d')
-        num_days = (check_out_date - check_in_date).days
+            for key, count in zip(class_keys, counts):
+                combination.extend(rooms_by_class[key][:count])
+            combinations.append(combination)
+        selected_combination = combinations[0]
 
-        # Calcola il costo totale
-        total_cost_selected_combination = sum(room.price * num_days for room in selected_combination)
+        # Calcola il costo totale di tutte le combinazioni candidate in un'unica operazione: conteggi per classe × prezzi dei soggiorni
+        combination_costs = np.round(np.array([counts for cost, counts in solutions]) @ class_prices, 2).tolist()
+        total_cost_selected_combination = combination_costs[0]
+        num_days = (check_out_date - check_in_date).days
 
         # Semplifica l'oggetto di output per la combinazione selezionata
-        simplified_combination = [{
-            "id": room.id,
-            "number": room.number,
-            "price": room.price,
-            "capacity": room.capacity,
-            "room_type": room.room_type
-        } for room in selected_combination]
+        simplified_combination = serialize_rooms(selected_combination, 'suggestion')
+
+        # Semplifica l'oggetto di output per le combinazioni alternative, in ordine di costo crescente
+        alternative_combinations = [{
+            "rooms": serialize_rooms(combination, 'suggestion'),
+            "total_cost": total_cost
+        } for combination, total_cost in zip(combinations[1:], combination_costs[1:])]
 
         # Semplifica l'oggetto di output per le stanze disponibili
-        simplified_available_rooms = [{
-            "id": room.id,
-            "number": room.number,
-            "price": room.price,
-            "capacity": room.capacity,
-            "room_type": room.room_type
-        } for room in available_rooms]
-
-        # Crea un array di oggetti per i conteggi dei tipi di stanza con capacità totale
+        simplified_available_rooms = serialize_rooms(available_rooms, 'suggestion')
+
+        # Crea un array di oggetti per i conteggi dei tipi di stanza con capacità totale e prezzo medio per notte nel soggiorno
+        type_prices = defaultdict(float)
+        for (room_type, capacity, price), stay_price in zip(class_keys, class_prices.tolist()):
+            type_prices[room_type] += stay_price * len(rooms_by_class[(room_type, capacity, price)])
         room_type_counts_array = [
             {
                 "room_type": room_type,
                 "count": count,
                 "capacity": rooms_by_type[room_type][0].capacity,
-                "price": sum(room.price for room in rooms_by_type[room_type]) / count
+                "price": type_prices[room_type] / (count * num_days)
             }
             for room_type, count in room_type_counts.items()
         ]
@@ -560,17 +3059,435 @@ def get_room_suggestions(check_in, check_out, guests, rooms_requested, old_booki
             "selected_combination": simplified_combination,
             "available_rooms": simplified_available_rooms,
             "room_type_counts": room_type_counts_array,
-            "total_cost_selected_combination": total_cost_selected_combination
+            "total_cost_selected_combination": total_cost_selected_combination,
+            "alternative_combinations": alternative_combinations
         }
     except Exception as e:
         raise Exception(f"Errore durante il recupero delle stanze disponibili: {e}")
 
 
+# Campi della risposta di /rooms_per_type_and_suggestion per ciascuna modalità:
+# - 'full': tutte le stanze disponibili e le combinazioni alternative
+# - 'summary': solo il riepilogo per tipo di stanza e la combinazione selezionata, così la dimensione della risposta
+#   dipende dal numero di tipi di stanza e non dal numero di stanze della struttura
+SUGGESTION_MODES = {
+    'full': ('selected_combination', 'available_rooms', 'room_type_counts', 'total_cost_selected_combination', 'alternative_combinations'),
+    'summary': ('selected_combination', 'room_type_counts', 'total_cost_selected_combination'),
+}
+
+# Restituisce solo i campi dei suggerimenti previsti dalla modalità indicata e, se fields non è vuoto, solo quelli elencati.
+# fields può essere una lista o una stringa di nomi separati da virgole.
+def select_suggestion_fields(room_suggestions, mode='full', fields=None):
+    if mode not in SUGGESTION_MODES:
+        raise ValueError(f"Modalità non valida: usare {' o '.join(repr(name) for name in SUGGESTION_MODES)}")
+    names = SUGGESTION_MODES[mode]
+    if fields:
+        if isinstance(fields, str):
+            fields = fields.split(',')
+        fields = {field.strip() for field in fields}
+        unknown = fields.difference(SUGGESTION_MODES['full'])
+        if unknown:
+            raise ValueError(f"Campi non validi: {', '.join(sorted(unknown))}")
+        names = [name for name in names if name in fields]
+    return {name: room_suggestions[name] for name in names}
+
+# Restituisce i suggerimenti sulle stanze usando la cache dei risultati.
+# La versione dell'inventario viene letta prima del calcolo: se una prenotazione cambia durante il calcolo,
+# il risultato viene salvato con la versione precedente e non sarà mai restituito per l'inventario aggiornato.
+def get_cached_room_suggestions(check_in, check_out, guests, rooms_requested, old_booking_id=None, property_id=None):
+    # La ricerca viene verificata prima di costruire la chiave della cache, che richiede valori confrontabili
+    validate_search_size(guests, rooms_requested)
+    key = (check_in, check_out, guests, rooms_requested, int(old_booking_id) if old_booking_id else None)
+    # Il primo caricamento di indice e catalogo cambia la versione: va eseguito prima di leggerla
+    occupancy_index.ensure_loaded()
+    room_catalog.ensure_loaded()
+    property_id = property_id or resolve_property_id()
+    version = inventory_version(property_id)
+    room_suggestions = suggestion_cache.get(property_id, key, version)
+    if room_suggestions is None:
+        room_suggestions = get_room_suggestions(check_in, check_out, guests, rooms_requested, old_booking_id, property_id)
+        suggestion_cache.put(property_id, key, version, room_suggestions)
+    return room_suggestions
+
+
+####################################################
+# Archiviazione delle prenotazioni
+####################################################
+# Le prenotazioni concluse e quelle cancellate non servono più alle ricerche ma restano nello storico degli utenti.
+# Il job di archiviazione le sposta a lotti, insieme alle loro stanze, nelle tabelle archived_booking e archived_booking_rooms
+# ed elimina le notti occupate ormai passate: le tabelle attive restano piccole, quindi il caricamento dell'indice di occupazione,
+# la sincronizzazione tra processi worker e le query di sovrapposizione non rallentano con il crescere dello storico.
+# Il riepilogo giornaliero non cambia: i report di occupazione continuano a includere i soggiorni archiviati.
+# Giorni dopo il check-out (o dopo la cancellazione) oltre i quali una prenotazione viene archiviata e prenotazioni per transazione
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 30))
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', 1000))
+
+# Query delle prenotazioni da archiviare alla data limite indicata, ciascuna servita da un indice di Booking e restituita
+# insieme alla colonna dell'indice, che il job usa come posizione da cui ripartire a ogni lotto:
+# - soggiorni confermati conclusi entro la data limite (indice su check_in, check_out, status)
+# - prenotazioni cancellate e non più modificate dalla data limite (indice su updated_at)
+def archivable_bookings_queries(cutoff):
+    cutoff_time = datetime.combine(cutoff, datetime.min.time())
+    return [
+        (db.session.query(Booking.id, Booking.check_in).filter(
+            Booking.check_in < cutoff, Booking.check_out <= cutoff, Booking.status != 'canceled'
+        ), Booking.check_in),
+        (db.session.query(Booking.id, Booking.updated_at).filter(
+            Booking.updated_at < cutoff_time, Booking.status == 'canceled'
+        ), Booking.updated_at),
+    ]
+
+# Sposta le prenotazioni indicate e le loro stanze nelle tabelle archiviate, senza eseguire il commit.
+# Le stanze vengono copiate nell'ordine in cui erano state associate, così lo storico resta invariato.
+def archive_bookings_batch(booking_ids, archived_at):
+    booking_columns = [column.name for column in Booking.__table__.columns]
+    db.session.execute(insert(ArchivedBooking).from_select(
+        booking_columns + ['archived_at'],
+        select(*[Booking.__table__.c[name] for name in booking_columns], db.literal(archived_at, db.DateTime)).where(Booking.id.in_(booking_ids))
+    ))
+    db.session.execute(insert(ArchivedBookingRooms).from_select(
+        ['booking_id', 'room_id', 'nightly_prices'],
+        select(BookingRooms.booking_id, BookingRooms.room_id, BookingRooms.nightly_prices).where(BookingRooms.booking_id.in_(booking_ids)).order_by(BookingRooms.id)
+    ))
+    RoomNight.query.filter(RoomNight.booking_id.in_(booking_ids)).delete(synchronize_session=False)
+    BookingRooms.query.filter(BookingRooms.booking_id.in_(booking_ids)).delete(synchronize_session=False)
+    Booking.query.filter(Booking.id.in_(booking_ids)).delete(synchronize_session=False)
+
+# Archivia le prenotazioni concluse o cancellate da più di ARCHIVE_AFTER_DAYS giorni, a lotti di batch_size prenotazioni:
+# ogni lotto è una transazione breve, così le prenotazioni concorrenti non restano bloccate a lungo.
+# Restituisce il numero di prenotazioni archiviate.
+def archive_bookings(today=None, batch_size=None):
+    batch_size = batch_size or ARCHIVE_BATCH_SIZE
+    if batch_size <= 0:
+        raise ValueError("Il numero di prenotazioni per lotto deve essere positivo.")
+    cutoff = (today or datetime.utcnow().date()) - timedelta(days=ARCHIVE_AFTER_DAYS)
+
+    archived = 0
+    for query, position in archivable_bookings_queries(cutoff):
+        start = None
+        while True:
+            # Ogni lotto riparte dalla posizione dell'ultimo lotto nell'indice, così le prenotazioni che non vanno archiviate
+            # (ad esempio quelle cancellate, nella prima query) vengono scorse una sola volta invece che a ogni lotto
+            batch_query = query if start is None else query.filter(position >= start)
+            batch = batch_query.order_by(position).limit(batch_size).all()
+            if not batch:
+                break
+            booking_ids = [booking_id for booking_id, _ in batch]
+            try:
+                archive_bookings_batch(booking_ids, datetime.utcnow())
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                raise Exception(f"Errore durante l'archiviazione delle prenotazioni: {e}")
+
+            # Rimuove dall'indice di occupazione di questo processo le prenotazioni archiviate;
+            # gli altri processi worker le rimuovono alla sincronizzazione successiva
+            for booking_id in booking_ids:
+                occupancy_index.remove_booking(booking_id)
+            archived += len(booking_ids)
+            start = batch[-1][1]
+    return archived
+
+
+####################################################
+# Esportazione e importazione delle prenotazioni
+####################################################
+# Colonne del CSV di esportazione e importazione: una riga per ogni stanza di una prenotazione.
+# total_price è il prezzo addebitato per la prenotazione, price e nightly_prices quelli addebitati per la stanza
+BOOKING_CSV_COLUMNS = [
+    'booking_id', 'property', 'user_id', 'check_in', 'check_out', 'guests', 'status', 'created_at', 'total_price',
+    'room_number', 'room_type', 'price', 'nightly_prices'
+]
+
+# Righe (prenotazione, stanza) da esportare, ordinate per prenotazione e lette dal database a blocchi di EXPORT_CHUNK_SIZE:
+# la memoria usata resta costante anche con milioni di prenotazioni.
+# Vengono esportate prima le prenotazioni archiviate e poi quelle attive, ciascuna tabella in ordine di ID.
+def export_bookings_rows(status=None, property_id=None):
+    queries = []
+    for booking_model, rooms_model in reversed(BOOKING_TABLES):
+        query = db.session.query(
+            booking_model.id, Property.code, booking_model.user_id, booking_model.check_in, booking_model.check_out, booking_model.guests,
+            booking_model.status, booking_model.created_at, booking_model.total_price, Room.number, Room.room_type, Room.price,
+            rooms_model.nightly_prices
+        ).join(Property, Property.id == booking_model.property_id).join(
+            rooms_model, rooms_model.booking_id == booking_model.id
+        ).join(Room, Room.id == rooms_model.room_id)
+        if status:
+            query = query.filter(booking_model.status == status)
+        if property_id:
+            query = query.filter(booking_model.property_id == property_id)
+        queries.append(query.order_by(booking_model.id, rooms_model.id).yield_per(EXPORT_CHUNK_SIZE))
+    return itertools.chain(*queries)
+
+# Genera l'esportazione in formato NDJSON: una prenotazione per riga, con la lista delle sue stanze
+def generate_bookings_ndjson(rows):
+    lines = []
+    current = None
+    for booking_id, property_code, user_id, check_in, check_out, guests, status, created_at, total_price, number, room_type, base_price, encoded in rows:
+        if current is None or current["booking_id"] != booking_id:
+            if current is not None:
+                lines.append(current_app.json.dumps(current))
+                # Invia le righe a blocchi, invece di una scrittura per prenotazione
+                if len(lines) >= EXPORT_CHUNK_SIZE:
+                    yield "\n".join(lines) + "\n"
+                    lines = []
+            current = {
+                "booking_id": booking_id,
+                "property": property_code,
+                "user_id": user_id,
+                "check_in": check_in.strftime('%Y%m%d'),
+                "check_out": check_out.strftime('%Y%m%d'),
+                "guests": guests,
+                "status": status,
+                "created_at": created_at.isoformat(),
+                "total_price": total_price,
+                "rooms": []
+            }
+        nightly_prices = decode_nightly_prices(encoded, base_price, check_in, check_out)
+        current["rooms"].append({
+            "room_number": number, "room_type": room_type, "price": stay_total([nightly_prices]), "nightly_prices": nightly_prices
+        })
+    if current is not None:
+        lines.append(current_app.json.dumps(current))
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+# Genera l'esportazione in formato CSV: una riga per ogni stanza di una prenotazione
+def generate_bookings_csv(rows):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(BOOKING_CSV_COLUMNS)
+    for count, row in enumerate(rows, 1):
+        booking_id, property_code, user_id, check_in, check_out, guests, status, created_at, total_price, number, room_type, base_price, encoded = row
+        nightly_prices = decode_nightly_prices(encoded, base_price, check_in, check_out)
+        writer.writerow([
+            booking_id, property_code, user_id, check_in.strftime('%Y%m%d'), check_out.strftime('%Y%m%d'), guests, status,
+            created_at.isoformat(), total_price, number, room_type, stay_total([nightly_prices]), encode_nightly_prices(nightly_prices)
+        ])
+        if count % EXPORT_CHUNK_SIZE == 0:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate(0)
+    yield output.getvalue()
+
+# Legge in streaming le prenotazioni da importare e restituisce coppie (numero di riga, prenotazione).
+# Nel CSV le righe consecutive con lo stesso booking_id formano un'unica prenotazione con più stanze.
+def read_import_records(stream, file_format):
+    text = io.TextIOWrapper(stream, encoding='utf-8')
+    if file_format == 'csv':
+        reader = csv.DictReader(text)
+        current, current_key, current_line = None, None, None
+        for row in reader:
+            key = row.get('booking_id') or f"riga-{reader.line_num}"
+            room = {"room_number": row.get('room_number'), "nightly_prices": row.get('nightly_prices')}
+            if current is not None and key == current_key:
+                current["rooms"].append(room)
+                continue
+            if current is not None:
+                yield current_line, current
+            current = {**row, "rooms": [room]}
+            current_key, current_line = key, reader.line_num
+        if current is not None:
+            yield current_line, current
+    else:
+        for line_number, line in enumerate(text, 1):
+            if not line.strip():
+                continue
+            try:
+                yield line_number, current_app.json.loads(line)
+            except ValueError:
+                yield line_number, None
+
+# Prezzi per notte di una stanza da importare, come lista o come valori separati da virgole; None se mancano
+def parse_nightly_prices(value, nights):
+    if value in (None, '', []):
+        return None
+    prices = [round(float(price), 2) for price in (value.split(',') if isinstance(value, str) else value)]
+    if len(prices) != nights:
+        raise ValueError("Il numero di prezzi per notte non corrisponde alla durata del soggiorno.")
+    if not all(price >= 0 for price in prices):
+        raise ValueError("I prezzi per notte non possono essere negativi.")
+    return prices
+
+# Valida e converte una prenotazione da importare; le stanze sono indicate dal numero di stanza all'interno della struttura
+# (campo property, facoltativo: senza di esso si usa la struttura predefinita)
+def parse_import_record(record, rooms_by_number):
+    if not isinstance(record, dict):
+        raise ValueError("Riga non valida")
+    user_id = record.get('user_id')
+    check_in = record.get('check_in')
+    check_out = record.get('check_out')
+    guests = record.get('guests')
+    room_records = [room if isinstance(room, dict) else {"room_number": room} for room in record.get('rooms') or []]
+    room_numbers = [room.get('room_number') for room in room_records]
+
+    if not user_id or not check_in or not check_out or not guests or not room_numbers:
+        raise ValueError("Dati mancanti")
+
+    check_in_date = datetime.strptime(str(check_in), '%Y%m%d').date()
+    check_out_date = datetime.strptime(str(check_out), '%Y%m%d').date()
+    if check_out_date <= check_in_date:
+        raise ValueError("La data di check-out deve essere successiva alla data di check-in.")
+    guests = int(guests)
+    if guests <= 0:
+        raise ValueError("Il numero di ospiti deve essere positivo.")
+
+    status = record.get('status') or 'confirmed'
+    if status not in ('confirmed', 'canceled'):
+        raise ValueError(f"Stato non valido: {status}")
+
+    property_id = resolve_property_id(record.get('property'))
+    rooms = []
+    for number in room_numbers:
+        room = rooms_by_number.get((property_id, str(number)))
+        if room is None:
+            raise ValueError(f"Stanza {number} inesistente")
+        if room in rooms:
+            raise ValueError(f"Stanza {number} indicata più volte")
+        rooms.append(room)
+
+    # Prezzi addebitati: quelli per notte delle stanze se presenti per tutte, altrimenti il totale della prenotazione
+    # ripartito secondo le tariffe in vigore; senza nessuno dei due il soggiorno è prezzato con le tariffe in vigore
+    nights = (check_out_date - check_in_date).days
+    nightly_prices = [parse_nightly_prices(room.get('nightly_prices'), nights) for room in room_records]
+    if all(room_prices is not None for room_prices in nightly_prices):
+        prices = nightly_prices
+    else:
+        total_price = record.get('total_price')
+        total_price = float(total_price) if total_price not in (None, '') else None
+        if total_price is not None and not total_price >= 0:
+            raise ValueError("Il prezzo totale non può essere negativo.")
+        prices = charged_nightly_prices(rooms, check_in_date, check_out_date, total_price)
+
+    parsed = {
+        "user_id": user_id, "property_id": property_id, "check_in": check_in_date, "check_out": check_out_date,
+        "guests": guests, "status": status, "rooms": rooms, "prices": prices
+    }
+    if record.get('created_at'):
+        parsed["created_at"] = datetime.fromisoformat(record['created_at'])
+    return parsed
+
+# Valida in blocco un lotto di prenotazioni da importare: gli utenti vengono verificati con una sola query
+# e la disponibilità delle stanze con l'indice di occupazione in memoria, considerando anche le altre prenotazioni del lotto.
+def validate_import_batch(batch):
+    rooms_by_number = {(room.property_id, room.number): room for room in room_catalog.all()}
+    parsed, errors = [], []
+    for line_number, record in batch:
+        try:
+            parsed.append((line_number, parse_import_record(record, rooms_by_number)))
+        except ValueError as e:
+            errors.append({"line": line_number, "error": str(e)})
+
+    user_ids = {record["user_id"] for _, record in parsed}
+    existing_users = {user_id for (user_id,) in db.session.query(User.id).filter(User.id.in_(user_ids))}
+
+    occupancy_index.ensure_loaded()
+    busy = defaultdict(list)
+    accepted = []
+    for line_number, record in parsed:
+        if record["user_id"] not in existing_users:
+            errors.append({"line": line_number, "error": "Utente non trovato"})
+            continue
+        if record["status"] == 'confirmed':
+            check_in, check_out = record["check_in"], record["check_out"]
+            occupied = [
+                room.number for room in record["rooms"]
+                if not occupancy_index.is_room_free(room.id, check_in, check_out)
+                or any(busy_check_in < check_out and busy_check_out > check_in for busy_check_in, busy_check_out in busy[room.id])
+            ]
+            if occupied:
+                errors.append({"line": line_number, "error": f"Stanze già occupate nel periodo richiesto: {', '.join(occupied)}"})
+                continue
+            for room in record["rooms"]:
+                busy[room.id].append((check_in, check_out))
+        accepted.append(record)
+    return accepted, sorted(errors, key=lambda error: error["line"])
+
+# Salva un lotto di prenotazioni in un'unica transazione con inserimenti in blocco.
+# In caso di conflitto con una prenotazione concorrente le occupazioni vengono rilette e il lotto viene rivalidato.
+def import_bookings_batch(batch):
+    for attempt in range(1, BOOKING_MAX_ATTEMPTS + 1):
+        accepted, errors = validate_import_batch(batch)
+        if not accepted:
+            return [], errors
+
+        try:
+            bookings = []
+            for record in accepted:
+                fields = {key: record[key] for key in ("user_id", "property_id", "check_in", "check_out", "guests", "status", "created_at") if key in record}
+                fields["total_price"] = stay_total(record["prices"])
+                bookings.append(Booking(**fields))
+            db.session.add_all(bookings)
+            db.session.flush()
+
+            db.session.execute(insert(BookingRooms), [
+                {"booking_id": booking.id, "room_id": room.id, "nightly_prices": encode_nightly_prices(room_prices)}
+                for booking, record in zip(bookings, accepted) for room, room_prices in zip(record["rooms"], record["prices"])
+            ])
+            room_nights = [
+                {"room_id": room.id, "night": night, "booking_id": booking.id}
+                for booking, record in zip(bookings, accepted) if record["status"] == 'confirmed'
+                for night in stay_nights(record["check_in"], record["check_out"]) for room in record["rooms"]
+            ]
+            if room_nights:
+                db.session.execute(insert(RoomNight), room_nights)
+            update_daily_occupancy(added=[
+                (booking.check_in, booking.check_out, record["rooms"], record["prices"])
+                for booking, record in zip(bookings, accepted) if record["status"] == 'confirmed'
+            ])
+            User.query.filter(User.id.in_({record["user_id"] for record in accepted})).update(
+                {User.bookings_version: User.bookings_version + 1}, synchronize_session=False
+            )
+            db.session.commit()
+            break
+        except IntegrityError:
+            db.session.rollback()
+            occupancy_index.reload_rooms({room.id for record in accepted for room in record["rooms"]})
+            if attempt == BOOKING_MAX_ATTEMPTS:
+                raise ValueError("Le stanze del lotto sono state prenotate da altri utenti, riprovare.")
+
+    # Aggiorna l'indice di occupazione con le prenotazioni confermate importate
+    for booking, record in zip(bookings, accepted):
+        if record["status"] == 'confirmed':
+            occupancy_index.add_booking(booking.id, booking.check_in, booking.check_out, [room.id for room in record["rooms"]])
+    return bookings, errors
+
+# Importa le prenotazioni leggendo il corpo della richiesta in streaming, a lotti di IMPORT_BATCH_SIZE.
+# Le prenotazioni non valide o in conflitto vengono scartate e segnalate con il numero di riga.
+def import_bookings(stream, file_format):
+    try:
+        imported, rejected, errors, batch = 0, 0, [], []
+
+        def flush_batch():
+            nonlocal imported, rejected
+            bookings, batch_errors = import_bookings_batch(batch)
+            imported += len(bookings)
+            rejected += len(batch_errors)
+            errors.extend(batch_errors[:IMPORT_MAX_REPORTED_ERRORS - len(errors)])
+            batch.clear()
+
+        for item in read_import_records(stream, file_format):
+            batch.append(item)
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                flush_batch()
+        if batch:
+            flush_batch()
+
+        return {"imported": imported, "rejected": rejected, "errors": errors}
+    except ValueError:
+        db.session.rollback()
+        raise
+    except Exception as e:
+        # Gestisce eventuali errori durante l'importazione
+        db.session.rollback()
+        raise Exception(f"Errore durante l'importazione delle prenotazioni: {e}")
+
+
 ####################################################
 # Endpoints
 ####################################################
 # Endpoint per la registrazione di un nuovo utente
-@app.route('/register', methods=['POST'])
+@bp.route('/register', methods=['POST'])
 def register():
     data = request.get_json()
     firstname = data.get('firstName')
@@ -591,15 +3508,18 @@ def register():
     if User.query.filter_by(email=email).first():
         return jsonify({"error": "Email già in uso"}), 400
 
-    # Crea una password hashata
-    hashed_password = generate_password_hash(password, method='pbkdf2:sha256')
+    # Crea una password hashata nel pool di hashing
+    try:
+        hashed_password = password_hasher.hash(password)
+    except HashingOverloaded as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": str(PASSWORD_HASH_RETRY_AFTER)}
     new_user = User(username=username, password=hashed_password, email=email, first_name=firstname, surname=surname)
     try:
         # Aggiunge il nuovo utente al database
         db.session.add(new_user)
         db.session.commit()
         # Crea un token di accesso per l'utente registrato
-        access_token = create_access_token(identity=new_user.id)
+        access_token = create_access_token(identity=new_user.id, additional_claims=user_claims(new_user))
         return jsonify({"message": "Utente registrato con successo.", "access_token": access_token, "firstName": new_user.first_name, "surname": new_user.surname}), 201
     except Exception as e:
         # Gestisce eventuali errori durante la registrazione
@@ -609,11 +3529,13 @@ def register():
         db.session.close()
 
 # Endpoint per il login di un utente
-@app.route('/login', methods=['POST'])
+@bp.route('/login', methods=['POST'])
 def login():
     data = request.get_json()
     identifier = data.get('identifier')  # Può essere l'username o l'email
     password = data.get('password')
+    # Se False, la risposta contiene solo token e profilo: le prenotazioni si recuperano in seguito da /user_bookings
+    include_bookings = data.get('include_bookings', True)
 
     # Verifica che i dati richiesti siano presenti
     if not identifier or not password:
@@ -621,24 +3543,40 @@ def login():
 
     # Cerca l'utente nel database usando username o email
     user = User.query.filter((User.username == identifier) | (User.email == identifier)).first()
-    if user and check_password_hash(user.password, password):
+    try:
+        password_valid = bool(user) and password_hasher.verify(user.password, password)
+    except HashingOverloaded as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": str(PASSWORD_HASH_RETRY_AFTER)}
+
+    if password_valid:
+        # Se l'hash è stato calcolato con parametri diversi da quelli configurati, lo aggiorna ora che la password è nota
+        if password_hasher.needs_rehash(user.password):
+            try:
+                user.password = password_hasher.hash(password)
+                db.session.commit()
+            except Exception:
+                # L'aggiornamento dell'hash non deve impedire il login: verrà ritentato al prossimo accesso
+                db.session.rollback()
+
         # Crea un token di accesso per l'utente autenticato
-        access_token = create_access_token(identity=user.id, expires_delta=timedelta(days=1))
-        try:
-            # Recupera le prenotazioni dell'utente
-            bookings_list = get_user_bookings(user.id)
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
-        return jsonify({
+        access_token = create_access_token(identity=user.id, additional_claims=user_claims(user), expires_delta=timedelta(days=1))
+        response = {
             "access_token": access_token,
             "firstName": user.first_name,
-            "surname": user.surname,
-            "bookings": bookings_list
-        }), 200
+            "surname": user.surname
+        }
+        if include_bookings:
+            try:
+                # Recupera le prenotazioni dell'utente
+                response["bookings"] = get_user_bookings(user.id)
+            except Exception as e:
+                return jsonify({"error": str(e)}), 500
+        return jsonify(response), 200
     return jsonify({"error": "Credenziali errate."}), 401
 
 # Endpoint per ottenere suggerimenti sulle stanze e le stanze disponibili
-@app.route('/rooms_per_type_and_suggestion', methods=['POST'])
+@bp.route('/rooms_per_type_and_suggestion', methods=['POST'])
+@admission_control('search')
 def rooms_per_type_and_suggestion():
     data = request.get_json()
     check_in = data.get('check_in')
@@ -646,14 +3584,20 @@ def rooms_per_type_and_suggestion():
     guests = data.get('guests')
     rooms_requested = data.get('rooms')
     old_booking_id = data.get('old_booking_id')
+    property_code = data.get('property')  # Codice della struttura, facoltativo
+    mode = data.get('mode', 'full')  # 'full' (default) o 'summary'
+    fields = data.get('fields')  # Campi della risposta da restituire, facoltativo
 
     # Verifica che i dati richiesti siano presenti
     if not check_in or not check_out or not guests or not rooms_requested:
         return jsonify({"error": "Dati mancanti"}), 400
 
     try:
-        # Ottiene i suggerimenti sulle stanze
-        room_suggestions = get_room_suggestions(check_in, check_out, guests, rooms_requested, old_booking_id)
+        # Ottiene i suggerimenti sulle stanze, dalla cache se la stessa ricerca è già stata calcolata sull'inventario attuale
+        property_id = resolve_property_id(property_code)
+        room_suggestions = get_cached_room_suggestions(check_in, check_out, guests, rooms_requested, old_booking_id, property_id)
+        # La cache contiene il risultato completo: modalità e campi selezionano solo cosa serializzare
+        room_suggestions = select_suggestion_fields(room_suggestions, mode, fields)
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
     except Exception as e:
@@ -661,19 +3605,108 @@ def rooms_per_type_and_suggestion():
 
     return jsonify(room_suggestions), 200
 
+# Endpoint con le metriche delle richieste e della cache nel formato testuale di Prometheus
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    lines = [request_metrics.render()]
+    for name, value in suggestion_cache.stats().items():
+        if name in ('hits', 'misses', 'evictions', 'invalidations', 'expirations'):
+            lines.append(f"# TYPE hotel_suggestion_cache_{name}_total counter\nhotel_suggestion_cache_{name}_total {value}\n")
+        elif name == 'size':
+            lines.append(f"# TYPE hotel_suggestion_cache_size gauge\nhotel_suggestion_cache_size {value}\n")
+    admission = admission_controller.stats()
+    admission["rate_limited"] = user_rate_limiter.limited + ip_rate_limiter.limited
+    for name, value in admission.items():
+        if name in ('admitted', 'shed', 'rate_limited'):
+            lines.append(f"# TYPE hotel_admission_{name}_total counter\nhotel_admission_{name}_total {value}\n")
+        else:
+            lines.append(f"# TYPE hotel_admission_{name} gauge\nhotel_admission_{name} {value}\n")
+    return current_app.response_class("".join(lines), content_type="text/plain; version=0.0.4; charset=utf-8"), 200
+
+# Endpoint per consultare i contatori della cache delle ricerche
+@bp.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    return jsonify({"rooms_per_type_and_suggestion": suggestion_cache.stats()}), 200
+
+# Endpoint per ottenere il calendario delle stanze libere per tipo, notte per notte (fino a un anno)
+@bp.route('/availability_calendar', methods=['POST'])
+@admission_control('calendar')
+def availability_calendar():
+    data = request.get_json()
+    start_date = data.get('start_date')
+    end_date = data.get('end_date')
+    property_code = data.get('property')  # Codice della struttura, facoltativo
+
+    # Verifica che i dati richiesti siano presenti
+    if not start_date or not end_date:
+        return jsonify({"error": "Dati mancanti"}), 400
+
+    try:
+        calendar = get_availability_calendar(start_date, end_date, resolve_property_id(property_code))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    return jsonify(calendar), 200
+
+# Endpoint con il report di occupazione e ricavi per notte e tipo di stanza (riservato agli amministratori)
+@bp.route('/occupancy_report', methods=['GET'])
+@admin_required
+def occupancy_report():
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+    property_code = request.args.get('property')  # Codice della struttura, facoltativo
+
+    # Verifica che i dati richiesti siano presenti
+    if not start_date or not end_date:
+        return jsonify({"error": "Dati mancanti"}), 400
+
+    try:
+        report = get_occupancy_report(start_date, end_date, resolve_property_id(property_code))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    return jsonify(report), 200
+
 # Endpoint per ottenere le prenotazioni di un utente
-@app.route('/user_bookings', methods=['GET'])
+@bp.route('/user_bookings', methods=['GET'])
 @jwt_required()
 def user_bookings():
     user_id = get_jwt_identity()
+    # Parametri opzionali di paginazione: senza di essi viene restituito l'intero storico come lista
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor')
+    window = request.args.get('window')
+    paginated = limit is not None or cursor is not None or window is not None
+
     try:
-        bookings = get_user_bookings(user_id)
-        return jsonify(bookings), 200
+        # Se lo storico non è cambiato dall'ultima risposta ricevuta dal client, risponde 304 senza serializzare nulla
+        bookings_version = db.session.query(User.bookings_version).filter_by(id=user_id).scalar()
+        etag = user_bookings_etag(user_id, bookings_version, request.query_string.decode(), window)
+        if request.if_none_match.contains_weak(etag):
+            response = current_app.response_class(status=304)
+            response.set_etag(etag, weak=True)
+            return response
+
+        if paginated:
+            bookings = get_user_bookings_page(user_id, limit, cursor, window)
+        else:
+            bookings = get_user_bookings(user_id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+    response = jsonify(bookings)
+    response.set_etag(etag, weak=True)
+    return response, 200
+
 # Endpoint per creare una prenotazione
-@app.route('/book', methods=['POST'])
+@bp.route('/book', methods=['POST'])
+@admission_control('book', write=True)
 @jwt_required()
 def book():
     data = request.get_json()
@@ -682,6 +3715,7 @@ def book():
     check_out = data.get('check_out')
     guests = data.get('guests')
     room_types = data.get('room_types')  # Array di tipi di stanza
+    property_code = data.get('property')  # Codice della struttura, facoltativo
 
     # Verifica che i dati richiesti siano presenti
     if not check_in or not check_out or not guests or not room_types:
@@ -689,7 +3723,7 @@ def book():
 
     try:
         # Crea la prenotazione
-        booking_details = create_booking(user_id, check_in, check_out, guests, room_types)
+        booking_details = create_booking(user_id, check_in, check_out, guests, room_types, resolve_property_id(property_code))
         
         # Recupera tutte le prenotazioni dell'utente
         user_bookings = get_user_bookings(user_id)
@@ -703,8 +3737,84 @@ def book():
         "user_bookings": user_bookings
     }), 201
 
+# Endpoint per prenotare più soggiorni con una sola richiesta (ad esempio per i tour operator).
+# mode: 'all_or_nothing' (default) salva i soggiorni solo se sono tutti disponibili, 'best_effort' salva quelli disponibili.
+@bp.route('/book_batch', methods=['POST'])
+@admission_control('book_batch', write=True)
+@jwt_required()
+def book_batch():
+    data = request.get_json()
+    user_id = get_jwt_identity()
+    items = data.get('bookings')
+    mode = data.get('mode', 'all_or_nothing')
+    property_code = data.get('property')  # Codice della struttura, facoltativo: vale per tutti i soggiorni del gruppo
+
+    # Verifica che i dati richiesti siano presenti
+    if not items or not isinstance(items, list):
+        return jsonify({"error": "Dati mancanti"}), 400
+    if mode not in ('all_or_nothing', 'best_effort'):
+        return jsonify({"error": "Modalità non valida: usare 'all_or_nothing' o 'best_effort'"}), 400
+
+    try:
+        # Crea le prenotazioni del gruppo
+        result = create_bookings_batch(user_id, items, mode == 'all_or_nothing', resolve_property_id(property_code))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    # Se nessun soggiorno è stato prenotato la richiesta è fallita, con l'esito di ciascun soggiorno
+    return jsonify(result), 201 if result["booked"] else 400
+
+# Endpoint per esportare tutte le prenotazioni in streaming (riservato agli amministratori).
+# format: 'ndjson' (default) o 'csv'; status e property: filtri facoltativi sullo stato e sulla struttura delle prenotazioni.
+@bp.route('/export_bookings', methods=['GET'])
+@admin_required
+def export_bookings():
+    file_format = request.args.get('format', 'ndjson')
+    status = request.args.get('status')
+    property_code = request.args.get('property')
+
+    if file_format not in ('ndjson', 'csv'):
+        return jsonify({"error": "Formato non valido: usare 'ndjson' o 'csv'"}), 400
+
+    try:
+        property_id = resolve_property_id(property_code) if property_code else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    rows = export_bookings_rows(status, property_id)
+    if file_format == 'csv':
+        body, mimetype = generate_bookings_csv(rows), 'text/csv'
+    else:
+        body, mimetype = generate_bookings_ndjson(rows), 'application/x-ndjson'
+    return Response(stream_with_context(body), mimetype=mimetype, headers={
+        "Content-Disposition": f"attachment; filename=bookings.{file_format}"
+    })
+
+# Endpoint per importare prenotazioni in blocco da NDJSON o CSV (riservato agli amministratori).
+# Il formato si indica con il parametro format o con il Content-Type (text/csv per il CSV).
+@bp.route('/import_bookings', methods=['POST'])
+@admin_required
+def import_bookings_endpoint():
+    file_format = request.args.get('format') or ('csv' if request.mimetype == 'text/csv' else 'ndjson')
+
+    if file_format not in ('ndjson', 'csv'):
+        return jsonify({"error": "Formato non valido: usare 'ndjson' o 'csv'"}), 400
+
+    try:
+        # Importa le prenotazioni
+        result = import_bookings(request.stream, file_format)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    return jsonify(result), 201 if result["imported"] else 400
+
 # Endpoint per cancellare una prenotazione
-@app.route('/cancel_booking', methods=['POST'])
+@bp.route('/cancel_booking', methods=['POST'])
+@admission_control('cancel_booking', write=True)
 @jwt_required()
 def cancel_booking():
     data = request.get_json()
@@ -717,7 +3827,7 @@ def cancel_booking():
 
     try:
         # Cancella la prenotazione
-        booking_details = cancel_booking_by_id(booking_id, user_id)
+        booking_details = cancel_booking_by_id(booking_id, user_id, is_admin())
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
 
@@ -726,7 +3836,8 @@ def cancel_booking():
     }), 200
 
 # Endpoint per modificare una prenotazione
-@app.route('/modify_booking', methods=['POST'])
+@bp.route('/modify_booking', methods=['POST'])
+@admission_control('modify_booking', write=True)
 @jwt_required()
 def modify_booking_endpoint():
     data = request.get_json()
@@ -743,7 +3854,7 @@ def modify_booking_endpoint():
 
     try:
         # Modifica la prenotazione
-        new_booking_details = modify_booking(booking_id, user_id, new_check_in, new_check_out, new_guests, new_room_types)
+        new_booking_details = modify_booking(booking_id, user_id, new_check_in, new_check_out, new_guests, new_room_types, is_admin())
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
     except Exception as e:
@@ -752,24 +3863,265 @@ def modify_booking_endpoint():
     return jsonify(new_booking_details), 201
 
 
+####################################################
+# Comandi di amministrazione (CLI)
+####################################################
+# Query più frequenti dell'applicazione, di cui si verifica il piano di esecuzione.
+# Ogni voce associa una descrizione alla query SQLAlchemy corrispondente, con parametri di esempio.
+def hot_queries():
+    sample_date = datetime(2030, 1, 1).date()
+    return [
+        ("Prenotazioni sovrapposte a un intervallo di date", db.session.query(Booking.id).filter(
+            and_(
+                Booking.check_in < sample_date,
+                Booking.check_out > sample_date,
+                Booking.status != 'canceled'
+            )
+        )),
+        ("Storico prenotazioni di un utente", user_bookings_query('user-id')),
+        ("Prenotazioni modificate di recente", db.session.query(Booking.id, BookingRooms.room_id).join(
+            BookingRooms, BookingRooms.booking_id == Booking.id
+        ).filter(Booking.updated_at >= sample_date)),
+        ("Pagina dello storico di un utente (keyset)", db.session.query(Booking.id, Booking.created_at).filter(
+            Booking.user_id == 'user-id', Booking.status != 'canceled',
+            or_(Booking.created_at < datetime(2030, 1, 1), and_(Booking.created_at == datetime(2030, 1, 1), Booking.id < 1))
+        ).order_by(Booking.created_at.desc(), Booking.id.desc()).limit(21)),
+        ("Stanze di una prenotazione", db.session.query(BookingRooms.room_id).filter(BookingRooms.booking_id == 1)),
+        ("Prenotazioni di una stanza", db.session.query(BookingRooms.booking_id).filter(BookingRooms.room_id == 1)),
+        ("Storico archiviato di un utente", user_bookings_query('user-id', ArchivedBooking, ArchivedBookingRooms)),
+        ("Prenotazioni archiviate di recente", db.session.query(ArchivedBooking.id).filter(ArchivedBooking.archived_at >= sample_date)),
+        *[(f"Prenotazioni da archiviare ({kind})", query.filter(position >= sample_date).order_by(position).limit(ARCHIVE_BATCH_SIZE))
+          for kind, (query, position) in zip(('concluse', 'cancellate'), archivable_bookings_queries(sample_date))],
+    ]
+
+# Tabelle su cui una scansione completa nelle query frequenti è considerata un errore
+INDEXED_TABLES = ('booking', 'booking_rooms', 'archived_booking', 'archived_booking_rooms')
+
+# Esegue EXPLAIN QUERY PLAN sulle query frequenti e restituisce la lista dei problemi trovati (scansioni complete)
+def check_query_plans():
+    if db.engine.dialect.name != 'sqlite':
+        raise ValueError("La verifica dei piani di esecuzione è disponibile solo per SQLite.")
+
+    problems = []
+    connection = db.session.connection()
+    for description, query in hot_queries():
+        compiled = query.statement.compile(dialect=db.engine.dialect)
+        parameters = tuple(compiled.params[name] for name in compiled.positiontup)
+        plan = [row[-1] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", parameters)]
+        for step in plan:
+            # SQLite indica con "SCAN <tabella>" la lettura completa di una tabella (o di un suo indice)
+            words = step.split()
+            if len(words) >= 2 and words[0] == 'SCAN' and words[1] in INDEXED_TABLES:
+                problems.append(f"{description}: {step}")
+        print(f"{description}:")
+        for step in plan:
+            print(f"    {step}")
+    return problems
+
+# Comando per aggiornare lo schema di un database esistente: flask --app flask_app db-upgrade
+@bp.cli.command('db-upgrade')
+def db_upgrade_command():
+    db.create_all()
+    run_migrations()
+    print("Schema del database aggiornato.")
+
+# Comando per aggiungere una struttura con le sue stanze: flask --app flask_app seed-property CODICE "Nome" --standard 10 --superior 5 --suite 2
+# Le quantità non indicate vengono lette dal file .env, come per la struttura predefinita.
+@bp.cli.command('seed-property')
+@click.argument('code')
+@click.argument('name')
+@click.option('--standard', type=int, help="Numero di stanze standard")
+@click.option('--superior', type=int, help="Numero di stanze superior")
+@click.option('--suite', type=int, help="Numero di suite")
+def seed_property_command(code, name, standard, superior, suite):
+    new_property = Property.query.filter_by(code=code).first()
+    if new_property is None:
+        try:
+            new_property = Property(code=code, name=name)
+            db.session.add(new_property)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            raise Exception(f"Errore durante la creazione della struttura: {e}")
+        print(f"Struttura {code} creata.")
+    quantities = {room_type: quantity for room_type, quantity in (('standard', standard), ('superior', superior), ('suite', suite)) if quantity is not None}
+    create_rooms(new_property.id, quantities)
+
+# Comando per ricostruire da zero il riepilogo giornaliero di occupazione e ricavi: flask --app flask_app rebuild-rollups
+@bp.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    try:
+        rebuild_daily_occupancy()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        raise Exception(f"Errore durante la ricostruzione dei riepiloghi: {e}")
+    print(f"Riepilogo giornaliero ricostruito: {DailyOccupancy.query.count()} righe.")
+
+# Comando per aggiungere una tariffa per notte a un tipo di stanza:
+# flask --app flask_app set-rate superior 20300701 20300901 180 [--property CODICE] [--weekdays 4,5]
+# Le date sono nel formato YYYYMMDD e la data di fine è esclusa; --weekdays limita la tariffa ad alcuni giorni della settimana (0 = lunedì).
+@bp.cli.command('set-rate')
+@click.argument('room_type')
+@click.argument('start_date')
+@click.argument('end_date')
+@click.argument('price', type=float)
+@click.option('--property', 'property_code', help="Codice della struttura (default: quella predefinita)")
+@click.option('--weekdays', help="Giorni della settimana separati da virgola, da 0 (lunedì) a 6 (domenica)")
+def set_rate_command(room_type, start_date, end_date, price, property_code, weekdays):
+    try:
+        rate = add_room_rate(room_type, start_date, end_date, price, property_code, weekdays)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    print(f"Tariffa {rate.id} aggiunta: {room_type} a {price:.2f} per notte dal {rate.start_date} al {rate.end_date} (esclusa).")
+
+# Comando per archiviare le prenotazioni concluse o cancellate: flask --app flask_app archive-bookings [--batch-size 1000]
+# Pensato per essere eseguito periodicamente (ad esempio ogni notte con cron) mentre l'applicazione è in servizio.
+@bp.cli.command('archive-bookings')
+@click.option('--batch-size', type=int, help="Numero di prenotazioni archiviate per transazione")
+def archive_bookings_command(batch_size):
+    archived = archive_bookings(batch_size=batch_size)
+    print(f"Prenotazioni archiviate: {archived}.")
+
+# Comando che fallisce se una query frequente ricorre a una scansione completa: flask --app flask_app check-query-plans
+@bp.cli.command('check-query-plans')
+def check_query_plans_command():
+    problems = check_query_plans()
+    if problems:
+        for problem in problems:
+            print(f"Scansione completa: {problem}")
+        raise SystemExit(1)
+    print("Tutte le query frequenti usano un indice.")
+
+
+####################################################
+# Serializzazione JSON
+####################################################
+# Serializzatore JSON basato su orjson: produce lo stesso JSON del serializzatore predefinito di Flask (chiavi ordinate,
+# date e dataclass convertite dalla stessa funzione default) ma codifica le risposte molto più velocemente, scrivendo
+# direttamente i byte della risposta. Con opzioni non supportate da orjson (ad esempio indent) usa il serializzatore predefinito.
+class OrjsonProvider(DefaultJSONProvider):
+    # Date, dataclass e sottoclassi dei tipi base vengono passate a default, come fa il serializzatore predefinito
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS if orjson else 0
+
+    def _dumps_bytes(self, obj, option=0):
+        return orjson.dumps(obj, default=self.default, option=self.options | option | (orjson.OPT_SORT_KEYS if self.sort_keys else 0))
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return self._dumps_bytes(obj).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # In modalità debug (o con compact False) le risposte sono indentate: le produce il serializzatore predefinito
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._dumps_bytes(obj, orjson.OPT_APPEND_NEWLINE), mimetype=self.mimetype)
+
+# Serializzatori JSON disponibili, selezionabili con JSON_PROVIDER nel file .env
+JSON_PROVIDERS = {'json': DefaultJSONProvider}
+if orjson is not None:
+    JSON_PROVIDERS['orjson'] = OrjsonProvider
+
+
+####################################################
+# Creazione dell'applicazione
+####################################################
+# Crea e configura l'applicazione. config sovrascrive la configurazione letta dal file .env
+# (ad esempio {'SQLALCHEMY_DATABASE_URI': 'sqlite://'} per un database in memoria).
+# Gli indici, il catalogo e le cache in memoria sono condivisi dal processo: si usa un'applicazione per processo.
+def create_app(config=None):
+    check_required_env_vars()
+
+    app = Flask(__name__)
+
+    # Abilito CORS
+    CORS(app)
+
+    app.config.update(default_config())
+    if config:
+        app.config.update(config)
+
+    # Serializzatore JSON delle richieste e delle risposte
+    provider_class = JSON_PROVIDERS.get(app.config['JSON_PROVIDER'])
+    if provider_class is None:
+        raise ValueError(f"JSON_PROVIDER non valido: {app.config['JSON_PROVIDER']} (valori ammessi: {', '.join(JSON_PROVIDERS)})")
+    app.json = provider_class(app)
+
+    # Dietro uno o più proxy fidati indirizzo e protocollo del client vengono letti dagli header X-Forwarded-*
+    if app.config['TRUSTED_PROXY_HOPS']:
+        hops = app.config['TRUSTED_PROXY_HOPS']
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops)
+
+    db.init_app(app)
+    jwt.init_app(app)
+    init_app_state(app)
+    app.register_blueprint(bp)
+    return app
+
+# Fase di inizializzazione, da eseguire una sola volta prima di servire le richieste:
+# con gunicorn e preload_app viene eseguita nel processo principale prima del fork, così i worker ereditano
+# lo schema aggiornato, le stanze e il catalogo e l'indice di occupazione già caricati in memoria.
+def initialize(app):
+    with app.app_context():
+        # Crea il database o le tabelle mancanti, poi aggiorna in loco lo schema con le migrazioni non ancora applicate
+        db.create_all()
+        run_migrations()
+
+        # Aggiunge le stanze se non sono già presenti
+        create_rooms()
+
+        # Carica il catalogo delle stanze, il calendario delle tariffe e l'indice di occupazione prima di servire le richieste
+        suggestion_cache.clear()
+        room_catalog.load()
+        rate_calendar.load()
+        occupancy_index.load()
+        db.session.remove()
+
+    # Chiude le connessioni aperte durante l'inizializzazione, perché non vanno condivise con i processi figli
+    dispose_engines(app, close=True)
+
+# Scarta le connessioni del pool: dopo un fork il processo figlio non deve riusare quelle del processo principale.
+# Con close=False le connessioni ereditate vengono abbandonate senza chiuderle, così il processo principale non ne risente.
+def dispose_engines(app, close=False):
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=close)
+
+# L'applicazione viene creata al primo accesso all'attributo app del modulo (ad esempio da gunicorn flask_app:app
+# o da flask --app flask_app): importare il modulo non richiede le variabili d'ambiente e non apre il database.
+app_lock = threading.Lock()
+
+def __getattr__(name):
+    if name == 'app':
+        with app_lock:
+            if 'app' not in globals():
+                globals()['app'] = create_app()
+        return globals()['app']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 ####################################################
 # Inizializzazione dell'applicazione
 ####################################################
 if __name__ == '__main__':
-    # Crea un contesto dell'applicazione
-    with app.app_context():
-        # Definisce il percorso del database
-        db_path = os.path.join(app.instance_path, 'hotel.db')
-        
-        # Verifica se il database esiste
-        if not os.path.exists(db_path):
-            # Se il database non esiste, lo crea e aggiunge le stanze
-            db.create_all()
-            create_rooms()
-        else:
-            # Se il database esiste già, stampa un messaggio e aggiunge le stanze
-            print("Il database esiste già.")
-            create_rooms()
+    app = create_app()
+
+    # Definisce il percorso del database
+    db_path = os.path.join(app.instance_path, 'hotel.db')
+
+    # Verifica se il database esiste
+    if os.path.exists(db_path):
+        print("Il database esiste già.")
+
+    # Schema, stanze e dati in memoria vengono preparati prima di servire le richieste
+    initialize(app)
 
 # Necessario per deploy su pythonanywhere
     if 'liveconsole' not in gethostname():
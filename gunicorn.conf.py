@@ -0,0 +1,25 @@
+# Configurazione di gunicorn per servire l'applicazione con più processi worker:
+#   gunicorn -c gunicorn.conf.py
+# L'applicazione viene creata e inizializzata una sola volta nel processo principale (preload_app),
+# poi i worker vengono creati con un fork e ne ereditano lo stato già pronto in memoria.
+import multiprocessing
+import os
+
+wsgi_app = 'flask_app:app'
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+# I limiti di default del controllo di ammissione dell'applicazione sono ricavati dallo stesso GUNICORN_THREADS
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+preload_app = True
+
+
+# Nel processo principale, prima della creazione dei worker: schema, stanze, catalogo e indice di occupazione
+def on_starting(server):
+    import flask_app
+    flask_app.initialize(flask_app.app)
+
+
+# In ogni worker, subito dopo il fork: le connessioni al database del processo principale non vanno riusate
+def post_fork(server, worker):
+    import flask_app
+    flask_app.dispose_engines(flask_app.app)
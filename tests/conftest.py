@@ -0,0 +1,55 @@
+# Configurazione condivisa dai test.
+# Ogni test lavora su un'applicazione con un database SQLite temporaneo e isolato, così non tocca mai hotel.db.
+# Le variabili d'ambiente vanno impostate prima di importare flask_app, che le legge all'importazione.
+import os
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Valori di default per le variabili d'ambiente richieste dall'applicazione
+DEFAULT_ENV = {
+    'ROOM_STANDARD_PRICE': '100.0',
+    'ROOM_SUPERIOR_PRICE': '150.0',
+    'ROOM_SUITE_PRICE': '250.0',
+    'ROOM_STANDARD_CAPACITY': '2',
+    'ROOM_SUPERIOR_CAPACITY': '3',
+    'ROOM_SUITE_CAPACITY': '4',
+    'ROOM_STANDARD_QUANTITY': '10',
+    'ROOM_SUPERIOR_QUANTITY': '15',
+    'ROOM_SUITE_QUANTITY': '5',
+    'JWT_SECRET_KEY': 'test-secret-key-test-secret-key-test',
+    'ADMISSION_CONTROL': 'False',
+}
+
+for key, value in DEFAULT_ENV.items():
+    os.environ.setdefault(key, value)
+
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import flask_app as fa
+
+
+# Applicazione inizializzata come all'avvio del server (schema con tutte le migrazioni, stanze, catalogo, tariffe e indice)
+# su un file SQLite temporaneo: un file, e non un database in memoria, perché i test concorrenti aprono più connessioni
+@pytest.fixture
+def app(tmp_path):
+    app = fa.create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'hotel.db'}"})
+    fa.initialize(app)
+    yield app
+    fa.dispose_engines(app, close=True)
+
+
+# Crea un utente direttamente nel database e restituisce il suo ID
+@pytest.fixture
+def make_user(app):
+    def make_user(username):
+        with app.app_context():
+            user = fa.User(username=username, email=f'{username}@example.com', password='test',
+                           first_name='Test', surname=username)
+            fa.db.session.add(user)
+            fa.db.session.commit()
+            return user.id
+    return make_user
@@ -0,0 +1,71 @@
+# Prenotazioni concorrenti: più thread prenotano in parallelo le stesse date e nessuna stanza
+# deve risultare assegnata a due prenotazioni confermate che si sovrappongono.
+import random
+import threading
+from datetime import date, timedelta
+
+import flask_app as fa
+
+THREADS = 8
+REQUESTS_PER_THREAD = 15
+# Finestra di date ristretta per forzare la contesa sulle stesse stanze
+WINDOW_START = date(2030, 3, 1)
+WINDOW_DAYS = 10
+
+
+def book_randomly(app, user_id, seed, results, errors):
+    rng = random.Random(seed)
+    with app.app_context():
+        try:
+            for _ in range(REQUESTS_PER_THREAD):
+                check_in = WINDOW_START + timedelta(days=rng.randrange(WINDOW_DAYS))
+                check_out = check_in + timedelta(days=rng.randint(1, 4))
+                room_types = [rng.choice(['standard', 'superior', 'suite']) for _ in range(rng.randint(1, 2))]
+                try:
+                    fa.create_booking(user_id, check_in.strftime('%Y%m%d'), check_out.strftime('%Y%m%d'), 2, room_types)
+                    results.append(True)
+                except Exception:
+                    # Stanze esaurite per le date richieste o tentativi esauriti
+                    results.append(False)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            fa.db.session.remove()
+
+
+# Conta le coppie di prenotazioni confermate e sovrapposte che condividono una stanza
+def count_double_bookings():
+    first_booking = fa.db.aliased(fa.Booking)
+    second_booking = fa.db.aliased(fa.Booking)
+    first_room = fa.db.aliased(fa.BookingRooms)
+    second_room = fa.db.aliased(fa.BookingRooms)
+    return fa.db.session.query(first_room.id).join(
+        second_room, (second_room.room_id == first_room.room_id) & (second_room.booking_id > first_room.booking_id)
+    ).join(first_booking, first_booking.id == first_room.booking_id
+    ).join(second_booking, second_booking.id == second_room.booking_id
+    ).filter(
+        first_booking.status != 'canceled', second_booking.status != 'canceled',
+        first_booking.check_in < second_booking.check_out, second_booking.check_in < first_booking.check_out
+    ).count()
+
+
+def test_no_double_bookings_under_concurrent_create_booking(app, make_user):
+    user_ids = [make_user(f'concurrent-{i}') for i in range(THREADS)]
+    results, errors = [], []
+    pool = [threading.Thread(target=book_randomly, args=(app, user_ids[i], i, results, errors)) for i in range(THREADS)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+
+    assert not errors
+    assert len(results) == THREADS * REQUESTS_PER_THREAD
+    # La finestra è piccola: una parte delle richieste deve essere rifiutata, altrimenti non c'è stata contesa
+    assert any(results) and not all(results)
+    with app.app_context():
+        assert count_double_bookings() == 0
+        # Ogni notte occupata appartiene a una prenotazione confermata
+        assert fa.RoomNight.query.count() == sum(
+            (booking.check_out - booking.check_in).days * len(booking.rooms)
+            for booking in fa.Booking.query.filter(fa.Booking.status != 'canceled')
+        )
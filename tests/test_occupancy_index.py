@@ -0,0 +1,59 @@
+# Indice di occupazione: dopo una sequenza casuale di prenotazioni, modifiche e cancellazioni, l'indice aggiornato
+# in modo incrementale deve coincidere con un indice costruito da zero leggendo il database.
+import random
+from datetime import date, timedelta
+
+import flask_app as fa
+
+OPERATIONS = 150
+WINDOW_START = date(2030, 5, 1)
+WINDOW_DAYS = 30
+ROOM_TYPES = ['standard', 'superior', 'suite']
+
+
+def random_stay(rng):
+    check_in = WINDOW_START + timedelta(days=rng.randrange(WINDOW_DAYS))
+    check_out = check_in + timedelta(days=rng.randint(1, 6))
+    room_types = [rng.choice(ROOM_TYPES) for _ in range(rng.randint(1, 3))]
+    return check_in.strftime('%Y%m%d'), check_out.strftime('%Y%m%d'), rng.randint(1, 4), room_types
+
+
+# Stato osservabile dell'indice: intervalli occupati nella finestra, stanze di ogni prenotazione e disponibilità per soggiorno
+def snapshot(index, booking_ids, rooms):
+    start, end = WINDOW_START - timedelta(days=1), WINDOW_START + timedelta(days=WINDOW_DAYS + 7)
+    intervals = sorted(index.overlapping_intervals(start, end))
+    booking_rooms = {booking_id: index.booking_room_ids(booking_id) for booking_id in booking_ids}
+    free = [
+        index.is_room_free(room.id, WINDOW_START + timedelta(days=day), WINDOW_START + timedelta(days=day + length))
+        for room in rooms for day in range(0, WINDOW_DAYS, 3) for length in (1, 4)
+    ]
+    return intervals, booking_rooms, free
+
+
+def test_occupancy_index_matches_fresh_load(app, make_user):
+    user_id = make_user('index')
+    rng = random.Random(42)
+    booking_ids = []
+    applied = 0
+    with app.app_context():
+        for _ in range(OPERATIONS):
+            operation = rng.random()
+            try:
+                if operation < 0.5 or not booking_ids:
+                    booking_ids.append(fa.create_booking(user_id, *random_stay(rng))['booking_id'])
+                elif operation < 0.8:
+                    fa.modify_booking(rng.choice(booking_ids), user_id, *random_stay(rng))
+                else:
+                    fa.cancel_booking_by_id(rng.choice(booking_ids), user_id)
+                applied += 1
+            except Exception:
+                # Stanze esaurite, prenotazione già cancellata: l'operazione non cambia il database
+                fa.db.session.rollback()
+
+        # La sequenza deve aver applicato un numero significativo di operazioni
+        assert applied > OPERATIONS // 2
+
+        rooms = fa.room_catalog.all()
+        fresh = fa.OccupancyIndex()
+        fresh.load()
+        assert snapshot(fa.occupancy_index, booking_ids, rooms) == snapshot(fresh, booking_ids, rooms)
@@ -0,0 +1,7 @@
+# Piani di esecuzione: nessuna query frequente deve ricorrere a una scansione completa delle tabelle delle prenotazioni.
+import flask_app as fa
+
+
+def test_hot_queries_use_indexes(app):
+    with app.app_context():
+        assert fa.check_query_plans() == []
@@ -0,0 +1,52 @@
+# Risolutore delle combinazioni di stanze: i risultati della programmazione dinamica devono coincidere
+# con quelli di una ricerca esaustiva su tutti i conteggi possibili per classe.
+import itertools
+import random
+
+import pytest
+
+import flask_app as fa
+
+TOP_K = 4
+
+
+# Enumera tutti i conteggi per classe con esattamente rooms_requested stanze e capacità sufficiente,
+# e restituisce i costi delle top_k combinazioni più economiche
+def brute_force_costs(room_classes, guests, rooms_requested, top_k):
+    costs = []
+    for counts in itertools.product(*(range(available + 1) for _, _, _, available in room_classes)):
+        if sum(counts) != rooms_requested:
+            continue
+        if sum(count * capacity for count, (_, capacity, _, _) in zip(counts, room_classes)) < guests:
+            continue
+        costs.append(sum(count * price for count, (_, _, price, _) in zip(counts, room_classes)))
+    return sorted(costs)[:top_k]
+
+
+def random_room_classes(rng):
+    return tuple(
+        (f'tipo{i}', rng.randint(1, 5), float(rng.randint(1, 40) * 25), rng.randint(0, 4))
+        for i in range(rng.randint(1, 4))
+    )
+
+
+@pytest.mark.parametrize('seed', range(200))
+def test_solve_room_mix_matches_brute_force(seed):
+    rng = random.Random(seed)
+    room_classes = random_room_classes(rng)
+    guests = rng.randint(1, 12)
+    rooms_requested = rng.randint(1, 6)
+
+    solutions = fa.solve_room_mix(room_classes, guests, rooms_requested, TOP_K)
+    expected = brute_force_costs(room_classes, guests, rooms_requested, TOP_K)
+
+    # A parità di costo l'ordine delle combinazioni può differire: si confrontano i costi
+    assert [cost for cost, _ in solutions] == pytest.approx(expected)
+    # Ogni soluzione restituita è valida e il suo costo corrisponde ai conteggi
+    assert len({counts for _, counts in solutions}) == len(solutions)
+    for cost, counts in solutions:
+        assert len(counts) == len(room_classes)
+        assert all(0 <= count <= available for count, (_, _, _, available) in zip(counts, room_classes))
+        assert sum(counts) == rooms_requested
+        assert sum(count * capacity for count, (_, capacity, _, _) in zip(counts, room_classes)) >= guests
+        assert cost == pytest.approx(sum(count * price for count, (_, _, price, _) in zip(counts, room_classes)))